@@ -1,73 +1,149 @@
 # Streamlit app: UI for indexing and chat-based policy Q&A.
 import streamlit as st
-import os
-import json
 import re
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables (API Keys) first!
 # Keep secrets out of code; env-based config matches deployment best practices.
 load_dotenv()
 
+# Only light modules at import time; the index, models and HTTP client load on first use,
+# so the page paints before any of them.
 from src.config import Cfg
-from src.document_processor import DocProc
-from src.vector_engine import VecEng
-from src.bot_logic import RAGBot
+from src.index_job import get_index_job
+from src.chat_store import get_chat_store
+from src.metrics import get_metrics
 
 # 1. Page Configuration
 st.set_page_config(page_title=Cfg.pg_title)
 st.title("BMW Assistant - Ask About BMW Company and Cars")
 
+@st.cache_resource(show_spinner=False)
+def api_client():
+    # One client (and HTTP connection pool) per process; the 1s progress polls reuse it.
+    from src.api_client import ApiClient
+
+    return ApiClient()
+
+def session_id():
+    # Keyed per browser session; ?session=<id> in the URL resumes a conversation after reload.
+    if "session_id" not in st.session_state:
+        sid = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = sid
+        st.session_state["session_id"] = sid
+    return st.session_state["session_id"]
+
 # 2. Sidebar / Admin Panel
 with st.sidebar:
     st.header("Admin Panel")
+    full_rebuild = st.checkbox("Full rebuild", value=False)
+    profile_next = st.checkbox("Profile next answer (cProfile)", value=False)
+    # Sharded index: pick the collections answers come from (and which ones a re-index rebuilds).
+    all_colls = list(dict.fromkeys(list(Cfg.collections) + [Cfg.default_collection])) if Cfg.collections else []
+    sel_colls = st.multiselect("Collections", all_colls, default=all_colls) if all_colls else []
     if st.button("Re-Index Knowledge Base"):
-        with st.spinner("Ingesting Documents..."):
-            dp = DocProc()
-            frags = dp.get_frags()
-            ve = VecEng()
-            if frags:
-                # Admin action rebuilds index to reflect newest policy files.
-                idx = ve.crt_idx(frags)
-                st.session_state["qa"] = RAGBot(idx).get_chn()
-                st.success(f"Indexed {len(frags)} fragments successfully!")
+        # Runs in the background (here or on the API server); answers keep coming from the
+        # live index until the new version is published.
+        try:
+            scope = sel_colls if sel_colls and len(sel_colls) < len(all_colls) else None
+            if Cfg.api_url:
+                started = api_client().reindex(full=full_rebuild, collections=scope)
             else:
-                st.warning("No documents found. Add files to data/raw and retry.")
+                started = get_index_job().start(full_rebuild, scope)
+        except Exception as e:
+            st.error(f"Indexing not started: {e}")
+        else:
+            if not started:
+                st.warning("Re-index already running.")
+            st.session_state["index_polling"] = True
 
     if st.button("Clear Chat History"):
         st.session_state["messages"] = []
-        os.makedirs(os.path.dirname(Cfg.chat_hist_path), exist_ok=True)
-        with open(Cfg.chat_hist_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+        get_chat_store().clear(session_id())
         st.success("Chat history cleared.")
 
+def index_status():
+    try:
+        return api_client().reindex_status() if Cfg.api_url else get_index_job().snapshot()
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+def index_panel():
+    # Polled as a fragment while a build runs, so only this panel reruns each second.
+    job = index_status()
+    status = job.get("status")
+    if status == "running":
+        files, done = job.get("files") or 0, job.get("files_done") or 0
+        st.progress(
+            min(1.0, done / files) if files else 0.0,
+            text=f"Re-indexing ({job.get('phase', '')}): {done}/{files} files, {job.get('chunks', 0)} fragments",
+        )
+        return
+    if st.session_state.pop("index_polling", False):
+        # Build finished: a bot that had no index yet is created on the full rerun; an existing
+        # bot switches to the new version by itself on its next query.
+        if Cfg.api_url or st.session_state.get("qa") is None:
+            st.session_state.pop("qa", None)
+        st.rerun()
+    if status == "done":
+        stats = job.get("stats") or {}
+        dd = stats.get("dedup") or {}
+        st.success(
+            f"Indexed {stats.get('chunks', 0)} fragments from {job.get('files', 0)} files successfully! "
+            f"(embedded {stats.get('added', 0)}, removed {stats.get('removed', 0)}, "
+            f"merged {dd.get('exact', 0) + dd.get('near', 0)} duplicates, "
+            f"{job.get('chunks_per_sec') or 0:.0f} chunks/sec)"
+        )
+    elif status == "error":
+        # The previous index stays live; successful batches are cached for the next attempt.
+        st.error(f"Indexing aborted: {job.get('error')}")
+
+with st.sidebar:
+    st.fragment(run_every=1.0 if st.session_state.get("index_polling") else None)(index_panel)()
+
 # 3. System Initialization (Lazy Loading)
+@st.cache_resource(show_spinner="Loading the knowledge base...")
+def shared_bot():
+    # One bot per process, shared by all sessions: the index is mapped once and the bot
+    # follows new index versions by itself.
+    from src.bot_logic import load_bot
+
+    return load_bot()
+
 def init_sys():
-    ve = VecEng()
-    # Correct: This loads the existing index from disk
-    idx = ve.ld_idx() 
-    if idx:
-        bot = RAGBot(idx)
+    if Cfg.api_url:
+        # Thin client: no index or model in this process, the API server answers.
+        client = api_client()
+        if client.refresh():
+            return client.get_chn()
+        st.sidebar.warning(f"API at {Cfg.api_url} has no index yet. Use 'Re-Index Knowledge Base'.")
+        return client.get_chn()
+    # Loads the existing index (or its collection shards) from disk, once per process.
+    bot = shared_bot()
+    if bot:
         return bot.get_chn()
+    # "No index" is not cached: the next session, or the rerun after a re-index, looks again.
+    shared_bot.clear()
     # Lazy-load warning so the UI stays usable even before indexing.
     st.sidebar.warning("Index not found. Use 'Re-Index Knowledge Base' to initialize.")
     return None
 
 def load_chat_history():
-    if os.path.exists(Cfg.chat_hist_path):
-        try:
-            with open(Cfg.chat_hist_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, list):
-                return [m for m in data if isinstance(m, dict)]
-        except Exception:
-            return []
-    return []
+    # Only the turns the prompt can use are read back, however long the session is.
+    try:
+        return get_chat_store().recent(session_id(), Cfg.hist_max_turns * 2)
+    except Exception as e:
+        print(f"Chat history load error: {str(e)}")
+        return []
 
-def save_chat_history(messages):
-    os.makedirs(os.path.dirname(Cfg.chat_hist_path), exist_ok=True)
-    with open(Cfg.chat_hist_path, "w", encoding="utf-8") as f:
-        json.dump(messages, f)
+def save_chat_message(messages, role, content):
+    # Append one message; the store is never rewritten.
+    messages.append({"role": role, "content": content})
+    try:
+        get_chat_store().append(session_id(), role, content)
+    except Exception as e:
+        print(f"Chat history save error: {str(e)}")
 
 
 def safe_chat_markdown(text):
@@ -83,15 +159,22 @@ def safe_chat_markdown(text):
     cleaned = cleaned.replace("_", "\\_").replace("*", "\\*").replace("`", "\\`")
     return cleaned
 
-if "qa" not in st.session_state:
-    # Cache the chain across reruns so the app feels fast and consistent.
-    st.session_state["qa"] = init_sys()
-
 if "messages" not in st.session_state:
     st.session_state["messages"] = load_chat_history()
+messages = st.session_state["messages"]
 
+# 4. Chat Interface
+# Past turns need no index, so they paint before the bot is loaded.
+for m in messages:
+    role = m.get("role")
+    content = m.get("content")
+    if role in ("user", "assistant") and content:
+        st.chat_message(role).markdown(safe_chat_markdown(content))
+
+if st.session_state.get("qa") is None:
+    # Cache the chain across reruns so the app feels fast and consistent.
+    st.session_state["qa"] = init_sys()
 qa = st.session_state["qa"]
-messages = st.session_state["messages"]
 
 with st.sidebar:
     st.divider()
@@ -111,18 +194,29 @@ with st.sidebar:
     else:
         st.caption("System not initialized yet.")
 
-# 4. Chat Interface
-for m in messages:
-    role = m.get("role")
-    content = m.get("content")
-    if role in ("user", "assistant") and content:
-        st.chat_message(role).markdown(safe_chat_markdown(content))
+    # Per-stage latency (this process, or the API server in thin-client mode).
+    with st.expander("Performance"):
+        try:
+            snap = qa.metrics() if Cfg.api_url and qa else get_metrics().snapshot()
+        except Exception as e:
+            snap = {"stages": {}, "counters": {}}
+            st.caption(f"Metrics unavailable: {e}")
+        if snap["stages"]:
+            st.table([
+                {"stage": s, "n": v["count"], "p50 ms": round(v["p50_ms"], 1), "p95 ms": round(v["p95_ms"], 1)}
+                for s, v in snap["stages"].items()
+            ])
+        else:
+            st.caption("No requests timed yet.")
+        for name, v in snap["counters"].items():
+            st.caption(f"{name}: {v}")
+        if not Cfg.api_url:
+            st.download_button("Prometheus metrics", get_metrics().prometheus(), file_name="metrics.prom")
 
 if q := st.chat_input("Ask about BMW company, models, specs, pricing, and ownership..."):
     # Display user message
     st.chat_message("user").markdown(safe_chat_markdown(q))
-    messages.append({"role": "user", "content": q})
-    save_chat_history(messages)
+    save_chat_message(messages, "user", q)
 
     if qa:
         # Display AI Response
@@ -133,13 +227,25 @@ if q := st.chat_input("Ask about BMW company, models, specs, pricing, and owners
             # Send query to RAG pipeline
             # The chain returns both answer and sources for transparency.
             trimmed = messages[-(Cfg.hist_max_turns * 2):]
-            res = qa.invoke({"query": q, "chat_history": trimmed})
+            filters = {"collection": sel_colls} if all_colls else None
+            if profile_next:
+                # Profiled requests run non-streaming so the whole call is under cProfile.
+                res = qa.invoke({"query": q, "chat_history": trimmed, "filters": filters, "profile": True})
+            else:
+                # Stream tokens into the placeholder so the first words show up immediately.
+                streamed = ""
+                res = {"result": "", "source_documents": []}
+                for ev in qa.stream({"query": q, "chat_history": trimmed, "filters": filters}):
+                    if "delta" in ev:
+                        streamed += ev["delta"]
+                        placeholder.markdown(safe_chat_markdown(streamed) + " ▌")
+                    else:
+                        res = ev
             ans = res["result"]
             src = res["source_documents"]
 
             placeholder.markdown(safe_chat_markdown(ans))
-            messages.append({"role": "assistant", "content": ans})
-            save_chat_history(messages)
+            save_chat_message(messages, "assistant", ans)
 
             # Show Citations
             with st.expander("View Sources"):
@@ -148,9 +254,11 @@ if q := st.chat_input("Ask about BMW company, models, specs, pricing, and owners
                     st.caption(f"Source: {source_name}")
                     # Preview snippet helps the interviewer see how retrieval worked.
                     st.text(s.page_content[:150] + "...")
+            if res.get("profile"):
+                with st.expander("Profile (cProfile, cumulative)"):
+                    st.code(res["profile"])
     else:
         # Clear guidance to prevent confusion when index is missing.
         err_msg = "System not initialized. Please click 'Re-Index Knowledge Base' in the sidebar first."
         st.error("⚠️ " + err_msg)
-        messages.append({"role": "assistant", "content": err_msg})
-        save_chat_history(messages)
\ No newline at end of file
+        save_chat_message(messages, "assistant", err_msg)
\ No newline at end of file
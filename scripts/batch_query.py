@@ -0,0 +1,187 @@
+"""Batch queries: questions from JSONL/CSV -> batched retrieval -> RAGBot answers -> JSONL.
+
+Questions are embedded in batches and searched with one FAISS call per batch; answers are
+generated with bounded concurrency and appended to the output as they finish. Re-running
+the same command resumes: questions already answered in the output file are skipped.
+
+    python scripts/batch_query.py questions.jsonl -o answers.jsonl --concurrency 8
+
+Input rows need a "query" (or "question") field and may carry "id" and "filters";
+CSV files need a query/question column. Rows without an id are numbered from 1.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.config import Cfg  # noqa: E402
+
+def read_questions(fp):
+    # -> [(id, query, filters)]; ids are strings so they compare equal to the ones read back on resume.
+    out = []
+    with open(fp, newline="", encoding="utf-8") as f:
+        if fp.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for n, row in enumerate(rows, 1):
+            query = (row.get("query") or row.get("question") or "").strip()
+            if not query:
+                print(f"Skipping row {n}: no query")
+                continue
+            filters = row.get("filters")
+            if isinstance(filters, str):
+                filters = json.loads(filters) if filters.strip() else None
+            out.append((str(row.get("id") or n), query, filters))
+    return out
+
+def answered(fp):
+    # Ids with a finished answer. A line cut short by a crash is dropped so appends start clean;
+    # rows with an "error" are retried.
+    if not os.path.exists(fp):
+        return set()
+    with open(fp, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    ids = set()
+    for line in data[:end].splitlines():
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in row:
+            ids.add(str(row["id"]))
+    return ids
+
+def _source(d):
+    return {"id": d.id, **{k: d.metadata[k] for k in ("source", "page", "collection") if k in d.metadata}}
+
+class Writer:
+    # One JSON line per question, flushed as soon as it is written; fsync'd once per batch.
+    def __init__(self, fp, resume):
+        self.f = open(fp, "a" if resume else "w", encoding="utf-8")
+        self.done = self.errors = 0
+
+    def write(self, row):
+        self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.f.flush()
+        if "error" in row:
+            self.errors += 1
+        else:
+            self.done += 1
+
+    def sync(self):
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+async def answer(bot, q, retrieved, share, sem, out):
+    qid, query, filters = q
+    try:
+        t0 = time.perf_counter()
+        res = await bot.ainvoke({"query": query, "chat_history": [], "filters": filters}, retrieved=retrieved)
+        timings = {**share, "generate_ms": (time.perf_counter() - t0) * 1000}
+        timings["total_ms"] = sum(timings.values())
+        row = {
+            "id": qid,
+            "query": query,
+            "answer": res["result"],
+            "sources": [_source(d) for d in res.get("source_documents", [])],
+            "timings": {k: round(v, 2) for k, v in timings.items()},
+        }
+        for key in ("prompt_tokens", "cached"):
+            if key in res:
+                row[key] = res[key]
+        # The bot reports LLM failures in the answer text; keep them retryable.
+        if res["result"].startswith("Connection Error:"):
+            row["error"] = res["result"]
+        out.write(row)
+    except Exception as e:
+        out.write({"id": qid, "query": query, "error": str(e)})
+    finally:
+        sem.release()
+
+async def run(bot, todo, args, out):
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+    for s in range(0, len(todo), args.batch):
+        batch = todo[s:s + args.batch]
+        # One retrieval call per filter set in the batch (usually just one).
+        groups = {}
+        for q in batch:
+            groups.setdefault(json.dumps(q[2] or args.filters, sort_keys=True), []).append(q)
+        for key, qs in groups.items():
+            try:
+                retrieved, times = await loop.run_in_executor(
+                    None, bot.retrieve_batch, [q[1] for q in qs], json.loads(key)
+                )
+            except Exception as e:
+                for qid, query, _ in qs:
+                    out.write({"id": qid, "query": query, "error": f"Retrieval failed: {str(e)}"})
+                continue
+            # Batch stage times split evenly over its questions.
+            share = {k: v / len(qs) for k, v in times.items()}
+            for q, r in zip(qs, retrieved):
+                # Waits for a free slot, so retrieval runs at most one batch ahead of generation.
+                await sem.acquire()
+                task = asyncio.create_task(answer(bot, q, r, share, sem, out))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        out.sync()
+        print(f"{min(s + args.batch, len(todo))}/{len(todo)} retrieved, {out.done} answered, {out.errors} errors")
+    if tasks:
+        await asyncio.gather(*tasks)
+    await bot.aclose()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("input", help="questions (.jsonl or .csv)")
+    ap.add_argument("-o", "--out", default="", help="JSONL output (default <input>.answers.jsonl)")
+    ap.add_argument("--batch", type=int, default=Cfg.batch_size, help="questions per embedding/search batch")
+    ap.add_argument("--concurrency", type=int, default=Cfg.batch_concurrency, help="LLM calls in flight")
+    ap.add_argument("--filters", type=json.loads, default=None, help='default filters, e.g. \'{"source": "x5.pdf"}\'')
+    ap.add_argument("--no-resume", action="store_true", help="overwrite the output instead of resuming")
+    args = ap.parse_args()
+
+    from src.bot_logic import load_bot
+
+    fp = args.out or os.path.splitext(args.input)[0] + ".answers.jsonl"
+    questions = read_questions(args.input)
+    done = set() if args.no_resume else answered(fp)
+    todo = [q for q in questions if q[0] not in done]
+    if done:
+        print(f"Resuming: {len(questions) - len(todo)} of {len(questions)} already answered in {fp}")
+    if not todo:
+        print("Nothing to do.")
+        return
+
+    bot = load_bot()
+    if bot is None:
+        print("No index found. Re-index the knowledge base first.")
+        sys.exit(1)
+    if not bot.api_token:
+        print("Warning: HUGGINGFACEHUB_API_TOKEN is not set; answers will be connection errors.")
+
+    out = Writer(fp, resume=not args.no_resume)
+    t0 = time.perf_counter()
+    try:
+        asyncio.run(run(bot, todo, args, out))
+    finally:
+        out.close()
+    dt = time.perf_counter() - t0
+    print(f"Wrote {out.done} answers ({out.errors} errors) to {fp} in {dt:.1f}s ({out.done / dt:.1f} q/s)")
+    sys.exit(1 if out.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
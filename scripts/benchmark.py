@@ -0,0 +1,272 @@
+"""Offline benchmark: synthetic corpus -> parse -> index build -> search -> RAGBot.invoke.
+
+No network: embeddings are a deterministic feature-hashing stub and the LLM is a stub with a
+configurable delay. Results go to a JSON file so runs can be compared across commits.
+
+    python scripts/benchmark.py --chunks 10000 --queries 500
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.config import Cfg  # noqa: E402
+
+BMW_TERMS = ["bmw", "m340i", "x5", "ix", "i4", "xdrive", "warranty", "service", "battery", "range", "munich", "leasing"]
+
+def _rss_mb():
+    # Current RSS on Linux; peak RSS elsewhere.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _pcts(lat):
+    a = np.asarray(lat) * 1000.0
+    return {
+        "n": int(a.size),
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(np.percentile(a, 50)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+    }
+
+def _dir_mb(path):
+    tot = 0
+    for root, _, files in os.walk(path):
+        tot += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return tot / 2**20
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+def gen_corpus(dirpath, n_chunks, n_files, seed):
+    # ~1 chunk per paragraph: paragraphs stay just under Cfg.ch_sz characters.
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(5000)] + BMW_TERMS
+    paras = []
+    per_file = -(-n_chunks // n_files)
+    written = 0
+    for fno in range(n_files):
+        with open(os.path.join(dirpath, f"bmw_bench_{fno:05d}.txt"), "w", encoding="utf-8") as f:
+            for _ in range(min(per_file, n_chunks - written)):
+                words = rng.choice(vocab, size=int(rng.integers(55, 70)))
+                para = " ".join(words)[: Cfg.ch_sz - 20]
+                paras.append(para)
+                f.write(para + "\n\n")
+                written += 1
+    return paras
+
+def stub_embed(dim):
+    # Feature hashing: shared words -> nearby vectors, so retrieval quality is measurable.
+    def embed(texts):
+        out = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, t in enumerate(texts):
+            for w in t.lower().split():
+                h = zlib.crc32(w.encode())
+                out[row, h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+        out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out.tolist()
+    return embed
+
+class StubLLM:
+    # Mimics InferenceClient.chat.completions.create with a fixed delay.
+    def __init__(self, delay_s):
+        self.delay_s = delay_s
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, stream=False, **kw):
+        time.sleep(self.delay_s)
+        text = "Stub answer. " + messages[-1]["content"][:40]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+def _stub_hf(ve, dim):
+    embed = stub_embed(dim)
+    ve.hf._request = embed
+    ve.hf._call_api = embed
+
+def bench(args):
+    work = args.work or tempfile.mkdtemp(prefix="rag_bench_")
+    raw_dir = os.path.join(work, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+
+    # Isolate every path and disable caches that would hide the work being measured.
+    Cfg.d_path = raw_dir
+    Cfg.idx_path = os.path.join(work, "index")
+    Cfg.source_filename_keywords = ("bmw",)
+    Cfg.emb_backend = "api"
+    Cfg.emb_cache_max = 0
+    Cfg.ans_cache_max = 0
+    Cfg.rr_enabled = False
+    Cfg.pack_use_tokenizer = False
+    if args.index_type:
+        Cfg.idx_type = args.index_type
+    if args.quant:
+        Cfg.idx_quant = args.quant
+    if args.rescore is not None:
+        Cfg.idx_rescore = args.rescore
+    if args.workers is not None:
+        Cfg.ing_workers = args.workers
+    os.environ.setdefault("HUGGINGFACEHUB_API_TOKEN", "bench-stub")
+
+    from src.bot_logic import RAGBot
+    from src.document_processor import DocProc
+    from src.metrics import get_metrics
+    from src.retriever import HybridRetriever
+    from src.vector_engine import VecEng
+
+    res = {}
+    t0 = time.perf_counter()
+    paras = gen_corpus(raw_dir, args.chunks, args.files or max(1, args.chunks // 200), args.seed)
+    res["corpus"] = {"chunks": len(paras), "secs": time.perf_counter() - t0, "mb": _dir_mb(raw_dir)}
+    print(f"corpus: {len(paras)} paragraphs in {res['corpus']['secs']:.1f}s")
+
+    dp = DocProc()
+    t0 = time.perf_counter()
+    frags = dp.get_frags()
+    dt = time.perf_counter() - t0
+    res["parse"] = {"chunks": len(frags), "secs": dt, "chunks_per_sec": len(frags) / dt}
+    print(f"parse: {len(frags)} chunks, {res['parse']['chunks_per_sec']:.0f}/s")
+
+    ve = VecEng()
+    _stub_hf(ve, args.dim)
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    vs = ve.crt_idx(frags, full=True)
+    dt = time.perf_counter() - t0
+    res["build"] = {
+        "secs": dt,
+        "chunks_per_sec": len(frags) / dt,
+        "kind": (ve.last_stats.get("recall") or {}).get("kind") or type(vs.index).__name__,
+        "recall": ve.last_stats.get("recall"),
+        "dedup": ve.last_stats.get("dedup"),
+        "rss_delta_mb": _rss_mb() - rss0,
+        "peak_rss_mb": _peak_mb(),
+        "disk_mb": _dir_mb(Cfg.idx_path),
+    }
+    print(f"build: {dt:.1f}s ({res['build']['chunks_per_sec']:.0f} chunks/s), {res['build']['disk_mb']:.1f} MB on disk")
+    del frags
+
+    # Reload the way the app does (memory-mapped), then query it.
+    ve = VecEng()
+    _stub_hf(ve, args.dim)
+    t0 = time.perf_counter()
+    vs = ve.ld_idx()
+    res["load"] = {"secs": time.perf_counter() - t0, "rss_mb": _rss_mb()}
+    # Dense search as the app runs it (re-scored against float32 when the index is quantized).
+    dense = HybridRetriever(vs, exact=ve.exact)
+
+    def dense_search(q):
+        return [d for d, _ in dense.search_by_vector(vs.embeddings.embed_query(q), Cfg.k_ret)]
+
+    rng = np.random.default_rng(args.seed + 1)
+    targets = rng.integers(0, len(paras), size=args.queries)
+    queries = []
+    for i in targets:
+        words = paras[i].split()
+        start = int(rng.integers(0, max(1, len(words) - 8)))
+        queries.append((int(i), " ".join(words[start:start + 8])))
+
+    lat, hits = [], 0
+    for i, q in queries:
+        t0 = time.perf_counter()
+        docs = dense_search(q)
+        lat.append(time.perf_counter() - t0)
+        hits += any(d.page_content.strip() == paras[i] for d in docs)
+    res["search"] = {**_pcts(lat), "qps": len(lat) / sum(lat), f"hit@{Cfg.k_ret}": hits / len(queries)}
+    print(f"search: p50 {res['search']['p50_ms']:.2f} ms, p99 {res['search']['p99_ms']:.2f} ms, hit@k {res['search'][f'hit@{Cfg.k_ret}']:.3f}")
+
+    def one(q):
+        t0 = time.perf_counter()
+        dense_search(q)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        clat = list(pool.map(one, [q for _, q in queries]))
+    res["search_concurrent"] = {**_pcts(clat), "threads": args.threads, "qps": len(clat) / (time.perf_counter() - t0)}
+
+    bot = RAGBot(vs, bm25=ve.bm25, version=ve.version, exact=ve.exact)
+    bot.client = StubLLM(args.llm_ms / 1000.0)
+    hlat = []
+    for _, q in queries:
+        t0 = time.perf_counter()
+        docs, _ = bot.retriever.search(q, Cfg.k_ret)
+        hlat.append(time.perf_counter() - t0)
+    res["retrieve"] = {**_pcts(hlat), "hybrid": bool(Cfg.hyb_enabled and ve.bm25)}
+
+    n_e2e = min(args.queries, args.e2e)
+    elat = []
+    for _, q in queries[:n_e2e]:
+        t0 = time.perf_counter()
+        bot.invoke({"query": q, "chat_history": []})
+        elat.append(time.perf_counter() - t0)
+    res["invoke"] = {**_pcts(elat), "llm_stub_ms": args.llm_ms}
+    print(f"invoke: p50 {res['invoke']['p50_ms']:.2f} ms (LLM stub {args.llm_ms} ms)")
+
+    res["stages"] = get_metrics().snapshot()["stages"]
+    if not args.keep and not args.work:
+        shutil.rmtree(work, ignore_errors=True)
+    return res
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--chunks", type=int, default=5000, help="synthetic chunks (1k .. 1M)")
+    ap.add_argument("--files", type=int, default=0, help="files to spread chunks over (default chunks/200)")
+    ap.add_argument("--dim", type=int, default=384, help="stub embedding dimension")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--e2e", type=int, default=100, help="queries sent through RAGBot.invoke")
+    ap.add_argument("--threads", type=int, default=8, help="threads for the concurrent search run")
+    ap.add_argument("--llm-ms", type=float, default=0.0, help="stub LLM latency")
+    ap.add_argument("--index-type", default="", help="override FAISS_INDEX_TYPE")
+    ap.add_argument("--quant", default="", help="override FAISS_QUANT (none, fp16, int8)")
+    ap.add_argument("--rescore", type=int, default=None, help="override FAISS_RESCORE (0 = off)")
+    ap.add_argument("--workers", type=int, default=None, help="override INGEST_WORKERS")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--work", default="", help="work dir (kept); default is a temp dir")
+    ap.add_argument("--keep", action="store_true", help="keep the temp work dir")
+    ap.add_argument("--out", default="", help="JSON output (default bench_results/<commit>-<chunks>.json)")
+    args = ap.parse_args()
+
+    import faiss
+
+    out = {
+        "meta": {
+            "commit": _git_rev(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "faiss": faiss.__version__,
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": bench(args),
+    }
+    fp = args.out or os.path.join("bench_results", f"{out['meta']['commit']}-{args.chunks}.json")
+    os.makedirs(os.path.dirname(fp) or ".", exist_ok=True)
+    with open(fp, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"Wrote {fp}")
+
+
+if __name__ == "__main__":
+    main()
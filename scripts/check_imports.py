@@ -1,8 +1,80 @@
-import importlib
-mods = ['src.config','src.document_processor','src.vector_engine','src.bot_logic']
-for m in mods:
-    try:
-        importlib.import_module(m)
-        print('OK', m)
-    except Exception as e:
-        print('ERR', m, type(e).__name__, e)
+"""Import check and start-up profile.
+
+Imports each module in a fresh interpreter (python -X importtime) and reports whether it
+imports, how long that takes, and which packages cost the most. main.py's own top-level
+imports are timed the same way: they run before the first paint of every new app process.
+
+    PYTHONPATH=. python scripts/check_imports.py --startup
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+mods = ['src.config', 'src.document_processor', 'src.vector_engine', 'src.bot_logic',
+        'src.index_job', 'src.api_client', 'src.api_server']
+
+def import_profile(code):
+    # -> (error or None, total ms, {top-level package: ms}) for running code in a new interpreter.
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    total, pkgs, other = 0, {}, []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue
+        # Self time per module, summed per top-level package, so nothing is counted twice.
+        us = int(self_us)
+        total += us
+        top = name.strip().split(".")[0]
+        pkgs[top] = pkgs.get(top, 0) + us
+    err = (other[-1] if other else f"exit {p.returncode}") if p.returncode else None
+    return err, total / 1000, {k: v / 1000 for k, v in pkgs.items()}
+
+def main_imports():
+    # main.py's module-level import statements (not the ones deferred into functions).
+    with open(os.path.join(ROOT, "main.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(n) for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom)))
+
+def report(label, code, top):
+    err, ms, pkgs = import_profile(code)
+    if err:
+        print('ERR', label, err)
+        return False
+    heavy = sorted(pkgs.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    print(f"OK  {label:<24} {ms:8.1f} ms   " + ", ".join(f"{k} {v:.0f}" for k, v in heavy))
+    return True
+
+def startup():
+    # What the first session on a cold process waits for after the page has painted.
+    t0 = time.perf_counter()
+    from src.bot_logic import load_bot
+    t1 = time.perf_counter()
+    bot = load_bot()
+    t2 = time.perf_counter()
+    chunks = bot.retriever.ntotal() if bot else 0
+    print(f"startup: import bot {(t1 - t0) * 1000:.0f} ms, load_bot {(t2 - t1) * 1000:.0f} ms ({chunks} chunks)")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--top", type=int, default=4, help="heaviest packages listed per module")
+    ap.add_argument("--startup", action="store_true", help="also time loading the index (load_bot)")
+    args = ap.parse_args()
+
+    ok = all([report(m, f"import {m}", args.top) for m in mods])
+    ok = report("main.py (top-level)", main_imports(), args.top) and ok
+    if args.startup and ok:
+        sys.path.insert(0, ROOT)
+        startup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
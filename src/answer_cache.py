@@ -0,0 +1,91 @@
+# AnsCache: semantic response cache keyed by query embedding + retrieved chunk set + conversation so far.
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config import Cfg
+
+class AnsCache:
+    def __init__(self, threshold, ttl, max_items):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        # entry id -> (chunk key, unit query vector, result, source_documents, created), oldest first.
+        self._entries = OrderedDict()
+        # (chunk key, history hash) -> entry ids, so lookups only compare against answers built from the same context.
+        self._by_chunks = {}
+        self._ids = itertools.count()
+
+    @staticmethod
+    def _unit(vec):
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    @staticmethod
+    def _key(chunk_ids, history):
+        # Follow-ups ("and its range?") only match answers given after the same prior turns.
+        h = hashlib.sha1(json.dumps(history or [], sort_keys=True).encode("utf-8")).hexdigest()
+        return tuple(sorted(chunk_ids)), h
+
+    def get(self, qvec, chunk_ids, history=None):
+        ck = self._key(chunk_ids, history)
+        q = self._unit(qvec)
+        now = time.monotonic()
+        with self._lock:
+            best, best_sim = None, self.threshold
+            for eid in list(self._by_chunks.get(ck, ())):
+                _, v, result, src, ts = self._entries[eid]
+                if now - ts > self.ttl:
+                    self._drop(eid)
+                    continue
+                sim = float(np.dot(q, v))
+                if sim >= best_sim:
+                    best, best_sim = (result, src), sim
+            return best
+
+    def put(self, qvec, chunk_ids, result, source_documents, history=None):
+        ck = self._key(chunk_ids, history)
+        with self._lock:
+            eid = next(self._ids)
+            self._entries[eid] = (ck, self._unit(qvec), result, source_documents, time.monotonic())
+            self._by_chunks.setdefault(ck, []).append(eid)
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+
+    def _drop(self, eid):
+        ck = self._entries.pop(eid)[0]
+        ids = self._by_chunks.get(ck, [])
+        if eid in ids:
+            ids.remove(eid)
+        if not ids:
+            self._by_chunks.pop(ck, None)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_ans_cache():
+    # Shared across sessions in the process; repeat questions from any user hit it.
+    global _cache
+    if Cfg.ans_cache_max <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnsCache(Cfg.ans_cache_thr, Cfg.ans_cache_ttl, Cfg.ans_cache_max)
+        return _cache
+
+def invalidate_ans_cache():
+    # Called on every index rebuild: cached answers may cite chunks that changed.
+    if _cache is not None:
+        _cache.clear()
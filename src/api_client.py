@@ -0,0 +1,93 @@
+# ApiClient: RAGBot-compatible thin client for src/api_server.py (used when RAG_API_URL is set).
+import json
+
+import httpx
+from langchain_core.documents import Document
+
+from src.config import Cfg
+
+def _docs(sources):
+    return [Document(page_content=s.get("content", ""), metadata=s.get("metadata") or {}, id=s.get("id")) for s in sources or []]
+
+def _result(data):
+    # Same shape as RAGBot.invoke so main.py renders both the same way.
+    res = {k: v for k, v in data.items() if k != "sources"}
+    res["source_documents"] = _docs(data.get("sources"))
+    return res
+
+class ApiClient:
+    def __init__(self, base_url=None):
+        self.base_url = base_url or Cfg.api_url
+        # Generation can take a while; only connecting is expected to be quick.
+        self.http = httpx.Client(base_url=self.base_url, timeout=httpx.Timeout(120.0, connect=5.0))
+        self.repo_id = Cfg.llm_model
+        self.fallback_models = ()
+        # The token lives on the server; the UI only needs to know the service answers.
+        self.api_token = None
+
+    def get_chn(self):
+        return self
+
+    def refresh(self):
+        try:
+            h = self.health()
+        except Exception as e:
+            print(f"API health check failed: {str(e)}")
+            return False
+        self.repo_id = h.get("model", self.repo_id)
+        self.fallback_models = tuple(h.get("fallback_models") or ())
+        self.api_token = "server"
+        return h.get("status") == "ok"
+
+    def health(self):
+        r = self.http.get("/health")
+        r.raise_for_status()
+        return r.json()
+
+    def metrics(self):
+        # Server-side stage latencies/counters (same shape as Metrics.snapshot()).
+        r = self.http.get("/metrics.json")
+        r.raise_for_status()
+        return r.json()
+
+    def invoke(self, input_dict):
+        try:
+            r = self.http.post("/query", json=input_dict)
+            data = r.json()
+        except Exception as e:
+            return {"result": f"Connection Error: {str(e)}", "source_documents": []}
+        if r.status_code != 200:
+            return {"result": f"Connection Error: {data.get('error', r.status_code)}", "source_documents": []}
+        return _result(data)
+
+    def stream(self, input_dict):
+        # Same events as RAGBot.stream: {"delta"} lines, then a final dict with "done".
+        try:
+            with self.http.stream("POST", "/query/stream", json=input_dict) as r:
+                if r.status_code != 200:
+                    r.read()
+                    msg = r.json().get("error", r.status_code)
+                    yield {"result": f"Connection Error: {msg}", "source_documents": [], "done": True}
+                    return
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    ev = json.loads(line)
+                    yield ev if "delta" in ev else _result(ev)
+        except Exception as e:
+            yield {"result": f"Connection Error: {str(e)}", "source_documents": [], "done": True}
+
+    def reindex(self, full=False, collections=None):
+        # Starts the server's background build; raises RuntimeError with the server's message.
+        headers = {"Authorization": f"Bearer {Cfg.api_admin_token}"} if Cfg.api_admin_token else {}
+        r = self.http.post("/reindex", json={"full": full, "collections": collections}, headers=headers)
+        data = r.json()
+        if r.status_code != 202:
+            raise RuntimeError(data.get("error", r.status_code))
+        return data
+
+    def reindex_status(self):
+        # Same fields as IndexJob.snapshot(): status, phase, files, files_done, chunks, error.
+        r = self.http.get("/reindex")
+        r.raise_for_status()
+        return r.json()
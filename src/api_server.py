@@ -0,0 +1,257 @@
+# API server: headless async HTTP front-end for RAGBot (one shared index + bot per process).
+# Run: python -m src.api_server   (or: uvicorn src.api_server:app --workers N)
+import asyncio
+import hmac
+import json
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from src.bot_logic import load_bot
+from src.config import Cfg
+from src.index_job import get_index_job
+from src.metrics import get_metrics
+from src.retriever import norm_filters
+
+class _Busy(Exception):
+    pass
+
+class ApiState:
+    def __init__(self):
+        self.bot = None
+        # Created in lifespan so they bind to the server's event loop.
+        self.sem = None
+        self.waiting = 0
+        self.inflight = 0
+
+    def load(self):
+        # Memory-mapped vectors are shared by the page cache across worker processes.
+        self.bot = load_bot()
+
+    async def ensure_bot(self):
+        # First index built after start-up (here or by another worker); later versions are
+        # picked up by the bot itself on its next query.
+        if self.bot is None:
+            await asyncio.to_thread(self.load)
+        return self.bot
+
+    async def acquire(self):
+        # Backpressure: a bounded wait queue in front of a bounded number of running requests.
+        if self.waiting >= Cfg.api_max_queue:
+            raise _Busy()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.sem.acquire(), Cfg.api_queue_timeout_s)
+        except asyncio.TimeoutError:
+            raise _Busy()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        self.sem.release()
+
+_state = ApiState()
+
+class _SlotStream(StreamingResponse):
+    # Frees the request's inflight slot however the response ends. A client that leaves before the
+    # body starts never runs the generator (or a background task), so its finally can't do it.
+    def __init__(self, content, **kw):
+        super().__init__(content, **kw)
+        self._held = True
+
+    def release(self):
+        if self._held:
+            self._held = False
+            _state.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+            # Ends the bot's stream (and its LLM call) if the client disconnected mid-answer.
+            await self.body_iterator.aclose()
+
+def doc_json(d):
+    return {"id": d.id, "content": d.page_content, "metadata": d.metadata}
+
+def _result_json(res):
+    out = {"result": res["result"], "sources": [doc_json(d) for d in res.get("source_documents", [])]}
+    for key in ("prompt_tokens", "cached", "profile", "done"):
+        if key in res:
+            out[key] = res[key]
+    return out
+
+def _busy():
+    return JSONResponse(
+        {"error": "Server busy, retry later."}, status_code=503,
+        headers={"Retry-After": str(max(1, int(Cfg.api_queue_timeout_s)))},
+    )
+
+async def _query_input(request):
+    try:
+        body = await request.json()
+    except Exception:
+        return None, JSONResponse({"error": "Body must be JSON."}, status_code=400)
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        return None, JSONResponse({"error": "'query' must be a non-empty string."}, status_code=400)
+    history = body.get("chat_history") or []
+    if not isinstance(history, list):
+        return None, JSONResponse({"error": "'chat_history' must be a list."}, status_code=400)
+    try:
+        # Checked here so a bad page number is the client's error, not a 500 from inside the search.
+        norm_filters(body.get("filters"))
+    except ValueError as e:
+        return None, JSONResponse({"error": str(e)}, status_code=400)
+    return {
+        "query": query.strip(),
+        # Same history window as the UI; the packer trims further to the token budget.
+        "chat_history": [m for m in history[-(Cfg.hist_max_turns * 2):] if isinstance(m, dict)],
+        "filters": body.get("filters"),
+        "profile": bool(body.get("profile")),
+    }, None
+
+def _no_index():
+    return JSONResponse({"error": "Index not found. POST /reindex first."}, status_code=503)
+
+async def query(request):
+    inp, err = await _query_input(request)
+    if err:
+        return err
+    if await _state.ensure_bot() is None:
+        return _no_index()
+    try:
+        await _state.acquire()
+    except _Busy:
+        return _busy()
+    try:
+        if inp["profile"]:
+            # cProfile only sees the calling thread, so a profiled request runs the sync path.
+            res = await asyncio.to_thread(_state.bot.invoke, inp)
+        else:
+            res = await _state.bot.ainvoke(inp)
+        return JSONResponse(_result_json(res))
+    finally:
+        _state.release()
+
+async def query_stream(request):
+    # NDJSON: one {"delta": ...} line per token chunk, then the final result line with "done".
+    inp, err = await _query_input(request)
+    if err:
+        return err
+    if await _state.ensure_bot() is None:
+        return _no_index()
+    try:
+        await _state.acquire()
+    except _Busy:
+        return _busy()
+
+    bot = _state.bot
+
+    async def events():
+        # The slot is held until the stream ends or the client disconnects.
+        try:
+            async for ev in bot.astream(inp):
+                line = ev if "delta" in ev else _result_json(ev)
+                yield json.dumps(line) + "\n"
+        finally:
+            resp.release()
+
+    try:
+        resp = _SlotStream(events(), media_type="application/x-ndjson")
+    except Exception:
+        _state.release()
+        raise
+    return resp
+
+def _admin_error(request):
+    # Re-indexing rewrites what every user is served from, so it needs the admin token.
+    if not Cfg.api_admin_token:
+        return JSONResponse({"error": "Re-indexing over the API is disabled; set API_ADMIN_TOKEN."}, status_code=403)
+    auth = request.headers.get("authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {Cfg.api_admin_token}".encode("utf-8")):
+        return JSONResponse({"error": "Admin token required."}, status_code=401)
+    return None
+
+async def reindex(request):
+    # Starts a background build and returns at once; poll GET /reindex for progress.
+    # Queries keep using the live version until the new one is published.
+    err = _admin_error(request)
+    if err:
+        return err
+    try:
+        body = await request.json()
+    except Exception:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    full = bool(body.get("full"))
+    # Sharded setups can rebuild some collections only; the rest stay as they are.
+    colls = body.get("collections")
+    if isinstance(colls, str):
+        colls = [colls]
+    job = get_index_job()
+    if not job.start(full, colls or None):
+        return JSONResponse({"error": "Re-index already running.", **job.snapshot()}, status_code=409)
+    return JSONResponse(job.snapshot(), status_code=202)
+
+async def reindex_status(request):
+    return JSONResponse(get_index_job().snapshot())
+
+async def health(request):
+    bot = await _state.ensure_bot()
+    return JSONResponse({
+        "status": "ok" if bot else "no_index",
+        "chunks": bot.retriever.ntotal() if bot else 0,
+        "index_version": bot.version if bot else None,
+        "collections": bot.retriever.names() if bot and hasattr(bot.retriever, "names") else [],
+        "loaded_collections": bot.retriever.loaded() if bot and hasattr(bot.retriever, "loaded") else [],
+        "inflight": _state.inflight,
+        "waiting": _state.waiting,
+        "model": bot.repo_id if bot else Cfg.llm_model,
+        "fallback_models": list(bot.fallback_models) if bot else [],
+        "llm": bot.health.snapshot() if bot else {},
+    })
+
+async def metrics(request):
+    # Prometheus scrape target; /metrics.json is the same data summarised for the UI.
+    return PlainTextResponse(get_metrics().prometheus(), media_type="text/plain; version=0.0.4")
+
+async def metrics_json(request):
+    return JSONResponse(get_metrics().snapshot())
+
+@asynccontextmanager
+async def lifespan(app):
+    _state.sem = asyncio.Semaphore(Cfg.api_max_inflight)
+    await asyncio.to_thread(_state.load)
+    yield
+    if _state.bot is not None:
+        await _state.bot.aclose()
+
+app = Starlette(
+    routes=[
+        Route("/query", query, methods=["POST"]),
+        Route("/query/stream", query_stream, methods=["POST"]),
+        Route("/reindex", reindex, methods=["POST"]),
+        Route("/reindex", reindex_status, methods=["GET"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/metrics.json", metrics_json, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Each worker is a separate process with its own index/bot; limits apply per worker.
+    uvicorn.run("src.api_server:app", host=Cfg.api_host, port=Cfg.api_port, workers=Cfg.api_workers)
@@ -0,0 +1,134 @@
+# BM25Idx: sparse keyword index over chunk ids, built alongside the FAISS index.
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from src.config import Cfg
+
+# Keep alphanumeric runs intact so model codes like "m340i" or "xdrive50" stay single terms.
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Saved arrays: sorted term hashes, CSR offsets into docs/tfs, per-doc lengths and chunk ids.
+_ARRAYS = ("terms", "offsets", "docs", "tfs", "lens", "ids")
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+def _term_hash(term):
+    # 64-bit term keys: a sorted uint64 array is searched without building a vocabulary dict.
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+class BM25Idx:
+    def __init__(self, arrays=None):
+        # Built in memory (term -> [(doc_no, tf)]), then frozen into CSR arrays; a loaded index
+        # is only those arrays, memory-mapped, so loading costs nothing per chunk.
+        self._ids, self._lens, self._post = [], [], {}
+        self.arr = None
+        if arrays is not None:
+            self._set(arrays)
+
+    def _set(self, arrays):
+        self.arr = arrays
+        self.n = len(arrays["lens"])
+        self.avg_len = float(np.mean(arrays["lens"])) if self.n else 0.0
+
+    def add(self, cid, text):
+        # Streaming build: chunks are added as ingestion produces them.
+        no = len(self._ids)
+        toks = tokenize(text)
+        self._ids.append(cid)
+        self._lens.append(len(toks))
+        for term, tf in Counter(toks).items():
+            self._post.setdefault(term, []).append((no, tf))
+
+    @classmethod
+    def build(cls, items):
+        # items: iterable of (chunk id, text).
+        idx = cls()
+        for cid, text in items:
+            idx.add(cid, text)
+        return idx
+
+    def freeze(self):
+        if self.arr is not None:
+            return self.arr
+        terms = list(self._post)
+        hashes = np.fromiter((_term_hash(t) for t in terms), dtype=np.uint64, count=len(terms))
+        order = np.argsort(hashes, kind="stable")
+        lists = [self._post[terms[i]] for i in order.tolist()]
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in lists])
+        flat = np.array([x for p in lists for x in p], dtype=np.int32).reshape(-1, 2)
+        self._set({
+            "terms": hashes[order],
+            "offsets": offsets,
+            "docs": np.ascontiguousarray(flat[:, 0]),
+            "tfs": np.ascontiguousarray(flat[:, 1]),
+            "lens": np.asarray(self._lens, dtype=np.int32),
+            "ids": np.array([c.encode("ascii") for c in self._ids], dtype="S64"),
+        })
+        self._ids, self._lens, self._post = [], [], {}
+        return self.arr
+
+    def search(self, query, k, allow=None):
+        # allow: optional set of chunk ids the caller's filter admits.
+        a = self.freeze()
+        n = self.n
+        if not n:
+            return []
+        k1, b = Cfg.bm25_k1, Cfg.bm25_b
+        avg_len = self.avg_len or 1.0
+        qh = np.fromiter((_term_hash(t) for t in set(tokenize(query))), dtype=np.uint64)
+        pos = np.searchsorted(a["terms"], qh)
+        docs, contrib = [], []
+        for p, h in zip(pos.tolist(), qh.tolist()):
+            if p >= len(a["terms"]) or int(a["terms"][p]) != h:
+                continue
+            s, e = int(a["offsets"][p]), int(a["offsets"][p + 1])
+            d = np.asarray(a["docs"][s:e])
+            tf = np.asarray(a["tfs"][s:e], dtype=np.float64)
+            idf = math.log(1.0 + (n - (e - s) + 0.5) / ((e - s) + 0.5))
+            norm = tf + k1 * (1.0 - b + b * np.asarray(a["lens"][d]) / avg_len)
+            docs.append(d)
+            contrib.append(idf * tf * (k1 + 1.0) / norm)
+        if not docs:
+            return []
+        uniq, inv = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(contrib))
+        order = np.argsort(-scores, kind="stable")
+        if allow is None:
+            top = order[:k]
+            return [(c.decode("ascii"), float(scores[j])) for j, c in zip(top, a["ids"][uniq[top]])]
+        # Filtered: walk the ranking in blocks until k admitted chunks are found.
+        out = []
+        for s in range(0, len(order), 1024):
+            blk = order[s:s + 1024]
+            for j, c in zip(blk, a["ids"][uniq[blk]]):
+                cid = c.decode("ascii")
+                if cid in allow:
+                    out.append((cid, float(scores[j])))
+                    if len(out) == k:
+                        return out
+        return out
+
+    def save(self, dirpath):
+        # One .npy per array so load() can memory-map each of them.
+        a = self.freeze()
+        os.makedirs(dirpath, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(dirpath, name + ".npy"), a[name], allow_pickle=False)
+
+    @classmethod
+    def load(cls, dirpath):
+        if not os.path.isdir(dirpath):
+            return None
+        try:
+            # Pages are shared with every process serving the same version.
+            return cls({name: np.load(os.path.join(dirpath, name + ".npy"), mmap_mode="r") for name in _ARRAYS})
+        except Exception as e:
+            # Dense search still works; hybrid simply turns itself off.
+            print(f"BM25 index load error: {str(e)}")
+            return None
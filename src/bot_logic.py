@@ -1,51 +1,353 @@
 # RAGBot: retrieval + LLM orchestration for grounded BMW Q&A.
+import asyncio
+import itertools
 import os
 import re
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient, InferenceClient
 
+from src.answer_cache import get_ans_cache
 from src.config import Cfg
+from src.llm_health import get_llm_health
+from src.metrics import get_metrics, inc, profiled, span, timed
+from src.prompt_pack import PromptPacker, preload_tokenizer
+from src.reranker import get_reranker
+from src.retriever import HybridRetriever
+from src.shards import ShardedRetriever
+from src.vector_engine import VecEng, chunk_id, current_version
+
+# Blocking steps of the async path (embedding, FAISS, packing) share one bounded pool,
+# so hundreds of in-flight requests don't mean hundreds of threads.
+_aio_pool = ThreadPoolExecutor(max_workers=Cfg.async_workers, thread_name_prefix="ragbot")
+# Hedged sync calls run each racing model on this pool. Sized so every in-flight request can race all
+# its candidates: a loser keeps its thread until its call returns (at most llm_timeout_s).
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=Cfg.hedge_workers or Cfg.api_max_inflight * (1 + len(Cfg.llm_fallback_models)),
+    thread_name_prefix="llm-hedge",
+)
+
+class _ModelFailed(Exception):
+    # Internal: this model is unusable for now, move on to the next candidate.
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+class _Stream:
+    # A chat-completion stream whose first chunk was already pulled; closing it (or reading it to
+    # the end) closes the call's own client, which holds the HTTP response.
+    def __init__(self, client, first, it):
+        self.client = client
+        self._first = first
+        self._it = it
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            return first
+        try:
+            return next(self._it)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        self.client.close()
 
 class RAGBot:
-    def __init__(self, vector_store):
+    def __init__(self, vector_store, bm25=None, version=None, retriever=None, exact=None, meta=None):
         self.vector_store = vector_store
+        # Dense + keyword retrieval; bm25 and exact (float32 copy of a quantized index) come from VecEng.
+        # A ShardedRetriever (collections) is passed in ready-made and reloads its shards itself.
+        self.retriever = retriever or HybridRetriever(vector_store, bm25, exact, meta)
+        self._follow = retriever is None
+        # Index version being served; a re-index publishes a new one and _maybe_reload() follows it.
+        self.version = version
+        self._reload_at = time.monotonic() + Cfg.idx_reload_check_s
+        self._reload_lock = threading.Lock()
+        # Queries running per retriever; one swapped out by a reload is closed when its count hits 0.
+        self._users = {}
+        self._use_lock = threading.Lock()
+        self.reranker = get_reranker()
+        self._packers = {}
         # Pull the API token from env so code stays deployable without hardcoding secrets.
         self.api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
         self.repo_id = Cfg.llm_model
         self.fallback_models = tuple(
             m for m in Cfg.llm_fallback_models if m and m != self.repo_id
         )
+        # Fetch tokenizers now rather than inside the first request (or the first fallback promotion).
+        for m in (self.repo_id, *self.fallback_models):
+            preload_tokenizer(m)
         # Defer client creation if token is missing to keep the app usable (with warnings).
-        self.client = InferenceClient(api_key=self.api_token) if self.api_token else None
+        self.client = InferenceClient(api_key=self.api_token, timeout=Cfg.llm_timeout_s) if self.api_token else None
+        # Async client is bound to the event loop it first runs on; see _aclient().
+        self._aio = None
+        self.ans_cache = get_ans_cache()
+        self.health = get_llm_health()
 
     def get_chn(self):
         return self
 
     def invoke(self, input_dict):
+        if input_dict.get("profile"):
+            # One-off cProfile of this request; the report comes back under "profile".
+            res, report = profiled(self._invoke, input_dict)
+            return {**res, "profile": report}
+        return self._invoke(input_dict)
+
+    @timed("request")
+    def _invoke(self, input_dict):
+        prep = self._prepare(input_dict)
+        if "result" in prep:
+            return prep
+
+        docs = prep["docs"]
+        try:
+            # Low temperature keeps responses consistent for policy Q&A.
+            completion = self._create_chat_completion(prep["system_msg"], prep["prior_msgs"], prep["query"])
+            ans = completion.choices[0].message.content
+            ans = self._format_answer(ans)
+            self._cache_answer(prep, ans)
+        except Exception as e:
+            # Surface upstream errors without crashing the app.
+            ans = f"Connection Error: {str(e)}"
+
+        return {
+            "result": ans,
+            # Return sources so UI can show citations for trust and auditability.
+            "source_documents": docs,
+            "prompt_tokens": prep["tokens"],
+        }
+
+    def stream(self, input_dict):
+        # Yield {"delta": text} as tokens arrive, then one final invoke-style dict with "done".
+        t0 = time.perf_counter()
+        prep = self._prepare(input_dict)
+        if "result" in prep:
+            yield {**prep, "done": True}
+            return
+
+        docs = prep["docs"]
+        parts = []
+        try:
+            chunks = self._create_chat_completion(
+                prep["system_msg"], prep["prior_msgs"], prep["query"], stream=True
+            )
+            for chunk in chunks:
+                delta = self._chunk_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    yield {"delta": delta}
+            # Formatting regroups paragraphs, so it runs once on the complete answer.
+            ans = self._format_answer("".join(parts))
+            self._cache_answer(prep, ans)
+        except Exception as e:
+            # Keep whatever already streamed; the error is appended rather than replacing it.
+            partial = self._format_answer("".join(parts)) + "\n\n" if parts else ""
+            ans = f"{partial}Connection Error: {str(e)}"
+
+        get_metrics().observe("request_stream", time.perf_counter() - t0)
+        yield {"result": ans, "source_documents": docs, "prompt_tokens": prep["tokens"], "done": True}
+
+    @timed("request")
+    async def ainvoke(self, input_dict, retrieved=None):
+        # Async twin of invoke(): same result dict, no thread held while waiting on the LLM.
+        # retrieved: (docs, qvec) from retrieve_batch(), skips the per-query search.
+        prep = await self._aprepare(input_dict, retrieved)
+        if "result" in prep:
+            return prep
+
+        docs = prep["docs"]
+        try:
+            completion = await self._acreate_chat_completion(prep["system_msg"], prep["prior_msgs"], prep["query"])
+            ans = self._format_answer(completion.choices[0].message.content)
+            self._cache_answer(prep, ans)
+        except Exception as e:
+            ans = f"Connection Error: {str(e)}"
+
+        return {"result": ans, "source_documents": docs, "prompt_tokens": prep["tokens"]}
+
+    async def astream(self, input_dict):
+        # Async twin of stream(): same {"delta"} events and final "done" dict.
+        t0 = time.perf_counter()
+        prep = await self._aprepare(input_dict)
+        if "result" in prep:
+            yield {**prep, "done": True}
+            return
+
+        docs = prep["docs"]
+        parts = []
+        try:
+            chunks = await self._acreate_chat_completion(
+                prep["system_msg"], prep["prior_msgs"], prep["query"], stream=True
+            )
+            async for chunk in chunks:
+                delta = self._chunk_text(chunk)
+                if delta:
+                    parts.append(delta)
+                    yield {"delta": delta}
+            ans = self._format_answer("".join(parts))
+            self._cache_answer(prep, ans)
+        except Exception as e:
+            partial = self._format_answer("".join(parts)) + "\n\n" if parts else ""
+            ans = f"{partial}Connection Error: {str(e)}"
+
+        get_metrics().observe("request_stream", time.perf_counter() - t0)
+        yield {"result": ans, "source_documents": docs, "prompt_tokens": prep["tokens"], "done": True}
+
+    async def aclose(self):
+        # Release pooled connections of the async client (e.g. on server shutdown).
+        if self._aio is not None:
+            await self._aio[1].close()
+            self._aio = None
+
+    @staticmethod
+    def _chunk_text(chunk):
+        choices = getattr(chunk, "choices", None) or []
+        if not choices:
+            return ""
+        delta = getattr(choices[0], "delta", None)
+        return getattr(delta, "content", None) or ""
+
+    def _prepare(self, input_dict):
+        # Shared by invoke/stream: returns either a final "result" or the chat-completion inputs.
+        query = input_dict["query"]
+        docs, qvec = self._retrieve(query, input_dict.get("filters"))
+        history = self._history(input_dict.get("chat_history", []))
+        return self._assemble(query, docs, qvec, history, self._packer())
+
+    async def _aprepare(self, input_dict, retrieved=None):
+        # Embedding + search and packer/tokenizer setup overlap; history filtering runs meanwhile.
+        loop = asyncio.get_running_loop()
         query = input_dict["query"]
-        chat_history = input_dict.get("chat_history", [])
+        if retrieved is None:
+            retrieved = loop.run_in_executor(_aio_pool, self._retrieve, query, input_dict.get("filters"))
+        else:
+            retrieved = asyncio.sleep(0, retrieved)
+        packer = loop.run_in_executor(_aio_pool, self._packer)
+        history = self._history(input_dict.get("chat_history", []))
+        (docs, qvec), packer = await asyncio.gather(retrieved, packer)
+        return await loop.run_in_executor(_aio_pool, self._assemble, query, docs, qvec, history, packer)
 
+    def _retrieve(self, query, filters=None):
         # 1. Retrieve Docs
         # Retrieve first so the LLM response is grounded in BMW documents, not guesswork.
-        docs = self.vector_store.similarity_search(query, k=Cfg.k_ret)
-        docs = self._filter_docs_by_source(docs)
+        # Embed once and reuse the vector for both search and the semantic answer cache.
+        # Source/file-type/page filters are applied inside the index search, so k hits still come back.
+        self._maybe_reload()
+        # A query finishes on the retriever it started with, even if a reload swaps it meanwhile.
+        with self._using() as retriever, span("retrieve"):
+            if not self.reranker:
+                return retriever.search(query, Cfg.k_ret, filters)
+            # Over-fetch, then let the cross-encoder pick the best k.
+            docs, qvec = retriever.search(query, max(Cfg.rr_fetch_k, Cfg.k_ret), filters)
+        with span("rerank"):
+            return self.reranker.rerank(query, docs, Cfg.k_ret), qvec
+
+    def retrieve_batch(self, queries, filters=None):
+        # Batch twin of _retrieve(): one embedding call and one FAISS search over the query matrix.
+        # Returns [(docs, qvec)] per query and the batch's stage times in ms.
+        self._maybe_reload()
+        k = max(Cfg.rr_fetch_k, Cfg.k_ret) if self.reranker else Cfg.k_ret
+        times = {}
+        with self._using() as retriever:
+            t0 = time.perf_counter()
+            with span("embed_batch"):
+                qvecs = retriever.embed_queries(queries)
+            t1 = time.perf_counter()
+            with span("search_batch"):
+                hits = retriever.search_batch(queries, qvecs, k, filters)
+            t2 = time.perf_counter()
+        times["embed_ms"], times["search_ms"] = (t1 - t0) * 1000, (t2 - t1) * 1000
+        if self.reranker:
+            with span("rerank"):
+                hits = [self.reranker.rerank(q, docs, Cfg.k_ret) for q, docs in zip(queries, hits)]
+            times["rerank_ms"] = (time.perf_counter() - t2) * 1000
+        return list(zip(hits, qvecs)), times
+
+    def _maybe_reload(self):
+        # Poll the CURRENT pointer at most every idx_reload_check_s; one thread loads, the rest keep serving.
+        if not self._follow or time.monotonic() < self._reload_at or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._reload_at = time.monotonic() + Cfg.idx_reload_check_s
+            ver = current_version()
+            if ver is None or ver == self.version:
+                return
+            ve = VecEng()
+            vs = ve.ld_idx()
+            if vs is None:
+                return
+            with self._use_lock:
+                old, self.retriever = self.retriever, HybridRetriever(vs, ve.bm25, ve.exact, ve.meta)
+                self.vector_store = vs
+                idle = old not in self._users
+            if idle:
+                old.close()
+            self.version = ve.version
+            if self.ans_cache:
+                # Another process may have published it; answers built on retired chunks must go here too.
+                self.ans_cache.clear()
+            inc("index_reloads")
+            print(f"Switched to index version {ve.version}")
+        except Exception as e:
+            # Keep serving the loaded version; the next check retries.
+            print(f"Index reload failed: {str(e)}")
+        finally:
+            self._reload_lock.release()
+
+    @contextmanager
+    def _using(self):
+        # The current retriever, counted as in use until the block exits.
+        with self._use_lock:
+            retriever = self.retriever
+            self._users[retriever] = self._users.get(retriever, 0) + 1
+        try:
+            yield retriever
+        finally:
+            with self._use_lock:
+                n = self._users.pop(retriever) - 1
+                if n:
+                    self._users[retriever] = n
+                retired = not n and retriever is not self.retriever
+            if retired:
+                # Last query on a version a reload replaced: its chunk store can go.
+                retriever.close()
 
+    @staticmethod
+    def _history(chat_history):
+        # Keep message roles constrained to user/assistant for history.
+        return [
+            {"role": m["role"], "content": m["content"]}
+            for m in chat_history
+            if m.get("role") in ("user", "assistant") and m.get("content")
+        ]
+
+    def _assemble(self, query, docs, qvec, history, packer):
         if not docs:
             return {
                 "result": "I don't know based on the current BMW knowledge sources. Please re-index with BMW files.",
                 "source_documents": [],
             }
-        
+
+        chunk_ids = [d.id or chunk_id(d) for d in docs]
+
         # 2. Build messages for chat-completions
-        context_text = "\n\n".join([d.page_content for d in docs])
-        system_msg = (
+        system_prefix = (
             # Strict system prompt to avoid hallucination and keep BMW answers grounded.
             "You are BMW Assistant, a helpful assistant providing clear, professional answers about BMW company information and BMW vehicles. "
             "Write in clear paragraphs. Only use numbered lists (1. 2. 3.) when absolutely necessary for step-by-step instructions. "
             "DO NOT use bullet points or dashes. Avoid any sub-bullets or nested formatting. "
             "Keep answers concise and grounded in the provided context. "
             "If you don't know, say 'I don't know'. Do not make up facts.\n\n"
-            f"Context:\n{context_text}"
+            "Context:\n"
         )
 
         if not self.api_token:
@@ -61,95 +363,361 @@ class RAGBot:
                 "source_documents": docs,
             }
 
-        try:
-            # Keep message roles constrained to user/assistant for history.
-            prior_msgs = [
-                {"role": m["role"], "content": m["content"]}
-                for m in chat_history
-                if m.get("role") in ("user", "assistant") and m.get("content")
-            ]
-            # Low temperature keeps responses consistent for policy Q&A.
-            completion = self._create_chat_completion(system_msg, prior_msgs, query)
-            ans = completion.choices[0].message.content
-            ans = self._format_answer(ans)
-        except Exception as e:
-            # Surface upstream errors without crashing the app.
-            ans = f"Connection Error: {str(e)}"
-
+        # Fit context and history into the active model's token budget.
+        with span("pack"):
+            packed = packer.pack(system_prefix, docs, history, query)
+        cache_hist = self._cache_history(packed["prior_msgs"], query)
+        if self.ans_cache and any(qvec):
+            # Keyed on the history the model would see too, so a follow-up never gets another thread's answer.
+            hit = self.ans_cache.get(qvec, chunk_ids, cache_hist)
+            inc("ans_cache_hits" if hit else "ans_cache_misses")
+            if hit:
+                # Near-identical question over the same context: skip the LLM entirely.
+                return {"result": hit[0], "source_documents": hit[1], "cached": True}
         return {
-            "result": ans,
-            # Return sources so UI can show citations for trust and auditability.
-            "source_documents": docs
+            "docs": packed["docs"],
+            "system_msg": system_prefix + packed["context_text"],
+            "prior_msgs": packed["prior_msgs"],
+            "tokens": packed["tokens"],
+            "query": query,
+            "qvec": qvec,
+            "chunk_ids": chunk_ids,
+            "cache_hist": cache_hist,
         }
 
+    def _packer(self):
+        # One packer per model; the active model can change when a fallback is promoted.
+        packer = self._packers.get(self.repo_id)
+        if packer is None:
+            packer = self._packers[self.repo_id] = PromptPacker(self.repo_id)
+        return packer
+
+    def _cache_answer(self, prep, ans):
+        # Only genuine answers are cached; zero query vectors mean the embedder fell back.
+        if self.ans_cache and any(prep["qvec"]):
+            self.ans_cache.put(prep["qvec"], prep["chunk_ids"], ans, prep["docs"], prep["cache_hist"])
+
     @staticmethod
-    def _filter_docs_by_source(docs):
-        keywords = tuple(getattr(Cfg, "source_filename_keywords", ()))
-        if not keywords:
-            return docs
-
-        filtered = []
-        for d in docs:
-            src = str(getattr(d, "metadata", {}).get("source", "")).lower()
-            if any(k in src for k in keywords):
-                filtered.append(d)
-        return filtered
-
-    def _create_chat_completion(self, system_msg, prior_msgs, query):
-        attempted_models = []
-        last_error = None
-        candidate_models = (self.repo_id, *self.fallback_models)
+    def _cache_history(prior_msgs, query):
+        # Clients save the question into the history before sending it; keyed with it, only the
+        # exact same wording could ever hit. Only the turns before it identify the conversation.
+        if prior_msgs and prior_msgs[-1] == {"role": "user", "content": query}:
+            return prior_msgs[:-1]
+        return prior_msgs
+
+    def _create_chat_completion(self, system_msg, prior_msgs, query, stream=False):
+        messages = self._messages(system_msg, prior_msgs, query)
+        candidates = self._candidates()
+        if Cfg.hedge_enabled and len(candidates) > 1:
+            return self._hedged(candidates, messages, stream)
+
         # Try each candidate model. For transient network/provider errors (timeouts,
         # 502/503/504), retry a few times then continue to the next candidate so the
         # app can fall back instead of crashing.
-        for model_name in candidate_models:
+        attempted_models = []
+        last_error = None
+        for model_name in candidates:
             attempted_models.append(model_name)
-            # Per-model retry attempts for transient failures
-            retries = 3
-            backoff = 1.0
-            for attempt in range(1, retries + 1):
-                try:
-                    completion = self.client.chat.completions.create(
-                        model=model_name,
-                        messages=[
-                            {"role": "system", "content": system_msg},
-                            *prior_msgs,
-                            {"role": "user", "content": query},
-                        ],
-                        max_tokens=512,
-                        temperature=0.1,
+            try:
+                completion = self._call_model(model_name, messages, stream)
+            except _ModelFailed as e:
+                last_error = e.error
+                continue
+            if model_name != self.repo_id:
+                # Promote a working fallback so future calls succeed faster.
+                inc("llm_fallbacks", model=model_name)
+                self.repo_id = model_name
+            return completion
+
+        self._raise_exhausted(attempted_models, last_error)
+
+    def _call_model(self, model_name, messages, stream=False, stop=None, clients=None):
+        # One model with per-model retries; raises _ModelFailed when the caller should move on.
+        # Hedged calls (stop set by _hedged once another model won) each get their own client,
+        # listed in clients, so a loser's response can be closed without touching the winner's.
+        retries = 3
+        backoff = 1.0
+        for attempt in range(1, retries + 1):
+            t0 = time.perf_counter()
+            client = self.client
+            if stop is not None:
+                client = self._call_client()
+                clients.append(client)
+            try:
+                # Low temperature keeps responses consistent for policy Q&A.
+                completion = client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    max_tokens=512,
+                    temperature=0.1,
+                    stream=stream,
+                )
+                if stream:
+                    # Pull the first chunk here so pre-token failures still retry/fall back.
+                    it = iter(completion)
+                    first = next(it, None)
+                    completion = _Stream(client, first, it) if stop is not None else itertools.chain(
+                        [first] if first is not None else [], it
                     )
-                    if model_name != self.repo_id:
-                        # Promote a working fallback so future calls succeed faster.
-                        self.repo_id = model_name
-                    return completion
-                except Exception as error:
-                    err_text = str(error).lower()
-                    model_not_supported = "model_not_supported" in err_text or "not supported" in err_text
-                    transient = any(x in err_text for x in ("504", "502", "503", "gateway", "timeout", "timed out", "connection"))
+                elif stop is not None:
+                    client.close()
+                # Time to first token for streams, full answer otherwise.
+                self._record_ok(model_name, time.perf_counter() - t0, stream)
+                if stop is not None and stop.is_set():
+                    # Another model already answered: drop this one's connection now.
+                    client.close()
+                    return None
+                return completion
+            except Exception as error:
+                if stop is not None and stop.is_set():
+                    # Closed under us by the winner: not a failure, but at least this slow.
+                    client.close()
+                    self.health.censored(model_name, time.perf_counter() - t0)
+                    raise _ModelFailed(error)
+                model_not_supported, transient = self._classify_error(error)
+                if not (model_not_supported or transient):
+                    # Non-transient, non-model-support error — surface it to caller.
+                    raise
+                self._record_fail(model_name)
+                if model_not_supported:
+                    # Model truly unsupported by provider — try next candidate model.
+                    raise _ModelFailed(error)
+                if attempt < retries and self.health.available(model_name):
+                    # Wait an increasing amount of time and retry the same model; a hedge loser
+                    # wakes as soon as the winner is known and gives up.
+                    inc("llm_retries", model=model_name)
+                    if stop is not None:
+                        if stop.wait(backoff):
+                            raise _ModelFailed(error)
+                    else:
+                        time.sleep(backoff)
+                    backoff *= 2
+                    continue
+                # Exhausted retries (or breaker opened) — caller tries the next candidate.
+                raise _ModelFailed(error)
 
-                    if model_not_supported:
-                        # Model truly unsupported by provider — try next candidate model.
-                        last_error = error
-                        break
+    def _call_client(self):
+        # Clients are cheap: they all share huggingface_hub's HTTP session (and its connection pool).
+        # The timeout also bounds a loser still waiting for headers, which close() can't reach yet.
+        return InferenceClient(api_key=self.api_token, timeout=Cfg.llm_timeout_s)
 
-                    if transient and attempt < retries:
-                        # Wait an increasing amount of time and retry the same model.
-                        import time
+    def _hedged(self, candidates, messages, stream=False):
+        # Start the best candidate; each time the newest one outlives its p95-based deadline
+        # (or fails), start the next. First success wins; the rest are stopped and closed.
+        attempted_models = []
+        last_error = None
+        running = {}
+        queue = iter(candidates)
+        stop = threading.Event()
+        clients = []
+        keep = None
 
-                        time.sleep(backoff)
-                        backoff *= 2
-                        last_error = error
+        def launch():
+            model_name = next(queue, None)
+            if model_name is not None:
+                attempted_models.append(model_name)
+                fut = _hedge_pool.submit(self._call_model, model_name, messages, stream, stop, clients)
+                running[fut] = model_name
+            return model_name
+
+        newest = launch()
+        try:
+            while running:
+                timeout = self.health.hedge_delay(newest) if newest is not None else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    newest = launch()
+                    if newest is not None:
+                        inc("llm_hedges")
+                    continue
+                for fut in done:
+                    model_name = running.pop(fut)
+                    try:
+                        completion = fut.result()
+                    except _ModelFailed as e:
+                        last_error = e.error
+                        if not running:
+                            newest = launch()
                         continue
+                    self._promote_if_failed(model_name)
+                    keep = getattr(completion, "client", None)
+                    return completion
+        finally:
+            # Losers that haven't started are cancelled. Running ones stop retrying, and closing
+            # their clients ends a pending stream or response read (one still waiting for headers
+            # closes itself when they arrive).
+            stop.set()
+            for fut in running:
+                fut.cancel()
+            for client in list(clients):
+                if client is not keep:
+                    client.close()
 
-                    if transient:
-                        # Exhausted retries for this model — record and try next candidate.
-                        last_error = error
-                        break
+        self._raise_exhausted(attempted_models, last_error)
 
-                    # Non-transient, non-model-support error — surface it to caller.
+    async def _acreate_chat_completion(self, system_msg, prior_msgs, query, stream=False):
+        # Same retry/fallback/hedging policy as _create_chat_completion, but nothing blocks a thread.
+        messages = self._messages(system_msg, prior_msgs, query)
+        candidates = self._candidates()
+        if Cfg.hedge_enabled and len(candidates) > 1:
+            return await self._ahedged(candidates, messages, stream)
+
+        attempted_models = []
+        last_error = None
+        for model_name in candidates:
+            attempted_models.append(model_name)
+            try:
+                completion = await self._acall_model(model_name, messages, stream)
+            except _ModelFailed as e:
+                last_error = e.error
+                continue
+            if model_name != self.repo_id:
+                inc("llm_fallbacks", model=model_name)
+                self.repo_id = model_name
+            return completion
+
+        self._raise_exhausted(attempted_models, last_error)
+
+    async def _acall_model(self, model_name, messages, stream=False):
+        retries = 3
+        backoff = 1.0
+        for attempt in range(1, retries + 1):
+            t0 = time.perf_counter()
+            try:
+                completion = await self._aclient().chat_completion(
+                    model=model_name,
+                    messages=messages,
+                    max_tokens=512,
+                    temperature=0.1,
+                    stream=stream,
+                )
+                if stream:
+                    completion = await self._apeek(completion)
+                self._record_ok(model_name, time.perf_counter() - t0, stream)
+                return completion
+            except asyncio.CancelledError:
+                # A hedge loser (or a dropped request): its latency is only known to exceed this.
+                self.health.censored(model_name, time.perf_counter() - t0)
+                raise
+            except Exception as error:
+                model_not_supported, transient = self._classify_error(error)
+                if not (model_not_supported or transient):
                     raise
+                self._record_fail(model_name)
+                if model_not_supported:
+                    raise _ModelFailed(error)
+                if attempt < retries and self.health.available(model_name):
+                    inc("llm_retries", model=model_name)
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                    continue
+                raise _ModelFailed(error)
+
+    async def _ahedged(self, candidates, messages, stream=False):
+        # Async hedging: losers are really cancelled, closing their HTTP requests.
+        attempted_models = []
+        last_error = None
+        running = {}
+        queue = iter(candidates)
+
+        def launch():
+            model_name = next(queue, None)
+            if model_name is not None:
+                attempted_models.append(model_name)
+                running[asyncio.ensure_future(self._acall_model(model_name, messages, stream))] = model_name
+            return model_name
+
+        newest = launch()
+        try:
+            while running:
+                timeout = self.health.hedge_delay(newest) if newest is not None else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    newest = launch()
+                    if newest is not None:
+                        inc("llm_hedges")
+                    continue
+                for task in done:
+                    model_name = running.pop(task)
+                    try:
+                        completion = task.result()
+                    except _ModelFailed as e:
+                        last_error = e.error
+                        if not running:
+                            newest = launch()
+                        continue
+                    self._promote_if_failed(model_name)
+                    return completion
+        finally:
+            for task in running:
+                task.cancel()
+
+        self._raise_exhausted(attempted_models, last_error)
+
+    def _record_ok(self, model_name, secs, stream):
+        # Stream latency is time to first token; the hedge deadline uses the same measure.
+        self.health.ok(model_name, secs)
+        get_metrics().observe("llm_first_token" if stream else "llm", secs)
+
+    def _record_fail(self, model_name):
+        was_available = self.health.available(model_name)
+        self.health.fail(model_name)
+        inc("llm_errors", model=model_name)
+        if was_available and not self.health.available(model_name):
+            inc("llm_breaker_open", model=model_name)
 
+    @staticmethod
+    def _messages(system_msg, prior_msgs, query):
+        return [
+            {"role": "system", "content": system_msg},
+            *prior_msgs,
+            {"role": "user", "content": query},
+        ]
+
+    def _candidates(self):
+        # Active model first, then the configured primary and fallbacks; models whose
+        # circuit breaker is open are skipped unless every model is currently open.
+        models = list(dict.fromkeys((self.repo_id, Cfg.llm_model, *self.fallback_models)))
+        return [m for m in models if self.health.available(m)] or models
+
+    def _promote_if_failed(self, model_name):
+        # A hedge that merely beat a slow primary doesn't replace it; one that covered a failure does.
+        if model_name != self.repo_id and not self.health.available(self.repo_id):
+            self.repo_id = model_name
+
+    def _aclient(self):
+        # One AsyncInferenceClient (and its pooled HTTP session) per event loop.
+        loop = asyncio.get_running_loop()
+        if self._aio is None or self._aio[0] is not loop:
+            self._aio = (loop, AsyncInferenceClient(api_key=self.api_token, timeout=Cfg.llm_timeout_s))
+        return self._aio[1]
+
+    @staticmethod
+    async def _apeek(chunks):
+        it = chunks.__aiter__()
+        try:
+            first = await it.__anext__()
+        except StopAsyncIteration:
+            first = None
+
+        async def gen():
+            if first is not None:
+                yield first
+            async for chunk in it:
+                yield chunk
+
+        return gen()
+
+    @staticmethod
+    def _classify_error(error):
+        # (model not supported by provider, transient network/provider error)
+        err_text = str(error).lower()
+        model_not_supported = "model_not_supported" in err_text or "not supported" in err_text
+        transient = any(x in err_text for x in ("504", "502", "503", "gateway", "timeout", "timed out", "connection"))
+        return model_not_supported, transient
+
+    @staticmethod
+    def _raise_exhausted(attempted_models, last_error):
         if last_error:
             raise RuntimeError(
                 "No supported chat model found. "
@@ -161,6 +729,7 @@ class RAGBot:
         raise RuntimeError("No chat model candidates configured.")
 
     @staticmethod
+    @timed("format")
     def _format_answer(text):
         cleaned = (text or "").strip()
         if not cleaned:
@@ -245,4 +814,14 @@ class RAGBot:
         if current_para:
             paragraphs.append(" ".join(current_para))
         
-        return "\n\n".join(paragraphs)
\ No newline at end of file
+        return "\n\n".join(paragraphs)
+
+def load_bot():
+    # Bot over the live index, or over every built collection when INDEX_COLLECTIONS is set;
+    # None until something has been indexed.
+    if Cfg.collections:
+        sr = ShardedRetriever()
+        return RAGBot(None, retriever=sr) if sr.names() else None
+    ve = VecEng()
+    idx = ve.ld_idx()
+    return RAGBot(idx, bm25=ve.bm25, version=ve.version, exact=ve.exact, meta=ve.meta) if idx else None
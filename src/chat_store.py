@@ -0,0 +1,67 @@
+# ChatStore: append-only, session-keyed chat history in SQLite (WAL).
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+from src.config import Cfg
+
+class ChatStore:
+    def __init__(self, path=None):
+        self.path = path or Cfg.chat_db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        uri = "file:" + pathname2url(os.path.abspath(self.path))
+        # One connection shared across Streamlit/server threads, serialised by a lock;
+        # WAL + busy timeout let other processes append at the same time.
+        self._con = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=Cfg.chat_busy_timeout_s)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            # Appends survive an app crash; fsync per checkpoint rather than per message.
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session, id)")
+            self._con.commit()
+
+    def append(self, session, role, content):
+        # One indexed INSERT per message, independent of how long the history is.
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO messages (session, role, content, ts) VALUES (?, ?, ?, ?)",
+                (session, role, content, time.time()),
+            )
+            self._con.commit()
+
+    def recent(self, session, n):
+        # Last n messages of one session, oldest first; reads only those rows via the index.
+        with self._lock:
+            rows = self._con.execute(
+                "SELECT role, content FROM messages WHERE session = ? ORDER BY id DESC LIMIT ?",
+                (session, n),
+            ).fetchall()
+        return [{"role": r, "content": c} for r, c in reversed(rows)]
+
+    def clear(self, session):
+        with self._lock:
+            self._con.execute("DELETE FROM messages WHERE session = ?", (session,))
+            self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_chat_store():
+    # Shared by all sessions in the process; sessions are separated by key, not by file.
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
@@ -6,6 +6,15 @@ class Cfg:
     pg_title = "BMW Assistant Knowledge Base"
     # Embedding model optimized for speed/quality tradeoff in RAG.
     mdl_nm = "sentence-transformers/all-MiniLM-L6-v2"
+    # Embedding backend: "api" (HF Inference API), "local" (in-process ONNX on CPU) or "auto".
+    emb_backend = os.getenv("EMB_BACKEND", "api").strip().lower()
+    # ONNX export inside the model repo; the int8 variant is the fastest on AVX2 CPUs.
+    emb_onnx_file = os.getenv("EMB_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+    # Optional pre-downloaded model dir (tokenizer.json + onnx file) for offline replicas.
+    emb_local_dir = os.getenv("EMB_LOCAL_DIR", "")
+    # ONNX intra-op threads for local inference; 0 lets onnxruntime decide.
+    emb_threads = int(os.getenv("EMB_THREADS", "0"))
+    emb_max_len = 256
     # Chat model can be overridden with HUGGINGFACE_LLM_MODEL.
     llm_model = os.getenv("HUGGINGFACE_LLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct")
     # Optional comma-separated fallback models, used when the primary is unsupported.
@@ -16,24 +25,167 @@ class Cfg:
     llm_fallback_models = tuple(
         model.strip() for model in _fallback_models_env.split(",") if model.strip()
     )
+    # Per-request HTTP timeout for chat completions, so a hung provider can't hold a thread forever.
+    llm_timeout_s = float(os.getenv("LLM_TIMEOUT_S", "60"))
     # Chunking tuned to keep context focused while preserving meaning.
     ch_sz = 500
     ch_ol = 50
     # Retrieve top-k chunks to balance recall and prompt length.
     k_ret = 3
+    # Disk-backed LRU embedding cache (SQLite, shared by every process using the path); EMB_CACHE_MAX=0 disables it.
+    emb_cache_path = "data/emb_cache"
+    emb_cache_max = int(os.getenv("EMB_CACHE_MAX", "50000"))
+    # Batched embedding pipeline: texts per request, concurrent requests, attempts per batch.
+    emb_batch_sz = int(os.getenv("EMB_BATCH_SIZE", "32"))
+    emb_workers = int(os.getenv("EMB_WORKERS", "4"))
+    emb_retries = 3
+    # Semantic answer cache: cosine threshold, TTL (seconds) and max entries; 0 entries disables it.
+    ans_cache_thr = float(os.getenv("ANS_CACHE_THRESHOLD", "0.95"))
+    ans_cache_ttl = int(os.getenv("ANS_CACHE_TTL", "3600"))
+    ans_cache_max = int(os.getenv("ANS_CACHE_MAX", "512"))
+    # FAISS index type: auto, flat, ivf_flat, hnsw or ivf_pq. "auto" picks by vector count.
+    idx_type = os.getenv("FAISS_INDEX_TYPE", "auto").strip().lower()
+    idx_auto_flat_max = 20000
+    idx_auto_pq_min = 500000
+    # IVF: lists (0 = ~4*sqrt(n)), lists probed per query (at least nlist / idx_nprobe_div), max training sample.
+    idx_nlist = int(os.getenv("FAISS_NLIST", "0"))
+    idx_nprobe = int(os.getenv("FAISS_NPROBE", "16"))
+    idx_nprobe_div = int(os.getenv("FAISS_NPROBE_DIV", "16"))
+    idx_train_max = 65536
+    # IVF-PQ sub-quantizers (capped to a divisor of the embedding dim).
+    idx_pq_m = 48
+    # HNSW graph degree and build/search beam widths.
+    idx_hnsw_m = 32
+    idx_ef_construction = 200
+    idx_ef_search = int(os.getenv("FAISS_EF_SEARCH", "64"))
+    # Vector storage precision for flat / ivf_flat / hnsw: none (float32), fp16 or int8 scalar quantization.
+    idx_quant = os.getenv("FAISS_QUANT", "none").strip().lower()
+    # Quantized indexes fetch k * this many candidates and re-score them against the float32 copy
+    # kept on disk (memory-mapped, only candidate rows are read); 0 = no re-scoring.
+    idx_rescore = int(os.getenv("FAISS_RESCORE", "4"))
+    idx_exact_file = "vectors_f32.npy"
+    # Sampled queries for the build-time recall@k report against exact search.
+    idx_recall_queries = 200
+    # Hybrid retrieval: BM25 keyword hits fused with vector hits by reciprocal-rank fusion.
+    hyb_enabled = os.getenv("HYBRID_SEARCH", "1") != "0"
+    hyb_w_dense = float(os.getenv("HYBRID_W_DENSE", "1.0"))
+    hyb_w_sparse = float(os.getenv("HYBRID_W_SPARSE", "1.0"))
+    hyb_rrf_k = 60
+    # Candidates taken from each list before fusion.
+    hyb_fetch_k = 20
+    bm25_k1 = 1.5
+    bm25_b = 0.75
+    # Parallel ingestion: parser processes (0 = one per CPU) and chunks buffered per embedding flush.
+    ing_workers = int(os.getenv("INGEST_WORKERS", "0"))
+    ing_flush = 512
+    # Near-duplicate chunks (MinHash estimate of word-shingle Jaccard >= threshold) are merged before embedding.
+    dedup_enabled = os.getenv("DEDUP", "1") != "0"
+    dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+    dedup_shingle = 3
+    dedup_perms = 64
+    # Merged origins listed in a kept chunk's metadata (dup_count has the full number).
+    dedup_max_sources = 50
+    # Optional cross-encoder re-ranking: over-fetch rr_fetch_k hits, keep the best k_ret.
+    rr_enabled = os.getenv("RERANK", "0") == "1"
+    rr_model = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    rr_onnx_file = os.getenv("RERANK_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+    rr_local_dir = os.getenv("RERANK_LOCAL_DIR", "")
+    rr_fetch_k = 30
+    rr_batch_sz = 16
+    rr_max_len = 256
+    # Re-ranking stops (and falls back to retrieval order) once this budget is spent.
+    rr_budget_ms = float(os.getenv("RERANK_BUDGET_MS", "60"))
+    rr_cache_max = 4096
     # Ingestion + index paths are relative so the app is portable.
     d_path = "data/raw"
     v_path = "data/vector_store"
     idx_path = "faiss_index"
+    # Pickle-free layout inside idx_path: FAISS vectors, row->id list, SQLite chunk store.
+    idx_vec_file = "vectors.faiss"
+    idx_ids_file = "ids.txt"
+    idx_docs_db = "docs.sqlite"
+    # BM25 postings as memory-mapped CSR .npy arrays in this subdirectory.
+    idx_bm25_file = "bm25"
+    # Source / file-type / page filter index (CSR .npy arrays + keys.json) in this subdirectory.
+    idx_meta_dir = "meta"
+    # Memory-map the vector file read-only when serving queries (set FAISS_MMAP=0 to load into RAM).
+    idx_mmap = os.getenv("FAISS_MMAP", "1") != "0"
+    # Per-file and per-chunk content hashes, kept next to the index for incremental re-indexing.
+    idx_manifest = "manifest.json"
+    # Each build goes to idx_path/versions/<version>; CURRENT names the live one and is swapped atomically.
+    idx_current_file = "CURRENT"
+    # Re-index job state in idx_path, readable by every process (API workers, Streamlit).
+    idx_job_file = "index_job.json"
+    idx_keep_versions = 3
+    # How often a running RAGBot checks CURRENT for a newer index (seconds).
+    idx_reload_check_s = float(os.getenv("INDEX_RELOAD_CHECK_S", "2"))
+    # Optional per-collection shards, "name=kw1,kw2;name2=kw3": files go to the first collection with a
+    # keyword in their filename, the rest to default_collection. Empty = one index for everything.
+    collections = {
+        n.strip(): tuple(k.strip().lower() for k in kws.split(",") if k.strip())
+        for n, _, kws in (c.partition("=") for c in os.getenv("INDEX_COLLECTIONS", "").split(";"))
+        if n.strip()
+    }
+    default_collection = os.getenv("INDEX_DEFAULT_COLLECTION", "general")
+    # Shards kept loaded at once (least recently queried are dropped) and threads for the fan-out search.
+    shard_max_loaded = int(os.getenv("SHARD_MAX_LOADED", "8"))
+    shard_workers = int(os.getenv("SHARD_WORKERS", "8"))
     # Only ingest files whose names contain one of these keywords.
     # Override with SOURCE_FILENAME_KEYWORDS (comma-separated), e.g. "bmw,cars".
     _source_keywords_env = os.getenv("SOURCE_FILENAME_KEYWORDS", "bmw")
     source_filename_keywords = tuple(
         k.strip().lower() for k in _source_keywords_env.split(",") if k.strip()
     )
-    # Chat history persistence to keep conversations stateful across reruns.
-    chat_hist_path = "data/chat_history.json"
+    # Hedged chat completions: if a model is slower than ~its p95, race the next fallback.
+    hedge_enabled = os.getenv("LLM_HEDGE", "0") == "1"
+    hedge_window = 50
+    hedge_min_samples = 5
+    hedge_mult = 1.0
+    hedge_default_s = float(os.getenv("LLM_HEDGE_DEFAULT_S", "4.0"))
+    hedge_min_s = 0.5
+    hedge_max_s = 8.0
+    # Threads for racing sync calls; 0 = one per candidate model for each of API_MAX_INFLIGHT requests.
+    hedge_workers = int(os.getenv("LLM_HEDGE_WORKERS", "0"))
+    # Circuit breaker: skip a model for cb_cooldown_s after cb_fail_max consecutive failures.
+    cb_fail_max = 3
+    cb_cooldown_s = float(os.getenv("LLM_CB_COOLDOWN_S", "30"))
+    # Threads for blocking steps (embedding, FAISS, packing) of the async RAGBot path.
+    async_workers = int(os.getenv("ASYNC_WORKERS", "16"))
+    # Prompt token budget (system + context + history + query), with optional per-model overrides.
+    prompt_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+    prompt_budgets = {}
+    # Use the model's own tokenizer.json when reachable; otherwise estimate ~4 chars per token.
+    pack_use_tokenizer = os.getenv("PACK_TOKENIZER", "1") != "0"
+    # Tokenizers load in the background at bot start; this bounds the Hub metadata request.
+    pack_tok_timeout_s = float(os.getenv("PACK_TOKENIZER_TIMEOUT_S", "5"))
+    # Share of the budget history may take, per-message role overhead, min overlap to dedupe.
+    pack_hist_share = 0.3
+    pack_msg_overhead = 4
+    pack_min_overlap = 12
+    # Chat history persistence to keep conversations stateful across reruns (SQLite, one row per message).
+    chat_db_path = "data/chat_history.sqlite"
+    chat_busy_timeout_s = 5.0
     # Keep last N turns (user+assistant pairs) to control prompt length.
     hist_max_turns = 6
-
-    
\ No newline at end of file
+    # Headless HTTP API (src/api_server.py): bind address, worker processes, admission limits.
+    # Local only by default; set API_HOST=0.0.0.0 to serve other machines.
+    api_host = os.getenv("API_HOST", "127.0.0.1")
+    api_port = int(os.getenv("API_PORT", "8000"))
+    api_workers = int(os.getenv("API_WORKERS", "1"))
+    # Requests answered at once, requests allowed to wait for a slot, and how long they may wait.
+    api_max_inflight = int(os.getenv("API_MAX_INFLIGHT", "64"))
+    api_max_queue = int(os.getenv("API_MAX_QUEUE", "256"))
+    api_queue_timeout_s = float(os.getenv("API_QUEUE_TIMEOUT_S", "10"))
+    # Bearer token POST /reindex requires (the UI sends it too); unset = re-indexing over the API is off.
+    api_admin_token = os.getenv("API_ADMIN_TOKEN", "")
+    # When set, the Streamlit UI is a thin client of this API instead of loading the index itself.
+    api_url = os.getenv("RAG_API_URL", "").rstrip("/")
+    # Batch query CLI (scripts/batch_query.py): questions per retrieval batch, LLM calls in flight.
+    batch_size = int(os.getenv("BATCH_QUERY_SIZE", "64"))
+    batch_concurrency = int(os.getenv("BATCH_QUERY_CONCURRENCY", "8"))
+    # Metrics: histogram buckets (seconds), samples kept for UI percentiles, Prometheus name prefix.
+    metrics_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    metrics_recent = 512
+    metrics_prefix = "rag"
+    # Functions listed by the per-request cProfile hook.
+    profile_top = 25
@@ -0,0 +1,139 @@
+# ChunkDedup: MinHash/LSH near-duplicate filter between splitting and embedding.
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+from src.config import Cfg
+from src.metrics import inc
+
+# Prime just above 2**32; a, b and the shingle hashes stay below 2**32, so a * h fits in uint64.
+_PRIME = np.uint64(4294967311)
+
+def _bands(perms, threshold):
+    # Most rows per band whose LSH threshold (1/b)^(1/r) is still below the target, so pairs
+    # near the threshold become candidates; candidates are then checked on the full signature.
+    best = (perms, 1)
+    for r in range(1, perms + 1):
+        if perms % r == 0 and (1.0 / (perms // r)) ** (1.0 / r) <= threshold:
+            best = (perms // r, r)
+    return best
+
+def _origin(doc):
+    return {k: doc.metadata[k] for k in ("source", "page") if k in doc.metadata}
+
+class ChunkDedup:
+    def __init__(self, threshold=None, perms=None, shingle=None):
+        self.threshold = Cfg.dedup_threshold if threshold is None else threshold
+        self.perms = perms or Cfg.dedup_perms
+        self.shingle = shingle or Cfg.dedup_shingle
+        self.n_bands, self.rows = _bands(self.perms, self.threshold)
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, 2**32, self.perms, dtype=np.uint64)
+        self._b = rng.integers(0, 2**32, self.perms, dtype=np.uint64)
+        # Kept chunks: exact-text lookup, band buckets and signatures (perms x uint32 each).
+        self._exact = {}
+        self._buckets = [{} for _ in range(self.n_bands)]
+        self._sigs = []
+        self._ids = []
+        # Kept chunk id -> origins (source/page) of the chunks merged into it.
+        self.merged = {}
+        self.seen = self.exact = self.near = 0
+
+    def _signature(self, words):
+        n = self.shingle
+        grams = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        h = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        # perms x shingles hash table in one shot; min over shingles per permutation.
+        return ((self._a[:, None] * h[None, :] % _PRIME + self._b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _match(self, sig):
+        cands = set()
+        for b, bucket in enumerate(self._buckets):
+            cands.update(bucket.get(sig[b * self.rows:(b + 1) * self.rows].tobytes(), ()))
+        best, best_sim = None, self.threshold
+        for c in cands:
+            sim = float(np.count_nonzero(self._sigs[c] == sig)) / self.perms
+            if sim >= best_sim:
+                best, best_sim = c, sim
+        return best
+
+    def filter(self, chunks, chunk_id):
+        # Yields chunks that are not near-duplicates of an earlier one, in input order.
+        # The first copy is kept; later copies only add their origin to self.merged.
+        for d in chunks:
+            self.seen += 1
+            words = re.sub(r"\s+", " ", d.page_content.lower()).strip().split(" ")
+            key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+            rep = self._exact.get(key)
+            if rep is not None:
+                self.exact += 1
+                self.merged.setdefault(self._ids[rep], []).append(_origin(d))
+                continue
+            sig = self._signature(words)
+            rep = self._match(sig)
+            if rep is not None:
+                self.near += 1
+                self.merged.setdefault(self._ids[rep], []).append(_origin(d))
+                continue
+            idx = len(self._ids)
+            self._ids.append(chunk_id(d))
+            self._sigs.append(sig)
+            self._exact[key] = idx
+            for b, bucket in enumerate(self._buckets):
+                bucket.setdefault(sig[b * self.rows:(b + 1) * self.rows].tobytes(), []).append(idx)
+            yield d
+
+    def apply(self, store):
+        # Write provenance into the kept chunks' metadata; chunks whose copies are gone lose theirs.
+        # Runs after ingestion because a chunk is stored before its later copies are seen.
+        todo = dict(self.merged)
+        if hasattr(store, "iter_meta"):
+            for cid, meta in store.iter_meta():
+                if "dup_sources" in meta and cid not in todo:
+                    todo[cid] = []
+        ids = list(todo)
+        rows = {}
+        for s in range(0, len(ids), 1000):
+            for cid, d in zip(ids[s:s + 1000], store.search_many(ids[s:s + 1000])):
+                if d is None:
+                    continue
+                meta = {k: v for k, v in d.metadata.items() if k not in ("dup_sources", "dup_count")}
+                if todo[cid]:
+                    meta["dup_sources"] = todo[cid][:Cfg.dedup_max_sources]
+                    meta["dup_count"] = len(todo[cid])
+                if meta != d.metadata:
+                    d.metadata = meta
+                    rows[cid] = d
+        if rows:
+            store.add(rows)
+        return len(rows)
+
+    def mark_files(self, files):
+        # Manifest entries of sources that had chunks dropped here; those files are always re-parsed.
+        for origins in self.merged.values():
+            for o in origins:
+                if o.get("source") in files:
+                    files[o["source"]]["dups"] = True
+
+    def stats(self):
+        dropped = self.exact + self.near
+        # Every dropped chunk is one embedding input fewer; calls are counted in API batches.
+        return {
+            "seen": self.seen,
+            "kept": self.seen - dropped,
+            "exact": self.exact,
+            "near": self.near,
+            "emb_calls_saved": -(-dropped // max(1, Cfg.emb_batch_sz)),
+        }
+
+    def report(self):
+        st = self.stats()
+        inc("dedup_dropped", st["exact"] + st["near"])
+        if st["exact"] or st["near"]:
+            print(
+                f"Dedup: merged {st['exact']} exact + {st['near']} near-duplicate chunks of {st['seen']} "
+                f"(~{st['emb_calls_saved']} embedding calls saved)"
+            )
+        return st
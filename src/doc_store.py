@@ -0,0 +1,71 @@
+# SqliteDocstore: pickle-free chunk store; text is fetched per id only for search hits.
+import json
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+class SqliteDocstore(Docstore, AddableMixin):
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        uri = "file:" + pathname2url(os.path.abspath(path)) + ("?mode=ro" if read_only else "")
+        # One connection shared across Streamlit/server threads, serialised by a lock.
+        self._con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        if not read_only:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, text TEXT NOT NULL, meta TEXT NOT NULL)"
+            )
+            self._con.commit()
+
+    def search(self, search):
+        with self._lock:
+            row = self._con.execute("SELECT text, meta FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            # Same contract as InMemoryDocstore: a message string instead of a Document.
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def search_many(self, ids):
+        # Batched fetch for top-k hits; preserves the order of ids.
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._con.execute(
+                f"SELECT id, text, meta FROM docs WHERE id IN ({marks})", list(ids)
+            ).fetchall()
+        found = {r[0]: Document(id=r[0], page_content=r[1], metadata=json.loads(r[2])) for r in rows}
+        return [found.get(i) for i in ids]
+
+    def add(self, texts):
+        # Rows stay uncommitted until commit(), so the index file and docstore switch together.
+        rows = [
+            (i, d.page_content, json.dumps(d.metadata, default=str))
+            for i, d in texts.items()
+        ]
+        with self._lock:
+            self._con.executemany("INSERT OR REPLACE INTO docs (id, text, meta) VALUES (?, ?, ?)", rows)
+
+    def delete(self, ids):
+        with self._lock:
+            self._con.executemany("DELETE FROM docs WHERE id = ?", [(i,) for i in ids])
+
+    def iter_meta(self):
+        # Metadata only, no chunk text: used to build per-source lookups cheaply.
+        with self._lock:
+            rows = self._con.execute("SELECT id, meta FROM docs").fetchall()
+        for i, m in rows:
+            yield i, json.loads(m)
+
+    def commit(self):
+        with self._lock:
+            self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
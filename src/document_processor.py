@@ -1,27 +1,63 @@
 # DocProc: load raw files and split into retrievable chunks.
+import multiprocessing
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from src.config import Cfg
+from src.metrics import get_metrics
+
+_spl = None
+
+def _splitter():
+    # One splitter per worker process.
+    global _spl
+    if _spl is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-class DocProc:
-    def __init__(self):
         # Recursive splitter balances context size and retrieval granularity.
-        self.spl = RecursiveCharacterTextSplitter(
+        _spl = RecursiveCharacterTextSplitter(
             chunk_size=Cfg.ch_sz,
             chunk_overlap=Cfg.ch_ol
         )
-    def ld_docs(self):
-        raw_d = []
+    return _spl
+
+def _load_file(fp):
+    # Loaders (and pypdf) are imported on first use: only re-indexing needs them.
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+    if fp.endswith(".txt"):
+        # TextLoader is the simplest path for internal policy docs.
+        return TextLoader(fp, encoding="utf-8").load()
+    # Support PDFs because policy documents often come from HR/legal exports.
+    return PyPDFLoader(fp).load()
+
+def _init_worker(ch_sz, ch_ol):
+    # Spawned workers re-import Cfg from the environment; carry over the parent's split settings.
+    Cfg.ch_sz, Cfg.ch_ol = ch_sz, ch_ol
+
+def _load_split(fp):
+    # Runs in a worker process: parse + split one file, return its chunks and the time it took
+    # (metrics recorded in a worker process would never reach the parent).
+    t0 = time.perf_counter()
+    frags = _splitter().split_documents(_load_file(fp))
+    return frags, time.perf_counter() - t0
+
+class DocProc:
+    def __init__(self):
+        self.spl = _splitter()
+
+    def ld_files(self):
         if not os.path.exists(Cfg.d_path):
             # Create the folder on first run so the admin can drop files in easily.
             os.makedirs(Cfg.d_path)
-            return raw_d
+            return []
 
         keywords = getattr(Cfg, "source_filename_keywords", ())
 
-        for f in os.listdir(Cfg.d_path):
+        files = []
+        for f in sorted(os.listdir(Cfg.d_path)):
             fp = os.path.join(Cfg.d_path, f)
             if not os.path.isfile(fp):
                 continue
@@ -30,23 +66,53 @@ class DocProc:
             if keywords and not any(k in f.lower() for k in keywords):
                 continue
 
-            if f.endswith(".txt"):
-                # TextLoader is the simplest path for internal policy docs.
-                l = TextLoader(fp, encoding="utf-8")
-                raw_d.extend(l.load())
-            elif f.endswith(".pdf"):
-                # Support PDFs because policy documents often come from HR/legal exports.
-                l = PyPDFLoader(fp)
-                raw_d.extend(l.load())
+            if f.endswith(".txt") or f.endswith(".pdf"):
+                files.append(fp)
+        return files
+
+    def ld_docs(self):
+        raw_d = []
+        for fp in self.ld_files():
+            raw_d.extend(_load_file(fp))
         return raw_d
 
+    def iter_frags(self, files=None):
+        # Yield chunks file by file; parsing runs in a process pool with bounded look-ahead,
+        # so memory holds at most ~2 parsed files per worker regardless of drop size.
+        files = self.ld_files() if files is None else list(files)
+        workers = min(Cfg.ing_workers or os.cpu_count() or 1, len(files))
+        metrics = get_metrics()
+        if workers <= 1:
+            for fp in files:
+                frags, secs = _load_split(fp)
+                metrics.observe("parse_file", secs)
+                yield from frags
+            return
+
+        # Spawned, not forked: the parent holds threads (embedding pools, uvicorn, Streamlit) and their locks.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(Cfg.ch_sz, Cfg.ch_ol),
+        ) as pool:
+            it = iter(files)
+            pending = deque()
+            for _, fp in zip(range(workers * 2), it):
+                pending.append(pool.submit(_load_split, fp))
+            while pending:
+                frags, secs = pending.popleft().result()
+                metrics.observe("parse_file", secs)
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append(pool.submit(_load_split, nxt))
+                yield from frags
+
     def get_frags(self):
-        d = self.ld_docs()
-        if not d:
+        # Chunking improves retrieval accuracy by matching smaller, focused passages.
+        frags = list(self.iter_frags())
+        if not frags:
             print("No documents found to ingest.")
             return []
-        # Chunking improves retrieval accuracy by matching smaller, focused passages.
-        frags = self.spl.split_documents(d)
-        print(f"Loaded {len(d)} docs → {len(frags)} chunks")
+        print(f"Loaded {len(set(f.metadata.get('source') for f in frags))} files → {len(frags)} chunks")
         return frags
-      
\ No newline at end of file
@@ -0,0 +1,111 @@
+# EmbCache: disk-backed embedding cache keyed by (model, text hash).
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+import numpy as np
+
+from src.config import Cfg
+
+class EmbCache:
+    def __init__(self, path, max_items, busy_timeout_s=10.0):
+        self.path = path
+        self.max_items = max_items
+        os.makedirs(os.path.abspath(path), exist_ok=True)
+        uri = "file:" + pathname2url(os.path.abspath(os.path.join(path, "cache.sqlite")))
+        # Keys, vectors and LRU stamps live in one SQLite file, so the app, API workers and CLI
+        # processes sharing the directory see the same entries; WAL lets them read while one writes.
+        self._con = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=busy_timeout_s)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS emb (key BLOB PRIMARY KEY, vec BLOB NOT NULL, used REAL NOT NULL)"
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS emb_used ON emb (used)")
+            self._con.commit()
+            # Row count as this process sees it: puts add to it, replaced keys and other processes'
+            # writes make it drift, so it is re-synced by a real COUNT(*) only once it passes the cap.
+            self._n = self._count()
+
+    def _count(self):
+        return self._con.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, model, texts):
+        keys = [self.key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            for s in range(0, len(keys), 500):
+                part = keys[s:s + 500]
+                rows = self._con.execute(
+                    f"SELECT key, vec FROM emb WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                # LRU touch for the hits, one statement per lookup.
+                now = time.time()
+                self._con.executemany("UPDATE emb SET used = ? WHERE key = ?", [(now, k) for k in found])
+                self._con.commit()
+        out = []
+        for k in keys:
+            v = found.get(k)
+            out.append(None if v is None else np.frombuffer(v, dtype=np.float32).tolist())
+        return out
+
+    def put_many(self, model, texts, vecs):
+        now = time.time()
+        # Never cache the zero-vector fallback; it would poison future lookups.
+        rows = [
+            (self.key(model, t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vecs)
+            if v and any(v)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._con.executemany("INSERT OR REPLACE INTO emb (key, vec, used) VALUES (?, ?, ?)", rows)
+            self._n += len(rows)
+            # Counting is a table scan, so it waits until the cap is passed by 10%; the cache may run
+            # that far over meanwhile, and each check then evicts back down to the cap.
+            if self._n > self.max_items + self.max_items // 10:
+                self._n = self._count()
+                over = self._n - self.max_items
+                if over > 0:
+                    # Evict the least recently used entries beyond the cap.
+                    self._con.execute(
+                        "DELETE FROM emb WHERE key IN (SELECT key FROM emb ORDER BY used LIMIT ?)", (over,)
+                    )
+                    self._n -= over
+            self._con.commit()
+
+    def flush(self):
+        # Every put is committed; this only checkpoints the WAL into the main file.
+        with self._lock:
+            self._con.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_emb_cache():
+    # One connection per process; processes share entries through the SQLite file.
+    global _cache
+    if Cfg.emb_cache_max <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbCache(Cfg.emb_cache_path, Cfg.emb_cache_max)
+            atexit.register(_cache.flush)
+        return _cache
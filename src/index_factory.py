@@ -0,0 +1,188 @@
+# Index factory: FAISS index type selection, training, search tuning and recall report.
+import math
+import time
+
+import faiss
+import numpy as np
+
+from src.config import Cfg
+
+KINDS = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+QUANTS = ("none", "fp16", "int8")
+
+def resolve_kind(n, kind=None):
+    kind = (kind or Cfg.idx_type).lower()
+    if kind == "auto":
+        # Exact search is fastest below a few tens of thousands of vectors; IVF variants scale past that.
+        if n < Cfg.idx_auto_flat_max:
+            kind = "flat"
+        elif n < Cfg.idx_auto_pq_min:
+            kind = "ivf_flat"
+        else:
+            kind = "ivf_pq"
+    elif kind not in KINDS:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE '{kind}', expected auto or one of {', '.join(KINDS)}")
+    if kind == "ivf_pq" and n < 256 * 39:
+        # PQ codebooks need enough points per code; small corpora get IVF-Flat instead.
+        kind = "ivf_flat"
+    if kind in ("ivf_flat", "ivf_pq") and n < 39:
+        kind = "flat"
+    return kind
+
+def _nlist(n):
+    if Cfg.idx_nlist:
+        return Cfg.idx_nlist
+    # ~4*sqrt(n) lists, while keeping at least 39 training points per centroid.
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+def _sq_type():
+    quant = Cfg.idx_quant
+    if quant not in QUANTS:
+        raise ValueError(f"Unknown FAISS_QUANT '{quant}', expected one of {', '.join(QUANTS)}")
+    return {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(quant)
+
+def is_sq(index):
+    # Scalar-quantized storage (flat, IVF or HNSW); these keep a float32 copy on disk for re-scoring.
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer))
+
+def _pq_m(d):
+    # Sub-quantizer count must divide the dimension.
+    m = min(Cfg.idx_pq_m, d)
+    while d % m:
+        m -= 1
+    return m
+
+def build_index(vecs, kind):
+    # Returns an empty, trained index of a kind from resolve_kind; vectors are added by the caller.
+    n, d = vecs.shape
+    # PQ codes are already compressed, so the scalar quantizer only applies to the other kinds.
+    qt = _sq_type() if kind != "ivf_pq" else None
+    if kind == "flat":
+        if qt is None:
+            return faiss.IndexFlatL2(d)
+        index = faiss.IndexScalarQuantizer(d, qt, faiss.METRIC_L2)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWSQ(d, qt, Cfg.idx_hnsw_m) if qt is not None else faiss.IndexHNSWFlat(d, Cfg.idx_hnsw_m)
+        index.hnsw.efConstruction = Cfg.idx_ef_construction
+        if qt is None:
+            return tune_index(index)
+    else:
+        quantizer = faiss.IndexFlatL2(d)
+        if kind == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, d, _nlist(n), _pq_m(d), 8)
+        elif qt is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, _nlist(n), qt, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, d, _nlist(n))
+    # Train on a random sample; k-means (and int8 value ranges) cost grows with sample size, not corpus size.
+    # int8 ranges come from this sample, so later incremental adds outside it are clipped until a rebuild.
+    rng = np.random.default_rng(0)
+    sample = vecs if n <= Cfg.idx_train_max else vecs[rng.choice(n, Cfg.idx_train_max, replace=False)]
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    return tune_index(index)
+
+def tune_index(index):
+    # Search-time knobs are not persisted by write_index, so apply them after every load too.
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = Cfg.idx_ef_search
+        return index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = _nprobe(ivf.nlist)
+    return index
+
+def _nprobe(nlist):
+    # nlist grows with the corpus, so a fixed nprobe scans an ever smaller share of it and recall drops;
+    # probe ~1/idx_nprobe_div of the lists, with FAISS_NPROBE as the floor.
+    scaled = nlist // Cfg.idx_nprobe_div if Cfg.idx_nprobe_div > 0 else 0
+    return max(1, min(nlist, max(Cfg.idx_nprobe, scaled)))
+
+def supports_remove(index):
+    # HNSW graphs cannot drop vectors, so incremental deletes there need a rebuild.
+    return isinstance(index, faiss.IndexFlatCodes) or faiss.try_extract_index_ivf(index) is not None
+
+def remove_rows(index, rows):
+    # Drop rows and renumber the rest 0..n-1 in order, matching the compacted row -> chunk id list.
+    # Flat-code indexes shift rows themselves; IVF lists keep the old ids, so they are rewritten.
+    n = index.ntotal
+    rows = np.asarray(sorted(rows), dtype=np.int64)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # Array direct maps cannot remove; one is only built transiently by exact_vectors().
+        ivf.make_direct_map(False)
+    index.remove_ids(rows)
+    if ivf is None:
+        return
+    gone = np.zeros(n, dtype=bool)
+    gone[rows] = True
+    new_id = np.cumsum(~gone) - 1
+    inv = ivf.invlists
+    for lst in range(ivf.nlist):
+        size = inv.list_size(lst)
+        if not size:
+            continue
+        ids = new_id[faiss.rev_swig_ptr(inv.get_ids(lst), size)].astype(np.int64)
+        codes = faiss.rev_swig_ptr(inv.get_codes(lst), size * inv.code_size).copy()
+        inv.update_entries(lst, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+
+def exact_vectors(index, rows):
+    # Stored float32 vectors of rows, or None when the index keeps only lossy codes (PQ, SQ).
+    rows = np.asarray(rows, dtype=np.int64)
+    base = faiss.downcast_index(index.storage) if isinstance(index, faiss.IndexHNSW) else index
+    if isinstance(base, faiss.IndexFlat):
+        return base.reconstruct_batch(rows)
+    if isinstance(base, faiss.IndexIVFFlat):
+        # Row -> list lookup for reconstruct; dropped again so it is not saved with the index.
+        base.make_direct_map(True)
+        try:
+            return base.reconstruct_batch(rows)
+        finally:
+            base.make_direct_map(False)
+    return None
+
+def rescore(qvec, cand, exact, k):
+    # Exact L2 over the candidate rows only; returns (positions, squared distances) of the best k.
+    cand = np.asarray([c for c in cand if c != -1], dtype=np.int64)
+    if not cand.size:
+        return [], []
+    order = np.argsort(cand)
+    # Sorted reads keep the memory-mapped file access sequential-ish.
+    rows = np.asarray(exact[cand[order]], dtype=np.float32)
+    dist = ((rows - np.asarray(qvec, dtype=np.float32)[None, :]) ** 2).sum(axis=1)
+    best = np.argsort(dist, kind="stable")[:k]
+    return cand[order][best].tolist(), dist[best].tolist()
+
+def recall_report(index, vecs, kind, k=None):
+    # Compare the approximate index with exact search on a sample of stored vectors.
+    k = k or Cfg.k_ret
+    n = vecs.shape[0]
+    report = {"kind": kind, "quant": Cfg.idx_quant if is_sq(index) else "none", "n": int(n), "k": int(k)}
+    if (kind == "flat" and not is_sq(index)) or n == 0:
+        report["recall"] = 1.0
+        return report
+    rng = np.random.default_rng(1)
+    qs = vecs[rng.choice(n, min(n, Cfg.idx_recall_queries), replace=False)]
+    flat = faiss.IndexFlatL2(vecs.shape[1])
+    flat.add(vecs)
+    t0 = time.perf_counter()
+    _, gt = flat.search(qs, k)
+    t1 = time.perf_counter()
+    _, got = index.search(qs, k)
+    t2 = time.perf_counter()
+    hits = sum(len(set(g) & set(a)) for g, a in zip(gt.tolist(), got.tolist()))
+    report.update({
+        "recall": round(hits / float(gt.size), 4),
+        "queries": int(len(qs)),
+        "flat_ms_per_q": round((t1 - t0) * 1000 / len(qs), 4),
+        "idx_ms_per_q": round((t2 - t1) * 1000 / len(qs), 4),
+    })
+    if is_sq(index) and Cfg.idx_rescore:
+        # Same queries with k * idx_rescore candidates re-scored against the float32 vectors.
+        t0 = time.perf_counter()
+        _, cand = index.search(qs, k * Cfg.idx_rescore)
+        hits = sum(len(set(g) & set(rescore(q, c, vecs, k)[0])) for q, g, c in zip(qs, gt.tolist(), cand.tolist()))
+        report["recall_rescored"] = round(hits / float(gt.size), 4)
+        report["rescored_ms_per_q"] = round((time.perf_counter() - t0) * 1000 / len(qs), 4)
+    return report
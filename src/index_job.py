@@ -0,0 +1,181 @@
+# IndexJob: re-index in a background thread with progress; the live index is swapped when it finishes.
+import json
+import os
+import threading
+import time
+
+from src.config import Cfg
+
+def _job_fp(name):
+    return os.path.join(Cfg.idx_path, name)
+
+def _try_lock(fd):
+    # Exclusive and non-blocking; without flock (Windows) every process runs its own jobs.
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def _claim():
+    # Fd holding the cross-process job lock, or None while another process runs a job.
+    os.makedirs(Cfg.idx_path, exist_ok=True)
+    fd = os.open(_job_fp(".job.lock"), os.O_CREAT | os.O_RDWR)
+    if _try_lock(fd):
+        return fd
+    os.close(fd)
+    return None
+
+class IndexJob:
+    # State is mirrored to idx_path/index_job.json and the job holds idx_path/.job.lock while it runs,
+    # so every worker reports the same build and only one of them can start it.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._fd = None
+        self._state = {"status": "idle"}
+
+    def start(self, full=False, collections=None):
+        # False if a build is already running in this or another process. collections limits a
+        # sharded re-index to those shards; the others are not touched.
+        with self._lock:
+            if self.running():
+                return False
+            fd = _claim()
+            if fd is None:
+                return False
+            self._fd = fd
+            self._state = {"status": "running", "phase": "loading", "full": full, "started": time.time()}
+            self._save()
+            self._thread = threading.Thread(
+                target=self._run, args=(full, collections), name="index-job", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def snapshot(self):
+        with self._lock:
+            if self.running():
+                return dict(self._state)
+        # Not building here: the last job of any process, as saved.
+        try:
+            with open(_job_fp(Cfg.idx_job_file), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                return dict(self._state)
+        if state.get("status") == "running":
+            fd = _claim()
+            if fd is not None:
+                # Nobody holds the lock, so the process that ran it exited mid-build.
+                os.close(fd)
+                state.update(status="error", error="Re-index stopped before finishing (its process exited).")
+        return state
+
+    def _update(self, fields):
+        with self._lock:
+            self._state.update(fields)
+            self._save()
+
+    def _save(self):
+        # Atomic replace, so readers in other processes never see a half-written file.
+        fp = _job_fp(Cfg.idx_job_file)
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, default=str)
+        os.replace(tmp, fp)
+
+    def _progress(self, files_base, chunks_base):
+        # Per-collection counters from VecEng, shifted by what earlier collections already did.
+        def update(fields):
+            fields = dict(fields)
+            if "files_done" in fields:
+                fields["files_done"] += files_base
+            if "chunks" in fields:
+                fields["chunks"] += chunks_base
+            self._update(fields)
+        return update
+
+    def _run(self, full, collections):
+        try:
+            # Ingestion stack is imported by the first build, not by every app start.
+            from src.document_processor import DocProc
+            from src.shards import built_collections, split_files
+            from src.vector_engine import VecEng
+
+            dp = DocProc()
+            files = dp.ld_files()
+            if not files:
+                self._update({"status": "error", "error": "No documents found. Add files to data/raw and retry."})
+                return
+            groups = split_files(files) if Cfg.collections else {None: files}
+            if Cfg.collections:
+                # Collections whose files are all gone are unpublished rather than left stale.
+                for name in built_collections():
+                    if name not in groups and (not collections or name in collections):
+                        VecEng(collection=name).drop()
+                if collections:
+                    groups = {n: f for n, f in groups.items() if n in collections}
+                if not groups:
+                    self._update({"status": "error", "error": "No documents found for the selected collections."})
+                    return
+            self._update({
+                "files": sum(len(f) for f in groups.values()), "files_done": 0, "chunks": 0,
+                "collections": [n for n in groups if n],
+            })
+            done_files = done_chunks = 0
+            stats, per = {}, {}
+            for name, fl in groups.items():
+                self._update({"collection": name})
+                ve = VecEng(progress=self._progress(done_files, done_chunks), collection=name)
+                ve.crt_idx(dp.iter_frags, full=full, paths=fl)
+                done_files += len(fl)
+                done_chunks += ve.last_stats.get("chunks", 0)
+                stats = _add_stats(stats, ve.last_stats)
+                if name:
+                    per[name] = {"version": ve.version, "stats": ve.last_stats}
+            self._update({
+                "status": "done",
+                "phase": "done",
+                "version": ve.version if not Cfg.collections else None,
+                "stats": stats,
+                "shards": per,
+                "chunks_per_sec": ve.hf.last_rate,
+            })
+        except Exception as e:
+            # The previous version stays live; nothing was published.
+            self._update({"status": "error", "error": str(e)})
+        finally:
+            self._update({"finished": time.time()})
+            os.close(self._fd)
+            self._fd = None
+
+def _add_stats(a, b):
+    # Totals over collections for the counters the UI shows.
+    if not a:
+        return dict(b)
+    out = dict(a)
+    for key in ("chunks", "added", "removed", "kept"):
+        out[key] = a.get(key, 0) + b.get(key, 0)
+    out["full"] = a.get("full") and b.get("full")
+    if "dedup" in a or "dedup" in b:
+        da, db = a.get("dedup") or {}, b.get("dedup") or {}
+        out["dedup"] = {k: da.get(k, 0) + db.get(k, 0) for k in set(da) | set(db)}
+    return out
+
+_job = None
+_job_lock = threading.Lock()
+
+def get_index_job():
+    global _job
+    with _job_lock:
+        if _job is None:
+            _job = IndexJob()
+        return _job
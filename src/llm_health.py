@@ -0,0 +1,80 @@
+# LLMHealth: per-model rolling latency and circuit breakers for the chat-completion fallbacks.
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from src.config import Cfg
+
+class _ModelStats:
+    def __init__(self):
+        self.lat = deque(maxlen=Cfg.hedge_window)
+        self.fails = 0
+        self.open_until = 0.0
+
+class LLMHealth:
+    def __init__(self):
+        self._m = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model):
+        st = self._m.get(model)
+        if st is None:
+            st = self._m[model] = _ModelStats()
+        return st
+
+    def available(self, model):
+        # Closed, or open long enough that one probe (half-open) is allowed through.
+        with self._lock:
+            return self._get(model).open_until <= time.monotonic()
+
+    def ok(self, model, secs):
+        with self._lock:
+            st = self._get(model)
+            st.lat.append(secs)
+            st.fails = 0
+            st.open_until = 0.0
+
+    def censored(self, model, secs):
+        # A call cut off after secs (lost a hedge race): kept as a sample of at least secs, so a
+        # model that keeps losing still gets a p95; breaker state is left alone.
+        with self._lock:
+            self._get(model).lat.append(secs)
+
+    def fail(self, model):
+        with self._lock:
+            st = self._get(model)
+            st.fails += 1
+            if st.fails >= Cfg.cb_fail_max:
+                # Open (or re-open after a failed probe) for the cooldown period.
+                st.open_until = time.monotonic() + Cfg.cb_cooldown_s
+
+    def p95(self, model):
+        with self._lock:
+            lat = list(self._get(model).lat)
+        if len(lat) < Cfg.hedge_min_samples:
+            return None
+        return float(np.percentile(lat, 95))
+
+    def hedge_delay(self, model):
+        # Wait roughly as long as this model's p95 before firing the next one.
+        p95 = self.p95(model)
+        if p95 is None:
+            return Cfg.hedge_default_s
+        return min(max(p95 * Cfg.hedge_mult, Cfg.hedge_min_s), Cfg.hedge_max_s)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._m.items())
+        return {
+            m: {"p95": self.p95(m), "n": len(st.lat), "fails": st.fails, "open": st.open_until > now}
+            for m, st in items
+        }
+
+_health = LLMHealth()
+
+def get_llm_health():
+    # Shared across RAGBot instances so stats survive a re-index.
+    return _health
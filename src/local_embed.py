@@ -0,0 +1,87 @@
+# LocalEmbedder: in-process CPU runtime for the sentence-transformers embedding model (ONNX).
+import os
+import threading
+
+import numpy as np
+from huggingface_hub import hf_hub_download
+
+from src.config import Cfg
+
+def fetch_file(model, fname, local_dir=""):
+    # Prefer a pre-downloaded model dir so replicas can start fully offline.
+    if local_dir:
+        fp = os.path.join(local_dir, fname)
+        if os.path.exists(fp):
+            return fp
+    return hf_hub_download(model, fname)
+
+def ort_session(fp, threads):
+    # Optional dep: only needed when a local ONNX model is enabled.
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    if threads:
+        opts.intra_op_num_threads = threads
+    opts.inter_op_num_threads = 1
+    return ort.InferenceSession(fp, opts, providers=["CPUExecutionProvider"])
+
+class LocalEmbedder:
+    def __init__(self, model=None, onnx_file=None, threads=None):
+        # Optional dep: only needed when EMB_BACKEND selects the local runtime.
+        from tokenizers import Tokenizer
+
+        self.model = model or Cfg.mdl_nm
+        self.onnx_file = onnx_file or Cfg.emb_onnx_file
+        threads = Cfg.emb_threads if threads is None else threads
+
+        self.tok = Tokenizer.from_file(self._fetch("tokenizer.json"))
+        # MiniLM was trained on 256-token windows; longer chunks are truncated like sentence-transformers does.
+        self.tok.enable_truncation(max_length=Cfg.emb_max_len)
+        self.tok.enable_padding()
+
+        self.sess = ort_session(self._fetch(self.onnx_file), threads)
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+
+    def _fetch(self, fname):
+        return fetch_file(self.model, fname, Cfg.emb_local_dir)
+
+    def embed(self, texts):
+        out = []
+        bs = max(1, Cfg.emb_batch_sz)
+        for s in range(0, len(texts), bs):
+            out.append(self._embed_batch(texts[s:s + bs]))
+        return np.vstack(out).tolist() if out else []
+
+    def _embed_batch(self, texts):
+        enc = self.tok.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.inputs:
+            feed["token_type_ids"] = np.zeros_like(ids)
+        tok_emb = self.sess.run(None, feed)[0]
+        # Mean pooling + L2 normalisation, matching the hosted sentence-transformers pipeline.
+        m = mask[..., None].astype(np.float32)
+        vecs = (tok_emb * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return vecs.astype(np.float32)
+
+_local = None
+_local_failed = False
+_local_lock = threading.Lock()
+
+def get_local_embedder():
+    # One ONNX session per process; loading it is the expensive part.
+    # None when the runtime/model can't be loaded; the failure is remembered so it isn't retried.
+    global _local, _local_failed
+    if _local_failed:
+        return None
+    with _local_lock:
+        if _local is None and not _local_failed:
+            try:
+                _local = LocalEmbedder()
+            except Exception as e:
+                # Missing onnxruntime/model files: keep serving through the Inference API.
+                print(f"Local embedding backend unavailable, using Inference API: {str(e)}")
+                _local_failed = True
+        return _local
@@ -0,0 +1,147 @@
+# Metrics: per-stage timing spans, counters and a cProfile hook, exportable as Prometheus text.
+import asyncio
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from src.config import Cfg
+
+class _Hist:
+    def __init__(self):
+        self.buckets = [0] * len(Cfg.metrics_buckets)
+        self.count = 0
+        self.sum = 0.0
+        # Recent samples for the p50/p95 shown in the UI; Prometheus uses the buckets.
+        self.recent = deque(maxlen=Cfg.metrics_recent)
+
+    def observe(self, secs):
+        self.count += 1
+        self.sum += secs
+        self.recent.append(secs)
+        for i, le in enumerate(Cfg.metrics_buckets):
+            if secs <= le:
+                self.buckets[i] += 1
+                break
+
+class Metrics:
+    def __init__(self):
+        self._hist = {}
+        self._cnt = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, secs):
+        with self._lock:
+            h = self._hist.get(stage)
+            if h is None:
+                h = self._hist[stage] = _Hist()
+            h.observe(secs)
+
+    def inc(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._cnt[key] = self._cnt.get(key, 0) + n
+
+    @contextmanager
+    def span(self, stage):
+        # Failed stages are timed too and additionally counted as errors.
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("stage_errors", stage=stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def snapshot(self):
+        with self._lock:
+            hists = {s: (h.count, h.sum, list(h.recent)) for s, h in self._hist.items()}
+            cnts = dict(self._cnt)
+        stages = {}
+        for s, (n, tot, recent) in sorted(hists.items()):
+            stages[s] = {
+                "count": n,
+                "mean_ms": 1000.0 * tot / n if n else 0.0,
+                "p50_ms": 1000.0 * float(np.percentile(recent, 50)) if recent else 0.0,
+                "p95_ms": 1000.0 * float(np.percentile(recent, 95)) if recent else 0.0,
+            }
+        counters = {
+            name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): v
+            for (name, labels), v in sorted(cnts.items())
+        }
+        return {"stages": stages, "counters": counters}
+
+    def prometheus(self):
+        # Text exposition format 0.0.4.
+        p = Cfg.metrics_prefix
+        lines = [
+            f"# HELP {p}_stage_seconds Latency of each RAG pipeline stage.",
+            f"# TYPE {p}_stage_seconds histogram",
+        ]
+        with self._lock:
+            hists = {s: (list(h.buckets), h.count, h.sum) for s, h in self._hist.items()}
+            cnts = dict(self._cnt)
+        for s, (buckets, n, tot) in sorted(hists.items()):
+            acc = 0
+            for le, c in zip(Cfg.metrics_buckets, buckets):
+                acc += c
+                lines.append(f'{p}_stage_seconds_bucket{{stage="{s}",le="{le}"}} {acc}')
+            lines.append(f'{p}_stage_seconds_bucket{{stage="{s}",le="+Inf"}} {n}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{s}"}} {tot:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{s}"}} {n}')
+        typed = set()
+        for (name, labels), v in sorted(cnts.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name}_total counter")
+                typed.add(name)
+            lab = ",".join(f'{k}="{val}"' for k, val in labels)
+            lines.append(f"{p}_{name}_total{{{lab}}} {v}" if lab else f"{p}_{name}_total {v}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._hist.clear()
+            self._cnt.clear()
+
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
+
+def span(stage):
+    return _metrics.span(stage)
+
+def inc(name, n=1, **labels):
+    _metrics.inc(name, n, **labels)
+
+def timed(stage):
+    # Decorator form of span() for whole methods (sync or async).
+    def deco(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with _metrics.span(stage):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _metrics.span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def profiled(fn, *args, **kwargs):
+    # Run one call under cProfile; returns (result, top functions by cumulative time as text).
+    prof = cProfile.Profile()
+    res = prof.runcall(fn, *args, **kwargs)
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(Cfg.profile_top)
+    return res, out.getvalue()
@@ -0,0 +1,147 @@
+# PromptPacker: fit retrieved chunks and chat history into a per-model token budget.
+import threading
+
+from huggingface_hub import hf_hub_download
+
+from src.config import Cfg
+
+# model -> Tokenizer, or None once loading failed (not retried); models still loading are absent.
+_toks = {}
+_toks_loading = set()
+_toks_lock = threading.Lock()
+
+def _load_tokenizer(model):
+    try:
+        from tokenizers import Tokenizer
+
+        try:
+            # A cached copy needs no network.
+            fp = hf_hub_download(model, "tokenizer.json", local_files_only=True)
+        except Exception:
+            fp = hf_hub_download(model, "tokenizer.json", etag_timeout=Cfg.pack_tok_timeout_s)
+        tok = Tokenizer.from_file(fp)
+    except Exception as e:
+        print(f"Tokenizer for {model} unavailable, estimating tokens: {str(e)}")
+        tok = None
+    with _toks_lock:
+        _toks[model] = tok
+        _toks_loading.discard(model)
+
+def preload_tokenizer(model):
+    # Loads in the background, once per model; requests never wait on the Hub.
+    if not Cfg.pack_use_tokenizer:
+        return
+    with _toks_lock:
+        if model in _toks or model in _toks_loading:
+            return
+        _toks_loading.add(model)
+    threading.Thread(target=_load_tokenizer, args=(model,), name="tokenizer", daemon=True).start()
+
+def _trim_overlap(prev, cur):
+    # Splitter overlap (Cfg.ch_ol) repeats text across neighbours; drop the repeated part of cur.
+    max_ol = min(len(prev), len(cur), Cfg.ch_ol * 2)
+    for n in range(max_ol, Cfg.pack_min_overlap - 1, -1):
+        if prev.endswith(cur[:n]):
+            return cur[n:].lstrip()
+        if prev.startswith(cur[-n:]):
+            return cur[:-n].rstrip()
+    return cur
+
+class PromptPacker:
+    def __init__(self, model):
+        self.model = model
+        self.budget = Cfg.prompt_budgets.get(model, Cfg.prompt_budget)
+        # chars/4 estimate until the model's tokenizer has loaded (or for good, if it can't be).
+        self.tok = None
+        self._tok_final = not Cfg.pack_use_tokenizer
+        preload_tokenizer(model)
+
+    def _refresh_tok(self):
+        if not self._tok_final and self.model in _toks:
+            self.tok, self._tok_final = _toks[self.model], True
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tok is not None:
+            return len(self.tok.encode(text, add_special_tokens=False).ids)
+        return max(1, len(text) // 4)
+
+    def _cut(self, text, n_tokens, keep_end=False):
+        # Proportional cut, then tighten until it fits.
+        if n_tokens <= 0:
+            return ""
+        total = self.count(text)
+        if total <= n_tokens:
+            return text
+        n_chars = int(len(text) * n_tokens / total)
+        while n_chars > 0:
+            part = text[-n_chars:] if keep_end else text[:n_chars]
+            if self.count(part) + 1 <= n_tokens:
+                return ("…" + part) if keep_end else (part + "…")
+            n_chars = int(n_chars * 0.9)
+        return ""
+
+    def pack(self, system_prefix, docs, history, query):
+        # docs arrive best-first from retrieval/re-ranking and are packed in that order.
+        self._refresh_tok()
+        fixed = self.count(system_prefix) + self.count(query) + Cfg.pack_msg_overhead * 2
+        room = max(0, self.budget - fixed)
+
+        # History: newest turns first, capped at a share of the budget; older turns are cut/dropped.
+        hist_cap = min(room, int(self.budget * Cfg.pack_hist_share))
+        prior, hist_used = [], 0
+        for m in reversed(history):
+            n = self.count(m["content"]) + Cfg.pack_msg_overhead
+            if hist_used + n > hist_cap:
+                left = hist_cap - hist_used - Cfg.pack_msg_overhead
+                cut = self._cut(m["content"], left, keep_end=True) if left > 16 else ""
+                if cut:
+                    prior.append({"role": m["role"], "content": cut})
+                    hist_used += self.count(cut) + Cfg.pack_msg_overhead
+                break
+            prior.append(m)
+            hist_used += n
+        prior.reverse()
+
+        # Context: dedupe exact repeats and splitter overlaps, then fill what is left.
+        ctx_room = room - hist_used
+        used_docs, parts, ctx_used, seen = [], [], 0, set()
+        for d in docs:
+            text = d.page_content.strip()
+            if not text or text in seen:
+                continue
+            src = d.metadata.get("source")
+            for prev_d, prev_text in zip(used_docs, parts):
+                if prev_d.metadata.get("source") == src:
+                    text = _trim_overlap(prev_text, text)
+            if not text:
+                continue
+            n = self.count(text) + 1
+            if ctx_used + n > ctx_room:
+                if not parts:
+                    # Always keep at least the best chunk, truncated to fit.
+                    text = self._cut(text, ctx_room - 1)
+                    if text:
+                        used_docs.append(d)
+                        parts.append(text)
+                        ctx_used += self.count(text) + 1
+                break
+            seen.add(d.page_content.strip())
+            used_docs.append(d)
+            parts.append(text)
+            ctx_used += n
+
+        return {
+            "docs": used_docs,
+            "context_text": "\n\n".join(parts),
+            "prior_msgs": prior,
+            "tokens": {
+                "system": fixed - self.count(query) - Cfg.pack_msg_overhead * 2 + ctx_used,
+                "history": hist_used,
+                "query": self.count(query),
+                "context": ctx_used,
+                "total": fixed + hist_used + ctx_used,
+                "budget": self.budget,
+            },
+        }
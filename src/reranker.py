@@ -0,0 +1,87 @@
+# Reranker: local cross-encoder that re-scores over-fetched chunks before prompt assembly.
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config import Cfg
+from src.local_embed import fetch_file, ort_session
+from src.metrics import inc
+
+class Reranker:
+    def __init__(self):
+        # Optional dep, same as the local embedding backend.
+        from tokenizers import Tokenizer
+
+        self.tok = Tokenizer.from_file(fetch_file(Cfg.rr_model, "tokenizer.json", Cfg.rr_local_dir))
+        self.tok.enable_truncation(max_length=Cfg.rr_max_len)
+        self.tok.enable_padding()
+        self.sess = ort_session(fetch_file(Cfg.rr_model, Cfg.rr_onnx_file, Cfg.rr_local_dir), Cfg.emb_threads)
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+        # (query, chunk id) -> score; repeat questions skip the model for chunks seen before.
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def rerank(self, query, docs, k):
+        if len(docs) <= 1:
+            return docs[:k]
+        t0 = time.perf_counter()
+        budget = Cfg.rr_budget_ms / 1000.0
+        keys = [(query, d.id or d.page_content) for d in docs]
+        with self._lock:
+            scores = [self._scores.get(key) for key in keys]
+        todo = [i for i, sc in enumerate(scores) if sc is None]
+
+        bs = max(1, Cfg.rr_batch_sz)
+        for s in range(0, len(todo), bs):
+            if time.perf_counter() - t0 > budget:
+                break
+            batch = todo[s:s + bs]
+            for i, sc in zip(batch, self._score(query, [docs[i].page_content for i in batch])):
+                scores[i] = sc
+        with self._lock:
+            for key, sc in zip(keys, scores):
+                if sc is not None:
+                    self._scores[key] = sc
+                    self._scores.move_to_end(key)
+            while len(self._scores) > Cfg.rr_cache_max:
+                self._scores.popitem(last=False)
+
+        # Candidates arrive in retrieval order, so the scored ones are a prefix of the best hits.
+        n_scored = next((i for i, sc in enumerate(scores) if sc is None), len(scores))
+        if n_scored < k:
+            # Budget blown before k candidates were scored: keep the retrieval order.
+            inc("rr_budget_skipped")
+            return docs[:k]
+        order = sorted(range(n_scored), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:k]]
+
+    def _score(self, query, texts):
+        enc = self.tok.encode_batch([(query, t) for t in texts])
+        feed = {
+            "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64),
+        }
+        if "token_type_ids" in self.inputs:
+            feed["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        logits = self.sess.run(None, feed)[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(texts), -1)[:, 0].tolist()
+
+_rr = None
+_rr_failed = False
+_rr_lock = threading.Lock()
+
+def get_reranker():
+    # None when disabled or when the model/runtime can't be loaded; retrieval order is used then.
+    global _rr, _rr_failed
+    if not Cfg.rr_enabled or _rr_failed:
+        return None
+    with _rr_lock:
+        if _rr is None:
+            try:
+                _rr = Reranker()
+            except Exception as e:
+                print(f"Re-ranker unavailable, using retrieval order: {str(e)}")
+                _rr_failed = True
+        return _rr
@@ -0,0 +1,308 @@
+# HybridRetriever: dense FAISS search fused with BM25 keyword search (reciprocal-rank fusion).
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from src.config import Cfg
+from src.index_factory import rescore
+from src.metrics import span
+
+# Shared pool: the two searches of a query run side by side; FAISS releases the GIL while searching.
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+# Filterable fields: each saved as keys.json entries plus <field>_offsets.npy / <field>_pos.npy (CSR).
+_META_FIELDS = ("source", "ftype", "page")
+
+class MetaIdx:
+    # Per-source / file-type / page row positions. Built with the index and saved in its version
+    # directory, so loading maps a few arrays instead of reading every chunk's metadata.
+    def __init__(self, n, ids, groups):
+        self.n = n
+        # Row -> chunk id (the vector store's index_to_docstore_id).
+        self.ids = ids
+        # field -> (keys, offsets, positions): rows of keys[i] are positions[offsets[i]:offsets[i + 1]].
+        self._groups = groups
+        self._key_no = {f: {k: i for i, k in enumerate(g[0])} for f, g in groups.items()}
+        self._sel = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, vector_store):
+        pos_of = {cid: pos for pos, cid in vector_store.index_to_docstore_id.items()}
+        lists = {f: {} for f in _META_FIELDS}
+        ds = vector_store.docstore
+        metas = ds.iter_meta() if hasattr(ds, "iter_meta") else ((i, d.metadata) for i, d in ds._dict.items())
+        for cid, meta in metas:
+            pos = pos_of.get(cid)
+            if pos is None:
+                continue
+            # A chunk merged by dedup also answers filters on the sources its copies came from.
+            for origin in [meta] + list(meta.get("dup_sources") or ()):
+                src = str(origin.get("source", "")).lower()
+                lists["source"].setdefault(src, []).append(pos)
+                lists["ftype"].setdefault(os.path.splitext(src)[1].lstrip("."), []).append(pos)
+                try:
+                    lists["page"].setdefault(int(origin["page"]), []).append(pos)
+                except (KeyError, TypeError, ValueError):
+                    pass
+        groups = {}
+        for field, by_key in lists.items():
+            offsets = np.zeros(len(by_key) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(v) for v in by_key.values()])
+            rows = np.fromiter(itertools.chain.from_iterable(by_key.values()), dtype=np.int64, count=int(offsets[-1]))
+            groups[field] = (list(by_key), offsets, rows)
+        return cls(vector_store.index.ntotal, vector_store.index_to_docstore_id, groups)
+
+    def save(self, dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+        for field, (_, offsets, rows) in self._groups.items():
+            np.save(os.path.join(dirpath, field + "_offsets.npy"), offsets, allow_pickle=False)
+            np.save(os.path.join(dirpath, field + "_pos.npy"), rows, allow_pickle=False)
+        with open(os.path.join(dirpath, "keys.json"), "w", encoding="utf-8") as f:
+            json.dump({"n": self.n, "keys": {field: g[0] for field, g in self._groups.items()}}, f)
+
+    @classmethod
+    def load(cls, dirpath, vector_store):
+        # None when the version has no saved copy (or it doesn't match the index); callers build one then.
+        fp = os.path.join(dirpath, "keys.json")
+        if not os.path.exists(fp):
+            return None
+        try:
+            with open(fp, "r", encoding="utf-8") as f:
+                head = json.load(f)
+            if head["n"] != vector_store.index.ntotal:
+                return None
+            groups = {
+                field: (
+                    head["keys"][field],
+                    np.load(os.path.join(dirpath, field + "_offsets.npy"), mmap_mode="r"),
+                    np.load(os.path.join(dirpath, field + "_pos.npy"), mmap_mode="r"),
+                )
+                for field in _META_FIELDS
+            }
+        except Exception as e:
+            print(f"Filter index load error: {str(e)}")
+            return None
+        return cls(head["n"], vector_store.index_to_docstore_id, groups)
+
+    def _rows(self, field, key):
+        i = self._key_no[field].get(key)
+        if i is None:
+            return []
+        _, offsets, rows = self._groups[field]
+        return rows[offsets[i]:offsets[i + 1]]
+
+    def selector(self, filt):
+        # -> (faiss selector, bitmap kept alive for it, allowed chunk ids) or None when unfiltered.
+        key = tuple(sorted((k, tuple(v)) for k, v in filt.items()))
+        if not key:
+            return None
+        with self._lock:
+            hit = self._sel.get(key)
+            if hit is None:
+                hit = self._build(filt)
+                if len(self._sel) >= 256:
+                    self._sel.pop(next(iter(self._sel)))
+                self._sel[key] = hit
+            return hit
+
+    def _build(self, filt):
+        mask = np.ones(self.n, dtype=bool)
+        # "domain" (configured keywords) and "source" (request keywords) are both filename substrings.
+        for field in ("domain", "source"):
+            if filt.get(field):
+                m = np.zeros(self.n, dtype=bool)
+                for src in self._key_no["source"]:
+                    if any(k in src for k in filt[field]):
+                        m[self._rows("source", src)] = True
+                mask &= m
+        for field in ("ftype", "page"):
+            if filt.get(field):
+                m = np.zeros(self.n, dtype=bool)
+                for key in filt[field]:
+                    m[self._rows(field, key)] = True
+                mask &= m
+        bitmap = np.packbits(mask, bitorder="little")
+        sel = faiss.IDSelectorBitmap(self.n, faiss.swig_ptr(bitmap))
+        allowed = {self.ids[p] for p in np.flatnonzero(mask).tolist()}
+        return sel, bitmap, allowed
+
+def norm_filters(filters=None):
+    # Merge the configured source keywords with per-request filters into {field: [values]}.
+    # Malformed filters raise ValueError (the API answers 400 with its message).
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("'filters' must be an object.")
+    filt = {}
+    keywords = tuple(getattr(Cfg, "source_filename_keywords", ()))
+    if keywords:
+        filt["domain"] = list(keywords)
+    req = filters or {}
+    src = req.get("source")
+    if src:
+        srcs = [src] if isinstance(src, str) else src
+        if not isinstance(srcs, (list, tuple)) or not all(isinstance(s, str) for s in srcs):
+            raise ValueError("'source' filter must be a string or a list of strings.")
+        # Request keywords narrow the configured domain, they never widen it.
+        filt["source"] = [s.lower() for s in srcs]
+    for field in ("ftype", "page"):
+        val = req.get(field)
+        if val is None or val == "" or val == []:
+            continue
+        vals = val if isinstance(val, (list, tuple, set)) else [val]
+        if field == "ftype":
+            filt[field] = [str(v).lower().lstrip(".") for v in vals]
+            continue
+        try:
+            filt[field] = [int(v) for v in vals]
+        except (TypeError, ValueError):
+            raise ValueError(f"'page' filter must be page numbers, got {val!r}.") from None
+    return filt
+
+class HybridRetriever:
+    def __init__(self, vector_store, bm25=None, exact=None, meta=None):
+        self.vector_store = vector_store
+        self.bm25 = bm25
+        # Float32 vectors behind a quantized index (VecEng.exact); None = use index distances as they are.
+        self.exact = exact
+        # Filter index saved with the version (VecEng.meta); built here only for indexes without one.
+        self._meta = meta
+
+    def close(self):
+        # Releases the chunk store's SQLite connection; the mapped index files go with the object.
+        close = getattr(self.vector_store.docstore, "close", None)
+        if close:
+            close()
+
+    def meta(self):
+        if self._meta is None or self._meta.n != self.vector_store.index.ntotal:
+            self._meta = MetaIdx.build(self.vector_store)
+        return self._meta
+
+    def search(self, query, k, filters=None):
+        # Returns (docs, query vector); the vector is reused by the answer cache.
+        sel = self.meta().selector(norm_filters(filters))
+        if sel is not None and not sel[2]:
+            # Nothing matches the filter: skip both searches.
+            return [], self.vector_store.embeddings.embed_query(query)
+
+        if not (Cfg.hyb_enabled and self.bm25):
+            qvec, hits = self._dense(query, k, sel)
+            return [d for d, _ in hits], qvec
+
+        fetch = max(k, Cfg.hyb_fetch_k)
+        dense_f = _pool.submit(self._dense, query, fetch, sel)
+        with span("search_bm25"):
+            sparse = self.bm25.search(query, fetch, allow=sel[2] if sel else None)
+        qvec, dense = dense_f.result()
+        with span("fuse"):
+            return self._fuse(dense, sparse, k), qvec
+
+    def _dense(self, query, k, sel=None):
+        qvec = self.vector_store.embeddings.embed_query(query)
+        with span("search_faiss"):
+            return qvec, self.search_by_vector(qvec, k, sel)
+
+    def embed_queries(self, queries):
+        # Batched, cached embedding of many queries (same model as embed_query).
+        return self.vector_store.embeddings.embed_documents(list(queries))
+
+    def search_batch(self, queries, qvecs, k, filters=None):
+        # Many queries at once: one FAISS search over the whole query matrix, then per-query fusion.
+        sel = self.meta().selector(norm_filters(filters))
+        if sel is not None and not sel[2]:
+            return [[] for _ in queries]
+        if not (Cfg.hyb_enabled and self.bm25):
+            with span("search_faiss"):
+                return [[d for d, _ in hits] for hits in self.search_by_vectors(qvecs, k, sel)]
+        fetch = max(k, Cfg.hyb_fetch_k)
+        with span("search_faiss"):
+            dense = self.search_by_vectors(qvecs, fetch, sel)
+        out = []
+        for query, hits in zip(queries, dense):
+            with span("search_bm25"):
+                sparse = self.bm25.search(query, fetch, allow=sel[2] if sel else None)
+            with span("fuse"):
+                out.append(self._fuse(hits, sparse, k))
+        return out
+
+    def search_by_vector(self, qvec, k, sel=None):
+        return self.search_by_vectors([qvec], k, sel)[0]
+
+    def search_by_vectors(self, qvecs, k, sel=None):
+        # -> per query [(doc, distance)]; filters are applied inside FAISS so k qualifying hits come back.
+        vs = self.vector_store
+        rescoring = self.exact is not None and Cfg.idx_rescore > 0
+        q = np.asarray(qvecs, dtype=np.float32)
+        fetch = k * Cfg.idx_rescore if rescoring else k
+        if sel is None:
+            scores, idx = vs.index.search(q, fetch)
+        else:
+            scores, idx = vs.index.search(q, fetch, params=self._params(sel[0]))
+        rows = []
+        for qv, s_row, i_row in zip(q, scores.tolist(), idx.tolist()):
+            if rescoring:
+                # Quantized distances only pick candidates; the final order uses full precision.
+                with span("rescore"):
+                    i_row, s_row = rescore(qv, i_row, self.exact, k)
+            rows.append([(vs.index_to_docstore_id[i], s) for i, s in zip(i_row, s_row) if i != -1])
+        # One docstore round trip for the chunks of all queries.
+        ids = list(dict.fromkeys(cid for row in rows for cid, _ in row))
+        if hasattr(vs.docstore, "search_many"):
+            found = dict(zip(ids, vs.docstore.search_many(ids)))
+        else:
+            found = {cid: vs.docstore.search(cid) for cid in ids}
+        return [
+            [(found[cid], s) for cid, s in row if found.get(cid) is not None and not isinstance(found[cid], str)]
+            for row in rows
+        ]
+
+    def _params(self, sel):
+        index = self.vector_store.index
+        if isinstance(index, faiss.IndexHNSW):
+            p = faiss.SearchParametersHNSW()
+            p.efSearch = index.hnsw.efSearch
+        else:
+            try:
+                ivf = faiss.extract_index_ivf(index)
+                p = faiss.SearchParametersIVF()
+                p.nprobe = ivf.nprobe
+            except RuntimeError:
+                p = faiss.SearchParameters()
+        p.sel = sel
+        return p
+
+    def ntotal(self):
+        return self.vector_store.index.ntotal
+
+    def _fuse(self, dense, sparse, k):
+        return fuse(dense, sparse, k, self.vector_store.docstore.search)
+
+def fuse(dense, sparse, k, lookup):
+    # Reciprocal-rank fusion of dense (doc, distance) and sparse (chunk id, score) hits;
+    # lookup(cid) fetches keyword-only hits (the sharded retriever routes it to the owning shard).
+    rrf_k = Cfg.hyb_rrf_k
+    scores, docs = {}, {}
+    for rank, (d, _) in enumerate(dense):
+        cid = d.id or d.page_content
+        docs[cid] = d
+        scores[cid] = scores.get(cid, 0.0) + Cfg.hyb_w_dense / (rrf_k + rank + 1)
+    for rank, (cid, _) in enumerate(sparse):
+        scores[cid] = scores.get(cid, 0.0) + Cfg.hyb_w_sparse / (rrf_k + rank + 1)
+
+    out = []
+    for cid in sorted(scores, key=scores.get, reverse=True):
+        d = docs.get(cid)
+        if d is None:
+            # Keyword-only hit: fetch its text from the docstore on demand.
+            d = lookup(cid)
+            if d is None or isinstance(d, str):
+                continue
+        out.append(d)
+        if len(out) >= k:
+            break
+    return out
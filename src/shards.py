@@ -0,0 +1,254 @@
+# Sharded collections: one index per collection, an LRU of loaded shards and a parallel fan-out search.
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+
+from src.answer_cache import invalidate_ans_cache
+from src.config import Cfg
+from src.metrics import inc, span
+from src.retriever import HybridRetriever, fuse, norm_filters
+from src.vector_engine import ManualHFEmbeddings, VecEng, collection_root, current_version
+
+# FAISS and SQLite release the GIL, so one thread per shard searches in parallel.
+_pool = ThreadPoolExecutor(max_workers=Cfg.shard_workers, thread_name_prefix="shard")
+
+def collection_of(fp):
+    # First configured collection with a keyword in the filename; everything else is the default one.
+    name = os.path.basename(fp).lower()
+    for coll, kws in Cfg.collections.items():
+        if any(k in name for k in kws):
+            return coll
+    return Cfg.default_collection
+
+def split_files(files):
+    groups = {}
+    for fp in files:
+        groups.setdefault(collection_of(fp), []).append(fp)
+    return groups
+
+def built_collections():
+    # Configured collections that have a published version.
+    names = list(Cfg.collections) + [Cfg.default_collection]
+    return [n for n in dict.fromkeys(names) if current_version(collection_root(n))]
+
+class _Shard:
+    def __init__(self, name):
+        self.name = name
+        ve = VecEng(collection=name)
+        vs = ve.ld_idx()
+        self.version = ve.version
+        self.retriever = HybridRetriever(vs, ve.bm25, ve.exact, ve.meta) if vs is not None else None
+        self.checked = time.monotonic()
+
+class ShardedRetriever:
+    # Same search() contract as HybridRetriever; filters may add {"collection": [...]} to pick shards.
+    def __init__(self, max_loaded=None):
+        self.max_loaded = max_loaded or Cfg.shard_max_loaded
+        # One embedding per query, shared by all shards (they use the same model).
+        self.hf = ManualHFEmbeddings()
+        self._shards = OrderedDict()
+        self._loading = {}
+        # Shards searched by in-flight queries (name -> count); eviction skips them.
+        self._pins = Counter()
+        # (checked at, built collections): CURRENT files are re-read at most every idx_reload_check_s.
+        self._names = None
+        # Last version loaded per collection, to notice new ones even for shards evicted meanwhile.
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._names is not None and now - self._names[0] < Cfg.idx_reload_check_s:
+                return self._names[1]
+        names = built_collections()
+        with self._lock:
+            changed = self._names is not None and self._names[1] != names
+            self._names = (now, names)
+        if changed:
+            # A collection was added or dropped (maybe by another process): cached answers may cite it.
+            invalidate_ans_cache()
+        return names
+
+    def loaded(self):
+        with self._lock:
+            return list(self._shards)
+
+    def ntotal(self):
+        # Chunks in the loaded shards only; evicted shards are not opened just to count them.
+        with self._lock:
+            shards = list(self._shards.values())
+        return sum(s.retriever.ntotal() for s in shards if s.retriever)
+
+    def shard(self, name):
+        # LRU get: loads on first use, reloads once the collection publishes a new version,
+        # and drops the least recently used shard beyond max_loaded.
+        with self._lock:
+            sh = self._shards.get(name)
+            if sh is not None:
+                self._shards.move_to_end(name)
+            load_lock = self._loading.setdefault(name, threading.Lock())
+        if sh is not None and not self._stale(sh):
+            return sh
+        with load_lock:
+            with self._lock:
+                cur = self._shards.get(name)
+            if cur is not None and cur is not sh:
+                # Loaded by another thread while this one waited.
+                return cur
+            new = _Shard(name)
+            inc("shard_loads", collection=name)
+            with self._lock:
+                self._shards[name] = new
+                self._shards.move_to_end(name)
+                changed = self._seen.get(name, new.version) != new.version
+                self._seen[name] = new.version
+                self._evict_over_budget()
+            if changed:
+                invalidate_ans_cache()
+            return new
+
+    def evict(self, name):
+        # Queries already holding the shard finish on it; its mapped files are released after them.
+        with self._lock:
+            if self._shards.pop(name, None) is not None:
+                inc("shard_evictions", collection=name)
+
+    def _evict_over_budget(self):
+        # Least recently used first; shards a running query searches stay until it is done
+        # (the budget can be exceeded meanwhile) rather than being reloaded by its next query.
+        for name in list(self._shards):
+            if len(self._shards) <= self.max_loaded:
+                break
+            if not self._pins[name]:
+                del self._shards[name]
+                inc("shard_evictions", collection=name)
+
+    def _pin(self, names):
+        with self._lock:
+            self._pins.update(names)
+
+    def _unpin(self, names):
+        with self._lock:
+            self._pins.subtract(names)
+            self._pins = +self._pins
+            self._evict_over_budget()
+
+    @staticmethod
+    def _stale(sh):
+        now = time.monotonic()
+        if now - sh.checked < Cfg.idx_reload_check_s:
+            return False
+        sh.checked = now
+        return current_version(collection_root(sh.name)) != sh.version
+
+    def _select(self, filters):
+        names = self.names()
+        want = (filters or {}).get("collection")
+        if want:
+            want = {want} if isinstance(want, str) else set(want)
+            names = [n for n in names if n in want]
+        return names
+
+    def _parts(self, names):
+        # Scopes over the budget are searched max_loaded shards at a time (loaded ones first), so only
+        # one part is held in memory; each part is pinned while it is searched.
+        loaded = set(self.loaded())
+        names = sorted(names, key=lambda n: n not in loaded)
+        return [names[s:s + self.max_loaded] for s in range(0, len(names), self.max_loaded)] or [names]
+
+    @staticmethod
+    def _sparse(sh, query, k, sel):
+        if not sh.retriever.bm25:
+            return []
+        with span("search_bm25"):
+            return sh.retriever.bm25.search(query, k, allow=sel[2] if sel else None)
+
+    def _jobs(self, names, filters):
+        # (shard, selector) for the selected shards that can match the filters at all.
+        with span("shard_load"):
+            shards = [s for s in _pool.map(self.shard, names) if s.retriever]
+        filt = norm_filters(filters)
+        jobs = []
+        for sh in shards:
+            sel = sh.retriever.meta().selector(filt)
+            if sel is None or sel[2]:
+                jobs.append((sh, sel))
+        return jobs
+
+    @staticmethod
+    def _hits(jobs, parts, sparse_parts, fetch):
+        # Best dense (doc, distance) and sparse (chunk id, score, docstore lookup) hits of one part.
+        # Keyword hits keep only their docstore, so an evicted shard's index can be freed before the merge.
+        ip = jobs[0][0].retriever.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        dense = sorted((h for p in parts for h in p), key=lambda h: h[1], reverse=ip)[:fetch]
+        if sparse_parts is None:
+            return ip, dense, None
+        sparse = [
+            (cid, score, sh.retriever.vector_store.docstore.search)
+            for (sh, _), hits in zip(jobs, sparse_parts)
+            for cid, score in hits
+        ]
+        return ip, dense, sorted(sparse, key=lambda h: h[1], reverse=True)[:fetch]
+
+    @staticmethod
+    def _merge(hits, k, fetch):
+        # Distances are comparable across shards (same embedding model and metric).
+        ip = hits[0][0]
+        dense = sorted((h for _, d, _ in hits for h in d), key=lambda h: h[1], reverse=ip)[:fetch]
+        if hits[0][2] is None:
+            return [d for d, _ in dense[:k]]
+        # BM25 scores use per-shard term statistics; close enough to rank the keyword list.
+        sparse = sorted((h for _, _, s in hits for h in s), key=lambda h: h[1], reverse=True)[:fetch]
+        lookup = {cid: search for cid, _, search in sparse}
+        with span("fuse"):
+            return fuse(dense, [(cid, score) for cid, score, _ in sparse], k, lambda cid: lookup[cid](cid))
+
+    def search(self, query, k, filters=None):
+        # Returns (docs, query vector) merged over the selected shards.
+        hybrid = Cfg.hyb_enabled
+        fetch = max(k, Cfg.hyb_fetch_k) if hybrid else k
+        qvec, hits = None, []
+        for names in self._parts(self._select(filters)):
+            self._pin(names)
+            try:
+                jobs = self._jobs(names, filters)
+                # Keyword search needs no vector, so it runs while the query is being embedded.
+                sparse_fs = [_pool.submit(self._sparse, sh, query, fetch, sel) for sh, sel in jobs] if hybrid else []
+                if qvec is None:
+                    qvec = self.hf.embed_query(query)
+                if jobs:
+                    with span("search_faiss"):
+                        parts = list(_pool.map(lambda j: j[0].retriever.search_by_vector(qvec, fetch, j[1]), jobs))
+                    sparse = [f.result() for f in sparse_fs] if hybrid else None
+                    hits.append(self._hits(jobs, parts, sparse, fetch))
+            finally:
+                self._unpin(names)
+        return (self._merge(hits, k, fetch) if hits else []), qvec
+
+    def embed_queries(self, queries):
+        return self.hf.embed_documents(list(queries))
+
+    def search_batch(self, queries, qvecs, k, filters=None):
+        # Same as search() for many queries: each shard gets one FAISS call over the whole query matrix.
+        hybrid = Cfg.hyb_enabled
+        fetch = max(k, Cfg.hyb_fetch_k) if hybrid else k
+        hits = [[] for _ in queries]
+        for names in self._parts(self._select(filters)):
+            self._pin(names)
+            try:
+                jobs = self._jobs(names, filters)
+                if not jobs:
+                    continue
+                with span("search_faiss"):
+                    per_shard = list(_pool.map(lambda j: j[0].retriever.search_by_vectors(qvecs, fetch, j[1]), jobs))
+                for qi, query in enumerate(queries):
+                    sparse = [self._sparse(sh, query, fetch, sel) for sh, sel in jobs] if hybrid else None
+                    hits[qi].append(self._hits(jobs, [p[qi] for p in per_shard], sparse, fetch))
+            finally:
+                self._unpin(names)
+        return [self._merge(h, k, fetch) if h else [] for h in hits]
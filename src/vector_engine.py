@@ -1,76 +1,695 @@
 # VecEng: embedding adapter and FAISS index create/load.
+import hashlib
+import itertools
+import json
 import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from typing import List
 
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from huggingface_hub import InferenceClient
 
+from src.answer_cache import invalidate_ans_cache
+from src.bm25 import BM25Idx
 from src.config import Cfg
+from src.dedup import ChunkDedup
+from src.doc_store import SqliteDocstore
+from src.emb_cache import get_emb_cache
+from src.index_factory import (
+    build_index, exact_vectors, is_sq, recall_report, remove_rows, resolve_kind, supports_remove, tune_index,
+)
+from src.local_embed import get_local_embedder
+from src.metrics import inc, span, timed
+from src.retriever import MetaIdx
+
+class EmbeddingBatchError(RuntimeError):
+    def __init__(self, failed):
+        # failed: (start, end, error) ranges of the input that could not be embedded.
+        self.failed = failed
+        n = sum(e - s for s, e, _ in failed)
+        detail = "; ".join(f"[{s}:{e}] {err}" for s, e, err in failed[:5])
+        super().__init__(f"{len(failed)} embedding batch(es) failed ({n} texts): {detail}")
 
 class ManualHFEmbeddings(Embeddings):
     def __init__(self):
         # Read token from env so local dev and deployment use the same mechanism.
         self.api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
         self.client = InferenceClient(api_key=self.api_token) if self.api_token else None
+        self.local = get_local_embedder() if Cfg.emb_backend in ("local", "auto") else None
+        self.backend = "local" if self.local else "api"
+        # Quantized local vectors differ slightly from hosted ones, so cache them separately.
+        self.cache_key = f"{Cfg.mdl_nm}#{Cfg.emb_onnx_file}" if self.local else Cfg.mdl_nm
+        self.cache = get_emb_cache()
+        # Last embed_documents throughput in chunks/sec.
+        self.last_rate = 0.0
 
     # Implement __call__ so FAISS can treat the embedding object like a function.
     def __call__(self, text: str) -> List[float]:
         return self.embed_query(text)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return self._call_api(texts)
+        if not texts:
+            return []
+        out = self.cache.get_many(self.cache_key, texts) if self.cache else [None] * len(texts)
+        miss = [i for i, v in enumerate(out) if v is None]
+        inc("emb_cache_hits", len(texts) - len(miss))
+        if miss:
+            inc("emb_cache_misses", len(miss))
+            fresh = self._embed_batched([texts[i] for i in miss])
+            for i, v in zip(miss, fresh):
+                out[i] = v
+        return out
 
     def embed_query(self, text: str) -> List[float]:
-        result = self._call_api([text])
+        with span("embed_query"):
+            result = self._embed_cached([text])
         if isinstance(result, list) and len(result) > 0:
             return result[0]
         return []
 
+    def _embed_cached(self, texts):
+        if not self.cache or not texts:
+            return self._call_api(texts)
+        # Serve repeats from disk and only send cache misses to the API.
+        out = self.cache.get_many(self.cache_key, texts)
+        miss = [i for i, v in enumerate(out) if v is None]
+        inc("emb_cache_hits", len(texts) - len(miss))
+        if miss:
+            inc("emb_cache_misses", len(miss))
+            miss_txt = [texts[i] for i in miss]
+            fresh = self._call_api(miss_txt)
+            self.cache.put_many(self.cache_key, miss_txt, fresh)
+            for i, v in zip(miss, fresh):
+                out[i] = v
+        return out
+
+    def _embed_batched(self, texts):
+        # Split into fixed-size batches and fan them out over a bounded worker pool.
+        bs = max(1, Cfg.emb_batch_sz)
+        batches = [(s, texts[s:s + bs]) for s in range(0, len(texts), bs)]
+        out = [None] * len(texts)
+        failed = []
+        t0 = time.perf_counter()
+        # The local runtime parallelises inside ONNX (Cfg.emb_threads), so it gets one worker.
+        workers = 1 if self.local else max(1, min(Cfg.emb_workers, len(batches)))
+        with span("embed_docs"), ThreadPoolExecutor(max_workers=workers) as pool:
+            futs = {pool.submit(self._embed_batch_retry, b): (s, b) for s, b in batches}
+            for fut in as_completed(futs):
+                s, b = futs[fut]
+                try:
+                    vecs = fut.result()
+                except Exception as e:
+                    failed.append((s, s + len(b), e))
+                    continue
+                out[s:s + len(b)] = vecs
+                if self.cache:
+                    # Cache per batch so a retried build reuses everything that succeeded.
+                    self.cache.put_many(self.cache_key, b, vecs)
+
+        done = len(texts) - sum(e - s for s, e, _ in failed)
+        dt = max(time.perf_counter() - t0, 1e-9)
+        self.last_rate = done / dt
+        print(f"Embedded {done}/{len(texts)} chunks in {dt:.2f}s ({self.last_rate:.1f} chunks/sec, {workers} workers)")
+        if failed:
+            raise EmbeddingBatchError(sorted(failed, key=lambda f: f[0]))
+        return out
+
+    def _embed_batch_retry(self, batch):
+        backoff = 1.0
+        for attempt in range(1, Cfg.emb_retries + 1):
+            try:
+                return self._request(batch)
+            except Exception:
+                if attempt == Cfg.emb_retries:
+                    raise
+                inc("emb_retries")
+                time.sleep(backoff)
+                backoff *= 2
+
+    @timed("embed_request")
+    def _request(self, texts):
+        # Strict call: raises instead of substituting zero vectors.
+        if self.local:
+            return self.local.embed(texts)
+        if not self.api_token:
+            raise RuntimeError("Missing HUGGINGFACEHUB_API_TOKEN")
+        if not self.client:
+            raise RuntimeError("Missing InferenceClient")
+
+        payload = texts if len(texts) > 1 else texts[0]
+        data = np.asarray(self.client.feature_extraction(payload, model=Cfg.mdl_nm), dtype=np.float32)
+        if data.ndim == 1:
+            data = data[None, :]
+        if data.ndim != 2 or data.shape[0] != len(texts):
+            raise RuntimeError(f"Unexpected embedding shape {data.shape} for {len(texts)} texts")
+        return data.tolist()
+
     def _call_api(self, texts):
         try:
             if not texts:
                 return []
+            if self.local:
+                with span("embed_request"):
+                    return self.local.embed(texts)
             if not self.api_token:
+                inc("emb_zero_fallback", len(texts))
                 # Return zero vectors so the pipeline doesn't crash in demo mode.
                 print("Embedding API Error: Missing HUGGINGFACEHUB_API_TOKEN")
                 return [[0.0] * 384 for _ in texts]
             if not self.client:
+                inc("emb_zero_fallback", len(texts))
                 # Same fallback to keep the UI responsive even if HF client fails.
                 print("Embedding API Error: Missing InferenceClient")
                 return [[0.0] * 384 for _ in texts]
-
-            payload = texts if len(texts) > 1 else texts[0]
-            data = self.client.feature_extraction(payload, model=Cfg.mdl_nm)
-
-            if isinstance(data, list) and data and isinstance(data[0], list):
-                return data
-            if isinstance(data, list):
-                return [data]
-            # Final fallback: ensure downstream FAISS always receives a vector list.
-            return [[0.0] * 384 for _ in texts]
+            return self._request(texts)
         except Exception as e:
-            # Fail gracefully so indexing does not take down the whole app.
+            inc("emb_zero_fallback", len(texts))
+            # Fail gracefully so a query does not take down the whole app.
             print(f"Embedding Connection Error: {str(e)}")
             return [[0.0] * 384 for _ in texts]
 
+def chunk_id(doc):
+    # Content hash doubles as the docstore id, so unchanged chunks keep their vectors.
+    src = str(doc.metadata.get("source", ""))
+    return hashlib.sha256(f"{src}\0{doc.page_content}".encode("utf-8")).hexdigest()
+
+def file_hash(src, docs):
+    # Hash the file bytes when available; fall back to the chunk text otherwise.
+    h = hashlib.sha256()
+    if src and os.path.isfile(src):
+        with open(src, "rb") as f:
+            for blk in iter(lambda: f.read(1 << 20), b""):
+                h.update(blk)
+    else:
+        for d in docs:
+            h.update(d.page_content.encode("utf-8"))
+    return h.hexdigest()
+
+def collection_root(collection=None):
+    # Each collection (shard) is a self-contained index root with its own versions and CURRENT.
+    return os.path.join(Cfg.idx_path, "collections", collection) if collection else Cfg.idx_path
+
+def current_version(root=None):
+    # Name of the live index version, or None for the flat (pre-versioning) layout.
+    try:
+        with open(os.path.join(root or Cfg.idx_path, Cfg.idx_current_file), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def version_dir(version, root=None):
+    root = root or Cfg.idx_path
+    return os.path.join(root, "versions", version) if version else root
+
+@contextmanager
+def _build_lock(root):
+    # One builder at a time per index root across processes (Streamlit, API workers, scripts).
+    os.makedirs(root, exist_ok=True)
+    fd = os.open(os.path.join(root, ".build.lock"), os.O_CREAT | os.O_RDWR)
+    try:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError("Another re-index is already running.")
+        yield
+    finally:
+        os.close(fd)
+
 class VecEng:
-    def __init__(self):
+    def __init__(self, progress=None, collection=None):
         self.hf = ManualHFEmbeddings()
+        # None = the single index in idx_path; otherwise one shard under idx_path/collections/.
+        self.collection = collection
+        self.root = collection_root(collection)
         self.vector_store = None
+        self.bm25 = None
+        # Filter index (retriever.MetaIdx) of the loaded version.
+        self.meta = None
+        self.last_stats = {}
+        # Version loaded/built last, and the directory its files live in.
+        self.version = None
+        self.dir = self.root
+        # Optional callback taking a dict of progress fields (phase, files_done, chunks).
+        self.progress = progress
+        # Float32 vectors of a quantized index (memory-mapped, index row order), used for re-scoring.
+        self.exact = None
+        # While building: all vectors (full build), or the source version's copy plus new vectors (incremental).
+        self._exact_full = None
+        self._exact_old = None
+        self._exact_new = {}
+
+    def _report(self, **kw):
+        if self.progress:
+            self.progress(kw)
+
+    @timed("index_update")
+    def crt_idx(self, chunks, full=False, paths=None):
+        # Builds into a fresh versions/<v>.building dir and publishes it by swapping CURRENT,
+        # so the live index is never written in place; readers move over on their next query.
+        # With paths, chunks is a parser (DocProc.iter_frags) called only for files that changed.
+        with _build_lock(self.root):
+            src_dir = version_dir(current_version(self.root), self.root)
+            vroot = os.path.join(self.root, "versions")
+            if os.path.isdir(vroot):
+                # Leftovers of a build that crashed; the lock says no build is running now.
+                for n in os.listdir(vroot):
+                    if n.endswith(".building"):
+                        shutil.rmtree(os.path.join(vroot, n), ignore_errors=True)
+            ver = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1e6) % 1000000:06d}"
+            self.dir = os.path.join(vroot, ver + ".building")
+            os.makedirs(self.dir)
+            try:
+                changed = self._build(chunks, full, src_dir, paths)
+            except BaseException:
+                shutil.rmtree(self.dir, ignore_errors=True)
+                raise
+            finally:
+                if self.vector_store is not None:
+                    self.vector_store.docstore.close()
+            if changed:
+                self._report(phase="publishing")
+                self._publish(ver)
+            else:
+                shutil.rmtree(self.dir, ignore_errors=True)
+        # Serve from the published files (memory-mapped, read-only) like every other reader.
+        return self.ld_idx()
+
+    def drop(self):
+        # Unpublish this index (a collection left without files); readers let go on their next check.
+        with _build_lock(self.root):
+            cur = os.path.join(self.root, Cfg.idx_current_file)
+            if os.path.exists(cur):
+                os.remove(cur)
+                invalidate_ans_cache()
+            shutil.rmtree(os.path.join(self.root, "versions"), ignore_errors=True)
+
+    def _publish(self, ver):
+        final = os.path.join(self.root, "versions", ver)
+        os.replace(self.dir, final)
+        self.dir = final
+        cur = os.path.join(self.root, Cfg.idx_current_file)
+        with open(cur + ".tmp", "w", encoding="utf-8") as f:
+            f.write(ver)
+            f.flush()
+            os.fsync(f.fileno())
+        # The pointer swap is the commit point: a crash before it leaves the old index live.
+        os.replace(cur + ".tmp", cur)
+        self.version = ver
+        invalidate_ans_cache()
+        # Older versions go, keeping a few so in-flight readers and rollbacks still have theirs.
+        vroot = os.path.dirname(final)
+        done = sorted(n for n in os.listdir(vroot) if not n.endswith(".building"))
+        for n in done[:-max(1, Cfg.idx_keep_versions)]:
+            if n != ver:
+                shutil.rmtree(os.path.join(vroot, n), ignore_errors=True)
+
+    def _build(self, chunks, full, src_dir, paths=None):
+        # Re-embed only chunks whose content hash is not already in the index.
+        # chunks can be a list or a generator (DocProc.iter_frags); it is consumed once, file by file.
+        man = {} if full else self._ld_manifest(src_dir)
+        # Writable copy of the live index inside the new version dir.
+        vs = self._ld_writable(src_dir) if man else None
+        if (
+            vs is None
+            or man.get("model") != Cfg.mdl_nm
+            or man.get("split") != [Cfg.ch_sz, Cfg.ch_ol]
+            or man.get("idx_type") != Cfg.idx_type
+            or man.get("quant", "none") != Cfg.idx_quant
+            # A quantized index can only be updated if its float32 copy is there to carry over.
+            or (is_sq(vs.index) and self._exact_old is None)
+        ):
+            if vs is not None:
+                vs.docstore.close()
+            self._full_idx(chunks(paths) if paths is not None else chunks)
+            return True
+
+        hashes = {}
+        if paths is not None:
+            chunks = self._replay_unchanged(chunks, paths, man, vs, hashes)
 
-    def crt_idx(self, chunks):
-        # Build a fresh index when the admin re-ingests documents.
-        self.vector_store = FAISS.from_documents(chunks, self.hf)
-        self.vector_store.save_local(Cfg.idx_path)
+        dd = ChunkDedup() if Cfg.dedup_enabled else None
+        if dd:
+            chunks = dd.filter(chunks, chunk_id)
+        existing = set(vs.index_to_docstore_id.values())
+        files = {}
+        keep = set()
+        bm25 = BM25Idx()
+        pend_ids, pend_docs = [], []
+        added = 0
+        for src, docs in self._iter_groups(chunks):
+            ids = []
+            for d in docs:
+                cid = chunk_id(d)
+                if cid in keep:
+                    continue
+                keep.add(cid)
+                ids.append(cid)
+                bm25.add(cid, d.page_content)
+                if cid not in existing:
+                    pend_ids.append(cid)
+                    pend_docs.append(d)
+            entry = files.setdefault(src, {"hash": hashes.get(src) or file_hash(src, docs), "chunks": []})
+            entry["chunks"].extend(ids)
+            self._report(phase="ingesting", files_done=len(files), chunks=len(keep))
+            if len(pend_docs) >= Cfg.ing_flush:
+                # Embed while later files are still being parsed.
+                added += self._add_docs(vs, pend_ids, pend_docs)
+                pend_ids, pend_docs = [], []
+        if pend_docs:
+            added += self._add_docs(vs, pend_ids, pend_docs)
+        # Before any compaction below, so replayed chunks carry their provenance.
+        prov = dd.apply(vs.docstore) if dd else 0
+        if dd:
+            dd.mark_files(files)
+
+        stale = [i for i in existing if i not in keep]
+        self.last_stats = {
+            "full": False,
+            "chunks": len(keep),
+            "added": added,
+            "removed": len(stale),
+            "kept": len(keep) - added,
+        }
+        if (stale and not supports_remove(vs.index)) or resolve_kind(len(keep)) != man.get("kind"):
+            # Kind changed (auto threshold crossed) or the index can't drop vectors: retrain on the
+            # vectors already stored; only the chunks added above were embedded.
+            self._retrain(vs, keep, stale, bm25, files)
+            if dd:
+                self.last_stats["dedup"] = dd.report()
+            return True
+        if stale:
+            self._remove(vs, stale)
+
+        if dd:
+            self.last_stats["dedup"] = dd.report()
+        print(f"Incremental index: +{added} / -{len(stale)} chunks, {self.last_stats['kept']} unchanged")
+        self.vector_store = vs
+        if not (added or stale or prov) and os.path.exists(os.path.join(src_dir, Cfg.idx_bm25_file)):
+            # Nothing to publish; the live version stays.
+            return False
+        self._report(phase="saving")
+        self._sv_idx(vs)
+        bm25.save(self._fp(Cfg.idx_bm25_file))
+        self.bm25 = bm25
+        self._sv_manifest(files, man["kind"])
+        return True
+
+    def _ld_writable(self, src_dir):
+        # Vectors read into RAM (a memory-mapped index is read-only and cannot take new vectors);
+        # the chunk store is copied so the live version's files are never modified.
+        vec_fp, ids_fp, db_fp = (os.path.join(src_dir, n) for n in (Cfg.idx_vec_file, Cfg.idx_ids_file, Cfg.idx_docs_db))
+        if not all(os.path.exists(fp) for fp in (vec_fp, ids_fp, db_fp)):
+            return None
+        shutil.copyfile(db_fp, self._fp(Cfg.idx_docs_db))
+        vs = self._ld_files(vec_fp, ids_fp, self._fp(Cfg.idx_docs_db), mmap=False)
+        exact_fp = os.path.join(src_dir, Cfg.idx_exact_file)
+        if os.path.exists(exact_fp):
+            # Row positions shift on delete, so old rows are looked up by chunk id when saving.
+            pos = {cid: p for p, cid in vs.index_to_docstore_id.items()}
+            self._exact_old = (np.load(exact_fp, mmap_mode="r"), pos)
+        return vs
+
+    def _add_docs(self, vs, ids, docs):
+        texts = [d.page_content for d in docs]
+        vecs = self.hf.embed_documents(texts)
+        vs.add_embeddings(zip(texts, vecs), metadatas=[d.metadata for d in docs], ids=ids)
+        if is_sq(vs.index):
+            self._exact_new.update(zip(ids, vecs))
+        return len(ids)
+
+    @staticmethod
+    def _remove(vs, stale):
+        # FAISS.delete without its id bookkeeping: remove_rows keeps IVF ids in step with the compacted list.
+        pos = {cid: p for p, cid in vs.index_to_docstore_id.items()}
+        gone = {pos[cid] for cid in stale}
+        remove_rows(vs.index, gone)
+        vs.docstore.delete(stale)
+        vs.index_to_docstore_id = dict(enumerate(c for p, c in sorted(vs.index_to_docstore_id.items()) if p not in gone))
+
+    def _stored_vecs(self, vs, ids):
+        # Float32 vectors of ids without calling the embedding model: the float32 copy of a quantized
+        # index, or the index's own rows. None when it only has lossy codes (IVF-PQ).
+        if is_sq(vs.index):
+            old, pos = self._exact_old
+            return np.asarray(
+                [self._exact_new[c] if c in self._exact_new else old[pos[c]] for c in ids], dtype=np.float32
+            )
+        pos = {cid: p for p, cid in vs.index_to_docstore_id.items()}
+        return exact_vectors(vs.index, [pos[c] for c in ids])
+
+    def _retrain(self, vs, keep, stale, bm25, files):
+        ids = [c for _, c in sorted(vs.index_to_docstore_id.items()) if c in keep]
+        vecs = self._stored_vecs(vs, ids)
+        store = vs.docstore
+        if vecs is None:
+            # PQ codes can't be turned back into the original vectors: re-embed from the docstore
+            # (the embedding cache serves what it still holds).
+            print(f"Rebuilding {len(ids)} chunks from text: the index keeps no exact vectors.")
+            self._full_idx(self._iter_store(vs, keep), dedup=False)
+            store.close()
+            return
+        store.delete(stale)
+        report = self._train_save(vecs, ids, store, bm25, files)
+        self.last_stats.update(rebuilt=True, recall=report)
+        print(
+            f"Index retrained on stored vectors: +{self.last_stats['added']} / -{len(stale)} chunks, "
+            f"{self.last_stats['kept']} unchanged"
+        )
+
+    @staticmethod
+    def _replay_unchanged(parse, paths, man, vs, hashes):
+        # Files whose bytes still match the live manifest are not parsed: their chunks come back
+        # from the docstore, first, so dedup keeps them as before and checks new chunks against them.
+        # Files that lost chunks to dedup ("dups") are parsed again, the dropped copies aren't stored.
+        old = man.get("files", {})
+        same, todo = [], []
+        for fp in paths:
+            hashes[fp] = file_hash(fp, ())
+            e = old.get(fp)
+            (same if e and e.get("hash") == hashes[fp] and not e.get("dups") else todo).append(fp)
+        print(f"Unchanged files: {len(same)} of {len(paths)} (not parsed)")
+        for fp in same:
+            ids = old[fp]["chunks"]
+            for s in range(0, len(ids), 1000):
+                yield from (d for d in vs.docstore.search_many(ids[s:s + 1000]) if d is not None)
+        yield from parse(todo)
+
+    @staticmethod
+    def _iter_store(vs, keep, batch=1000):
+        # Replay live chunks from the SQLite docstore in index order.
+        ids = [i for _, i in sorted(vs.index_to_docstore_id.items()) if i in keep]
+        for s in range(0, len(ids), batch):
+            for d in vs.docstore.search_many(ids[s:s + batch]):
+                if d is not None:
+                    yield d
+
+    @timed("index_build")
+    def _full_idx(self, chunks, dedup=True):
+        # Build a fresh index when no usable manifest exists (first run, model/splitter change, forced).
+        # Chunks stream straight into a new SQLite docstore; only the vectors are held in memory.
+        os.makedirs(self.dir, exist_ok=True)
+        dd = ChunkDedup() if dedup and Cfg.dedup_enabled else None
+        if dd:
+            chunks = dd.filter(chunks, chunk_id)
+        db_tmp = self._fp(Cfg.idx_docs_db) + ".tmp"
+        for fp in (db_tmp, db_tmp + "-journal"):
+            if os.path.exists(fp):
+                os.remove(fp)
+        store = SqliteDocstore(db_tmp)
+        bm25 = BM25Idx()
+        files, seen, ids, parts, pend = {}, set(), [], [], []
+        for src, grp in self._iter_groups(chunks):
+            f_ids = []
+            for d in grp:
+                cid = chunk_id(d)
+                if cid in seen:
+                    continue
+                seen.add(cid)
+                f_ids.append(cid)
+                ids.append(cid)
+                pend.append((cid, d))
+                bm25.add(cid, d.page_content)
+            entry = files.setdefault(src, {"hash": file_hash(src, grp), "chunks": []})
+            entry["chunks"].extend(f_ids)
+            self._report(phase="ingesting", files_done=len(files), chunks=len(ids))
+            if len(pend) >= Cfg.ing_flush:
+                parts.append(self._embed_to_store(store, pend))
+                pend = []
+        if pend:
+            parts.append(self._embed_to_store(store, pend))
+        if not ids:
+            store.close()
+            raise ValueError("No chunks to index.")
+        if dd:
+            dd.apply(store)
+            dd.mark_files(files)
+
+        report = self._train_save(np.vstack(parts), ids, store, bm25, files, db_tmp)
+        self.last_stats = {
+            "full": True, "chunks": len(ids), "added": len(ids), "removed": 0, "kept": 0, "recall": report,
+        }
+        if dd:
+            self.last_stats["dedup"] = dd.report()
         return self.vector_store
 
-    def ld_idx(self):
-        if os.path.exists(Cfg.idx_path):
+    def _train_save(self, vecs, ids, store, bm25, files, db_tmp=None):
+        # Train an index of the kind the vector count calls for, then write the whole version.
+        kind = resolve_kind(len(vecs))
+        self._report(phase="training", chunks=len(ids))
+        index = build_index(vecs, kind)
+        index.add(vecs)
+        self._exact_full = vecs if is_sq(index) else None
+        self.vector_store = FAISS(self.hf, index, store, dict(enumerate(ids)))
+        # Show what the approximate index costs in recall versus exact search.
+        report = recall_report(index, vecs, kind)
+        print(f"Index {kind}: recall@{report['k']} vs flat = {report['recall']}")
+        if "recall_rescored" in report:
+            print(f"Index {kind}/{report['quant']}: recall@{report['k']} with float32 re-scoring = {report['recall_rescored']}")
+        self._report(phase="saving")
+        self._sv_idx(self.vector_store, db_tmp)
+        bm25.save(self._fp(Cfg.idx_bm25_file))
+        self.bm25 = bm25
+        report["memory"] = self._mem_report(index, len(ids), vecs.shape[1])
+        with open(self._fp("recall_report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        self._sv_manifest(files, kind)
+        return report
+
+    def _embed_to_store(self, store, pend):
+        vecs = np.asarray(self.hf.embed_documents([d.page_content for _, d in pend]), dtype=np.float32)
+        store.add({cid: Document(id=cid, page_content=d.page_content, metadata=d.metadata) for cid, d in pend})
+        return vecs
+
+    @staticmethod
+    def _iter_groups(chunks):
+        # Consecutive chunks of one source form a group; a source seen twice is merged by the caller.
+        for src, grp in itertools.groupby(chunks, key=lambda d: str(d.metadata.get("source", ""))):
+            yield src, list(grp)
+
+    @staticmethod
+    def _ld_manifest(src_dir):
+        fp = os.path.join(src_dir, Cfg.idx_manifest)
+        if not os.path.exists(fp):
+            return {}
+        try:
+            with open(fp, "r", encoding="utf-8") as f:
+                man = json.load(f)
+            return man if isinstance(man, dict) and "files" in man else {}
+        except Exception:
+            # A corrupt manifest just means the next build is a full one.
+            return {}
+
+    def _sv_manifest(self, files, kind):
+        fp = self._fp(Cfg.idx_manifest)
+        tmp = fp + ".tmp"
+        man = {
+            "model": Cfg.mdl_nm,
+            "split": [Cfg.ch_sz, Cfg.ch_ol],
+            "idx_type": Cfg.idx_type,
+            "quant": Cfg.idx_quant,
+            "kind": kind,
+            "files": files,
+        }
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(man, f)
+        os.replace(tmp, fp)
+
+    def _fp(self, name):
+        return os.path.join(self.dir, name)
+
+    @timed("index_save")
+    def _sv_idx(self, vs, db_tmp=None):
+        # Vectors go to a plain FAISS file (mmap-able), ids to a text file, chunks to SQLite.
+        vec_fp, ids_fp, db_fp = self._fp(Cfg.idx_vec_file), self._fp(Cfg.idx_ids_file), self._fp(Cfg.idx_docs_db)
+        faiss.write_index(vs.index, vec_fp + ".tmp")
+        with open(ids_fp + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(vs.index_to_docstore_id[i] for i in range(len(vs.index_to_docstore_id))))
+        vs.docstore.commit()
+        if db_tmp:
+            vs.docstore.close()
+            os.replace(db_tmp, db_fp)
+            vs.docstore = SqliteDocstore(db_fp)
+        if is_sq(vs.index):
+            self._sv_exact(vs)
+        # Filters need every chunk's metadata; reading it here spares each reader doing so on load.
+        MetaIdx.build(vs).save(self._fp(Cfg.idx_meta_dir))
+        os.replace(vec_fp + ".tmp", vec_fp)
+        os.replace(ids_fp + ".tmp", ids_fp)
+
+    def _sv_exact(self, vs, block=65536):
+        # Float32 copy of every vector in index row order; written through a memmap, block by block.
+        fp = self._fp(Cfg.idx_exact_file)
+        n, d = vs.index.ntotal, vs.index.d
+        if self._exact_full is not None:
+            with open(fp + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(self._exact_full, dtype=np.float32))
+        else:
+            old, pos = self._exact_old if self._exact_old else (None, {})
+            out = np.lib.format.open_memmap(fp + ".tmp", mode="w+", dtype=np.float32, shape=(n, d))
+            for s in range(0, n, block):
+                cids = [vs.index_to_docstore_id[i] for i in range(s, min(n, s + block))]
+                src = np.asarray([pos.get(c, -1) for c in cids], dtype=np.int64)
+                have = src >= 0
+                if have.any():
+                    out[s:s + len(cids)][have] = old[src[have]]
+                for j in np.flatnonzero(~have).tolist():
+                    out[s + j] = self._exact_new[cids[j]]
+            out.flush()
+            del out
+        os.replace(fp + ".tmp", fp)
+
+    def _mem_report(self, index, n, d):
+        # Index size on disk (= resident size once loaded) versus plain float32 vectors.
+        size = os.path.getsize(self._fp(Cfg.idx_vec_file))
+        f32 = n * d * 4
+        return {
+            "index_mb": round(size / 2**20, 3),
+            "float32_mb": round(f32 / 2**20, 3),
+            "saved_pct": max(0.0, round(100.0 * (1 - size / f32), 1)) if f32 else 0.0,
+            "exact_copy_mb": round(f32 / 2**20, 3) if is_sq(index) else 0.0,
+        }
+
+    @timed("index_load")
+    def ld_idx(self, mmap=None):
+        # Loads the version CURRENT points at (or the flat layout of older installs).
+        mmap = Cfg.idx_mmap if mmap is None else mmap
+        self.version = current_version(self.root)
+        self.dir = version_dir(self.version, self.root)
+        vec_fp, ids_fp, db_fp = self._fp(Cfg.idx_vec_file), self._fp(Cfg.idx_ids_file), self._fp(Cfg.idx_docs_db)
+        if all(os.path.exists(fp) for fp in (vec_fp, ids_fp, db_fp)):
+            self.vector_store = self._ld_files(vec_fp, ids_fp, db_fp, mmap)
+            self.bm25 = BM25Idx.load(self._fp(Cfg.idx_bm25_file))
+            self.meta = MetaIdx.load(self._fp(Cfg.idx_meta_dir), self.vector_store)
+            exact_fp = self._fp(Cfg.idx_exact_file)
+            # Always mapped: re-scoring reads only the candidate rows.
+            self.exact = np.load(exact_fp, mmap_mode="r") if is_sq(self.vector_store.index) and os.path.exists(exact_fp) else None
+        elif self.collection is None and os.path.exists(os.path.join(Cfg.idx_path, "index.pkl")):
+            # Legacy pickle format; the next re-index rewrites it in the new layout.
             self.vector_store = FAISS.load_local(
                 Cfg.idx_path,
                 self.hf, 
                 # Local FAISS uses pickle; allow only because we own the index file.
                 allow_dangerous_deserialization=True
             )
-        return self.vector_store
\ No newline at end of file
+            tune_index(self.vector_store.index)
+        return self.vector_store
+
+    def _ld_files(self, vec_fp, ids_fp, db_fp, mmap):
+        # Mapped pages are shared by every process serving the same index file.
+        flags = (getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY) if mmap else 0
+        index = faiss.read_index(vec_fp, flags)
+        with open(ids_fp, "r", encoding="utf-8") as f:
+            ids = f.read().split("\n") if index.ntotal else []
+        return FAISS(self.hf, tune_index(index), SqliteDocstore(db_fp, read_only=mmap), dict(enumerate(ids)))
\ No newline at end of file
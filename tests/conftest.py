@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from src.config import Cfg
+from src.vector_engine import ManualHFEmbeddings
+
+DIM = 16
+
+def fake_vecs(texts):
+    # Deterministic per text, so a chunk's vector can be recomputed to check what a hit maps to.
+    return [
+        np.random.default_rng(int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)).standard_normal(DIM).tolist()
+        for t in texts
+    ]
+
+@pytest.fixture
+def calls():
+    return []
+
+@pytest.fixture
+def fake_embed(monkeypatch, calls):
+    # No network: embeddings are hash-seeded vectors; every embedded text is recorded in calls.
+    def embed(self, texts):
+        calls.extend(texts)
+        return fake_vecs(texts)
+    monkeypatch.setattr(ManualHFEmbeddings, "_request", embed)
+    monkeypatch.setattr(ManualHFEmbeddings, "_call_api", embed)
+
+@pytest.fixture
+def env(tmp_path, monkeypatch, fake_embed):
+    # Isolated data/index/cache paths and no model downloads.
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    for key, val in {
+        "d_path": str(raw),
+        "idx_path": str(tmp_path / "index"),
+        "emb_cache_path": str(tmp_path / "emb_cache"),
+        "chat_db_path": str(tmp_path / "chat.sqlite"),
+        "emb_backend": "api",
+        "emb_cache_max": 0,
+        "ans_cache_max": 0,
+        "rr_enabled": False,
+        "dedup_enabled": False,
+        "pack_use_tokenizer": False,
+        "ing_workers": 1,
+    }.items():
+        monkeypatch.setattr(Cfg, key, val)
+    return tmp_path
+
+def write_docs(raw, n_files, per_file, seed=0):
+    # One chunk per paragraph (each stays under Cfg.ch_sz); returns {filename: [paragraphs]}.
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(3000)]
+    docs = {}
+    for f in range(n_files):
+        name = f"bmw_doc_{f}.txt"
+        # 350-480 chars: two paragraphs never fit in one chunk.
+        paras = [" ".join(rng.choice(vocab, 120))[:400 + int(rng.integers(-50, 80))].strip() for _ in range(per_file)]
+        with open(os.path.join(raw, name), "w", encoding="utf-8") as fh:
+            fh.write("\n\n".join(paras))
+        docs[name] = paras
+    return docs
@@ -0,0 +1,12 @@
+from src.answer_cache import AnsCache
+
+def test_history_is_part_of_the_key():
+    c = AnsCache(threshold=0.95, ttl=60, max_items=10)
+    first = [{"role": "user", "content": "Tell me about the i4"}, {"role": "assistant", "content": "The i4 is ..."}]
+    c.put([1.0, 0.0], ["a", "b"], "i4 range", [], first)
+    assert c.get([1.0, 0.0], ["b", "a"], first) == ("i4 range", [])
+    # Same follow-up text and context, different conversation: no hit.
+    assert c.get([1.0, 0.0], ["a", "b"], [{"role": "user", "content": "Tell me about the iX"}]) is None
+    assert c.get([1.0, 0.0], ["a", "b"]) is None
+    c.put([1.0, 0.0], ["a", "b"], "standalone", [])
+    assert c.get([1.0, 0.0], ["a", "b"], None) == ("standalone", [])
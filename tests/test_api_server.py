@@ -0,0 +1,71 @@
+from starlette.requests import ClientDisconnect
+from starlette.testclient import TestClient
+
+from src import api_server
+from src.api_server import app
+from src.config import Cfg
+
+def test_bad_filters_get_400(env):
+    with TestClient(app) as client:
+        for filters in ({"page": "abc"}, "bmw_doc_0"):
+            r = client.post("/query", json={"query": "range", "filters": filters})
+            assert r.status_code == 400 and "error" in r.json()
+
+class _Job:
+    # Stand-in for IndexJob: records starts instead of building in a background thread.
+    def __init__(self):
+        self.started = []
+
+    def start(self, full, collections):
+        self.started.append(full)
+        return True
+
+    def snapshot(self):
+        return {"status": "running"}
+
+def test_reindex_needs_the_admin_token(env, monkeypatch):
+    job = _Job()
+    monkeypatch.setattr(api_server, "get_index_job", lambda: job)
+    with TestClient(app) as client:
+        monkeypatch.setattr(Cfg, "api_admin_token", "")
+        assert client.post("/reindex").status_code == 403
+        monkeypatch.setattr(Cfg, "api_admin_token", "s3cret")
+        assert client.post("/reindex").status_code == 401
+        assert client.post("/reindex", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert job.started == []
+        assert client.post("/reindex", headers={"Authorization": "Bearer s3cret"}).status_code == 202
+        assert job.started == [False]
+
+class _StreamBot:
+    async def astream(self, inp):
+        yield {"delta": "hi"}
+        yield {"result": "hi", "source_documents": [], "done": True}
+
+    async def aclose(self):
+        pass
+
+def test_stream_slot_is_freed_when_the_client_leaves_early(env, monkeypatch):
+    async def leave(message):
+        # Client gone before the response headers are out.
+        raise OSError("connection reset")
+
+    async def receive():
+        return {"type": "http.request", "body": b'{"query": "range"}', "more_body": False}
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/query/stream", "raw_path": b"/query/stream",
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8000),
+    }
+    with TestClient(app) as client:
+        monkeypatch.setattr(api_server._state, "bot", _StreamBot())
+        for _ in range(Cfg.api_max_inflight + 1):
+            try:
+                client.portal.call(app, scope, receive, leave)
+            except ClientDisconnect:
+                pass
+        assert api_server._state.inflight == 0
+        r = client.post("/query/stream", json={"query": "range"})
+        assert r.status_code == 200 and r.text.count("\n") == 2
+        assert api_server._state.inflight == 0
@@ -0,0 +1,27 @@
+import numpy as np
+
+from src.bm25 import BM25Idx
+
+ITEMS = [
+    ("a" * 64, "BMW X5 xDrive40i warranty covers the battery"),
+    ("b" * 64, "The M340i has a six cylinder engine"),
+    ("c" * 64, "Warranty terms for the iX and i4 battery"),
+    ("d" * 64, "Leasing offers in Munich"),
+]
+
+def test_search_ranks_and_filters():
+    idx = BM25Idx.build(ITEMS)
+    hits = idx.search("battery warranty", 3)
+    assert {cid for cid, _ in hits} == {"a" * 64, "c" * 64}
+    assert idx.search("m340i", 3)[0][0] == "b" * 64
+    assert idx.search("battery warranty", 3, allow={"c" * 64}) == [(c, s) for c, s in hits if c == "c" * 64]
+    assert idx.search("unknown words", 3) == []
+
+def test_saved_index_is_memory_mapped(tmp_path):
+    idx = BM25Idx.build(ITEMS)
+    want = idx.search("battery warranty munich", 4)
+    idx.save(str(tmp_path / "bm25"))
+    loaded = BM25Idx.load(str(tmp_path / "bm25"))
+    assert isinstance(loaded.arr["docs"], np.memmap)
+    assert loaded.search("battery warranty munich", 4) == want
+    assert BM25Idx.load(str(tmp_path / "missing")) is None
@@ -0,0 +1,178 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace as NS
+
+import pytest
+from langchain_core.documents import Document
+
+from src import answer_cache
+from src.bot_logic import RAGBot
+from src.config import Cfg
+from src.document_processor import DocProc
+from src.vector_engine import VecEng
+
+from conftest import write_docs
+
+class _SlowStream:
+    # First chunk never comes until the stream is closed, like a model stuck before its first token.
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.closed.wait(5)
+        raise ConnectionError("stream closed")
+
+class _Client:
+    def __init__(self, model_streams):
+        self.model_streams = model_streams
+        self.closed = False
+        self.chat = NS(completions=self)
+
+    def create(self, model, stream=False, **kw):
+        self.stream = self.model_streams[model]()
+        return self.stream
+
+    def close(self):
+        self.closed = True
+        if isinstance(self.stream, _SlowStream):
+            self.stream.closed.set()
+
+def test_hedge_closes_the_losing_stream(env, monkeypatch):
+    monkeypatch.setattr(Cfg, "hedge_enabled", True)
+    monkeypatch.setattr(Cfg, "hedge_default_s", 0.05)
+    monkeypatch.setattr(Cfg, "llm_model", "slow")
+    monkeypatch.setattr(Cfg, "llm_fallback_models", ("fast",))
+    bot = RAGBot(NS(index=NS(ntotal=0)))
+    monkeypatch.setattr(bot.health, "_m", {})
+    clients = []
+    streams = {"slow": _SlowStream, "fast": lambda: iter([NS(choices=[NS(delta=NS(content="hi"))])])}
+    monkeypatch.setattr(bot, "_call_client", lambda: clients.append(_Client(streams)) or clients[-1])
+
+    t0 = time.perf_counter()
+    chunks = list(bot._create_chat_completion("sys", [], "q", stream=True))
+    assert chunks[0].choices[0].delta.content == "hi"
+    assert time.perf_counter() - t0 < 1
+    slow, fast = clients
+    assert slow.closed and fast.closed
+    # The loser's thread returns and leaves a censored "at least this slow" sample, not a failure.
+    deadline = time.monotonic() + 2
+    while not bot.health._get("slow").lat and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(bot.health._get("slow").lat) == 1
+    assert bot.health._get("slow").fails == 0
+
+class _CountingClient:
+    def __init__(self):
+        self.calls = 0
+        self.chat = NS(completions=self)
+
+    def create(self, model, **kw):
+        self.calls += 1
+        return NS(choices=[NS(message=NS(content="The i4 has up to 590 km of range."))])
+
+def test_paraphrase_with_ui_history_hits_the_answer_cache(env, monkeypatch):
+    monkeypatch.setattr(Cfg, "ans_cache_max", 16)
+    monkeypatch.setattr(Cfg, "hedge_enabled", False)
+    monkeypatch.setattr(answer_cache, "_cache", None)
+    monkeypatch.setenv("HUGGINGFACEHUB_API_TOKEN", "x")
+    bot = RAGBot(NS(index=NS(ntotal=1)))
+    bot.client = _CountingClient()
+    docs = [Document(page_content="The BMW i4 eDrive40 reaches up to 590 km (WLTP).", metadata={"source": "i4.txt"})]
+    # Both wordings embed to the same vector and retrieve the same chunk.
+    monkeypatch.setattr(bot, "_retrieve", lambda query, filters=None: (docs, [1.0, 0.0]))
+    for q in ("What is the range of the i4?", "How far does the i4 go?"):
+        # The UI saves the question into the history before sending it.
+        res = bot.invoke({"query": q, "chat_history": [{"role": "user", "content": q}]})
+    assert res.get("cached") is True
+    assert bot.client.calls == 1
+
+class _Answer(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "hi"}}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+def test_hedge_loser_waiting_for_headers_times_out(env, monkeypatch):
+    # "slow" accepts the connection and never answers; "fast" is a real HTTP endpoint.
+    hung = socket.socket()
+    hung.bind(("127.0.0.1", 0))
+    hung.listen(4)
+    fast = ThreadingHTTPServer(("127.0.0.1", 0), _Answer)
+    threading.Thread(target=fast.serve_forever, daemon=True).start()
+    slow_url = f"http://127.0.0.1:{hung.getsockname()[1]}"
+    monkeypatch.setattr(Cfg, "hedge_enabled", True)
+    monkeypatch.setattr(Cfg, "hedge_default_s", 0.05)
+    monkeypatch.setattr(Cfg, "llm_timeout_s", 0.5)
+    monkeypatch.setattr(Cfg, "llm_model", slow_url)
+    monkeypatch.setattr(Cfg, "llm_fallback_models", (f"http://127.0.0.1:{fast.server_address[1]}",))
+    monkeypatch.setenv("HUGGINGFACEHUB_API_TOKEN", "x")
+    bot = RAGBot(NS(index=NS(ntotal=0)))
+    monkeypatch.setattr(bot.health, "_m", {})
+    try:
+        completion = bot._create_chat_completion("sys", [], "q")
+        assert completion.choices[0].message.content == "hi"
+        # The loser gives its pool thread back after llm_timeout_s, as a censored sample.
+        deadline = time.monotonic() + 3
+        while not bot.health._get(slow_url).lat and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert len(bot.health._get(slow_url).lat) == 1
+        assert bot.health._get(slow_url).fails == 0
+    finally:
+        fast.shutdown()
+        hung.close()
+
+def test_reload_closes_the_retired_chunk_store(env, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_reload_check_s", 0.0)
+    write_docs(env / "raw", n_files=2, per_file=3)
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags(), full=True)
+    bot = RAGBot(vs, bm25=ve.bm25, version=ve.version)
+    first = bot.retriever
+    cid = vs.index_to_docstore_id[0]
+
+    def publish(seed):
+        write_docs(env / "raw", n_files=2, per_file=3, seed=seed)
+        VecEng().crt_idx(DocProc().iter_frags(), full=True)
+        bot._maybe_reload()
+
+    with bot._using() as retriever:
+        # A query still running on the old version keeps its store open across the swap.
+        publish(1)
+        assert bot.retriever is not first
+        assert retriever.vector_store.docstore.search(cid).id == cid
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.vector_store.docstore.search(cid)
+    # Nobody on the version being replaced: closed at the swap.
+    second = bot.retriever
+    publish(2)
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.vector_store.docstore.search(cid)
+    assert bot._retrieve("anything")[0]
+
+def test_reload_clears_answers_of_the_old_version(env, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_reload_check_s", 0.0)
+    monkeypatch.setattr(Cfg, "ans_cache_max", 16)
+    monkeypatch.setattr(answer_cache, "_cache", None)
+    write_docs(env / "raw", n_files=2, per_file=3)
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags(), full=True)
+    bot = RAGBot(vs, bm25=ve.bm25, version=ve.version)
+    write_docs(env / "raw", n_files=2, per_file=3, seed=1)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+    # Cached after the publish, as in a process that didn't build the new version.
+    bot.ans_cache.put([1.0, 0.0], ["a"], "old answer", [])
+    bot._maybe_reload()
+    assert bot.ans_cache.get([1.0, 0.0], ["a"]) is None
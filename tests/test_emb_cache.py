@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+from src.emb_cache import EmbCache
+
+def test_two_instances_share_one_path(tmp_path):
+    # Two processes (or two caches in one) on the same directory must not hand out each other's vectors.
+    a = EmbCache(str(tmp_path), 100)
+    b = EmbCache(str(tmp_path), 100)
+    a.put_many("m", ["hello"], [[1.0, 2.0]])
+    b.put_many("m", ["world"], [[3.0, 4.0]])
+    assert a.get_many("m", ["hello", "world"]) == [[1.0, 2.0], [3.0, 4.0]]
+    assert b.get_many("m", ["hello", "world"]) == [[1.0, 2.0], [3.0, 4.0]]
+    # Reopening an existing cache keeps its entries.
+    c = EmbCache(str(tmp_path), 100)
+    assert c.get_many("m", ["hello"]) == [[1.0, 2.0]]
+
+def test_separate_process_sees_entries(tmp_path):
+    a = EmbCache(str(tmp_path), 100)
+    a.put_many("m", ["hello"], [[1.0, 2.0]])
+    code = (
+        "import sys; from src.emb_cache import EmbCache; c = EmbCache(sys.argv[1], 100); "
+        "assert c.get_many('m', ['hello']) == [[1.0, 2.0]]; c.put_many('m', ['world'], [[3.0, 4.0]])"
+    )
+    subprocess.run([sys.executable, "-c", code, str(tmp_path)], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert a.get_many("m", ["world", "hello"]) == [[3.0, 4.0], [1.0, 2.0]]
+
+def test_lru_eviction_and_zero_vectors(tmp_path):
+    c = EmbCache(str(tmp_path), 2)
+    c.put_many("m", ["a"], [[1.0]])
+    c.put_many("m", ["b"], [[2.0]])
+    c.get_many("m", ["a"])
+    c.put_many("m", ["c", "z"], [[3.0], [0.0]])
+    assert c.get_many("m", ["a", "b", "c", "z"]) == [[1.0], None, [3.0], None]
+    # Same text under another model is a different entry.
+    assert c.get_many("other", ["a"]) == [None]
+
+def test_cap_is_checked_without_counting_every_put(tmp_path):
+    c = EmbCache(str(tmp_path), 100)
+    counts = []
+    count = c._count
+    c._count = lambda: counts.append(1) or count()
+    for i in range(300):
+        c.put_many("m", [f"t{i}"], [[float(i + 1)]])
+    # One recount per 10 puts past the cap, each evicting back down to it.
+    assert len(counts) <= 20
+    assert c._count() <= 110
+    assert c.get_many("m", ["t299", "t0"]) == [[300.0], None]
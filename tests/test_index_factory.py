@@ -0,0 +1,26 @@
+import faiss
+import numpy as np
+
+from src.config import Cfg
+from src.index_factory import build_index, recall_report
+
+def _ivf(n, d=32):
+    vecs = np.random.default_rng(0).standard_normal((n, d)).astype(np.float32)
+    index = build_index(vecs, "ivf_flat")
+    index.add(vecs)
+    return index, vecs
+
+def test_nprobe_scales_with_nlist(monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_recall_queries", 100)
+    index, vecs = _ivf(20000)
+    ivf = faiss.extract_index_ivf(index)
+    assert ivf.nprobe == max(Cfg.idx_nprobe, ivf.nlist // Cfg.idx_nprobe_div) > Cfg.idx_nprobe
+    scaled = recall_report(index, vecs, "ivf_flat")["recall"]
+    ivf.nprobe = Cfg.idx_nprobe
+    assert scaled > recall_report(index, vecs, "ivf_flat")["recall"]
+
+def test_nprobe_floor_on_small_indexes():
+    index, _ = _ivf(2000)
+    ivf = faiss.extract_index_ivf(index)
+    # nlist // 16 is below FAISS_NPROBE here, which stays the minimum.
+    assert ivf.nprobe == min(ivf.nlist, Cfg.idx_nprobe)
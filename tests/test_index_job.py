@@ -0,0 +1,31 @@
+import json
+import os
+import threading
+import time
+
+from src.config import Cfg
+from src.document_processor import DocProc
+from src.index_job import IndexJob
+
+def test_workers_share_one_job(env, monkeypatch):
+    # Two IndexJobs stand in for two API workers on the same index path.
+    gate = threading.Event()
+    monkeypatch.setattr(DocProc, "ld_files", lambda self: gate.wait(5) and [])
+    a, b = IndexJob(), IndexJob()
+    assert a.start()
+    try:
+        assert not b.start()
+        assert b.snapshot()["status"] == "running"
+    finally:
+        gate.set()
+    deadline = time.monotonic() + 5
+    while a.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert b.snapshot()["status"] == "error" and b.snapshot()["error"] == a.snapshot()["error"]
+    assert "No documents" in b.snapshot()["error"]
+
+def test_job_of_an_exited_process_is_not_reported_as_running(env):
+    os.makedirs(Cfg.idx_path, exist_ok=True)
+    with open(os.path.join(Cfg.idx_path, Cfg.idx_job_file), "w", encoding="utf-8") as f:
+        json.dump({"status": "running", "phase": "embedding"}, f)
+    assert IndexJob().snapshot()["status"] == "error"
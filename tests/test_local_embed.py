@@ -0,0 +1,18 @@
+from src import local_embed
+from src.config import Cfg
+from src.vector_engine import ManualHFEmbeddings
+
+def test_failed_local_backend_is_not_retried(monkeypatch):
+    tries = []
+    def broken():
+        tries.append(1)
+        raise RuntimeError("no onnxruntime")
+    monkeypatch.setattr(local_embed, "LocalEmbedder", broken)
+    monkeypatch.setattr(local_embed, "_local", None)
+    monkeypatch.setattr(local_embed, "_local_failed", False)
+    monkeypatch.setattr(Cfg, "emb_backend", "auto")
+    monkeypatch.setattr(Cfg, "emb_cache_max", 0)
+    # Every embedder built afterwards (per query, per shard) falls back to the API without reloading.
+    for _ in range(3):
+        assert ManualHFEmbeddings().backend == "api"
+    assert len(tries) == 1
@@ -0,0 +1,26 @@
+import time
+
+from langchain_core.documents import Document
+
+from src import prompt_pack
+from src.config import Cfg
+from src.prompt_pack import PromptPacker
+
+def test_tokenizer_failure_is_remembered(monkeypatch):
+    tries = []
+    def offline(*args, **kwargs):
+        tries.append(kwargs.get("local_files_only", False))
+        raise OSError("offline")
+    monkeypatch.setattr(prompt_pack, "hf_hub_download", offline)
+    monkeypatch.setattr(prompt_pack, "_toks", {})
+    monkeypatch.setattr(Cfg, "pack_use_tokenizer", True)
+
+    # Packing never waits for the download: the estimate is used meanwhile.
+    out = PromptPacker("org/model").pack("sys ", [Document(page_content="x" * 400)], [], "q")
+    assert out["tokens"]["context"] == 101
+    deadline = time.monotonic() + 5
+    while "org/model" not in prompt_pack._toks and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert prompt_pack._toks["org/model"] is None
+    PromptPacker("org/model").pack("sys ", [], [], "q")
+    assert tries == [True, False]
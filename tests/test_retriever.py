@@ -0,0 +1,23 @@
+import pytest
+from src.document_processor import DocProc
+from src.retriever import MetaIdx, norm_filters
+from src.vector_engine import VecEng
+
+from conftest import write_docs
+
+@pytest.mark.parametrize("filters", ["bmw", ["bmw"], {"page": "abc"}, {"page": [1, None]}, {"source": 3}])
+def test_malformed_filters_are_rejected(filters):
+    with pytest.raises(ValueError):
+        norm_filters(filters)
+
+def test_filter_index_is_saved_with_the_version(env):
+    write_docs(env / "raw", n_files=3, per_file=5)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+    ve = VecEng()
+    vs = ve.ld_idx()
+    assert ve.meta is not None
+    built = MetaIdx.build(vs)
+    for filt in ({"source": "bmw_doc_1"}, {"ftype": "txt", "source": ["doc_0", "doc_2"]}, {"page": 4}):
+        f = norm_filters(filt)
+        assert ve.meta.selector(f)[2] == built.selector(f)[2]
+    assert len(ve.meta.selector(norm_filters({"source": "bmw_doc_1"}))[2]) == 5
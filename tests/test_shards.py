@@ -0,0 +1,97 @@
+from types import SimpleNamespace as NS
+
+import faiss
+import pytest
+from langchain_core.documents import Document
+
+from src import shards
+from src.config import Cfg
+from src.shards import ShardedRetriever
+
+# Distance of each collection's one chunk to any query.
+_DIST = {"a": 0.3, "b": 0.9, "c": 0.1}
+
+class _FakeRetriever:
+    def __init__(self, name):
+        self.doc = Document(page_content=f"chunk of {name}", id=name)
+        self.vector_store = NS(index=NS(metric_type=faiss.METRIC_L2), docstore=NS(search=lambda cid: self.doc))
+        self.bm25 = None
+
+    def meta(self):
+        return NS(selector=lambda filt: None)
+
+    def search_by_vector(self, qvec, k, sel=None):
+        return [(self.doc, _DIST[self.doc.id])]
+
+    def search_by_vectors(self, qvecs, k, sel=None):
+        return [self.search_by_vector(q, k, sel) for q in qvecs]
+
+class _FakeShard:
+    version = "v1"
+
+    def __init__(self, name):
+        self.name = name
+        self.retriever = _FakeRetriever(name)
+
+@pytest.fixture
+def fake_shards(monkeypatch):
+    # Three built collections; shards load instantly and never go stale; CURRENT reads are counted.
+    reads = []
+    def built():
+        reads.append(1)
+        return ["a", "b", "c"]
+    monkeypatch.setattr(shards, "built_collections", built)
+    monkeypatch.setattr(shards, "_Shard", _FakeShard)
+    monkeypatch.setattr(ShardedRetriever, "_stale", staticmethod(lambda sh: False))
+    return reads
+
+def test_names_are_rechecked_at_most_every_reload_interval(fake_shards, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_reload_check_s", 60.0)
+    sr = ShardedRetriever(max_loaded=3)
+    for _ in range(5):
+        assert sr.names() == ["a", "b", "c"]
+    assert len(fake_shards) == 1
+    monkeypatch.setattr(Cfg, "idx_reload_check_s", 0.0)
+    sr.names()
+    assert len(fake_shards) == 2
+
+def test_shards_of_a_running_query_are_not_evicted(fake_shards):
+    sr = ShardedRetriever(max_loaded=2)
+    # Two queries in flight: one over a and b, one over c.
+    sr._pin(["a", "b"])
+    sr._pin(["c"])
+    for name in "abc":
+        sr.shard(name)
+    assert sr.loaded() == ["a", "b", "c"]
+    # Back within budget once the first query is done, dropping the least recently used.
+    sr._unpin(["a", "b"])
+    assert sr.loaded() == ["b", "c"]
+
+def test_scope_over_the_budget_is_searched_in_parts(fake_shards, fake_embed, monkeypatch):
+    sr = ShardedRetriever(max_loaded=2)
+    loaded = []
+    search = _FakeRetriever.search_by_vector
+    def record(self, qvec, k, sel=None):
+        loaded.append(len(sr.loaded()))
+        return search(self, qvec, k, sel)
+    monkeypatch.setattr(_FakeRetriever, "search_by_vector", record)
+    docs, _ = sr.search("q", 3)
+    # All three collections merged by distance, never more than two shards loaded.
+    assert [d.id for d in docs] == ["c", "a", "b"]
+    assert max(loaded) <= 2 and len(sr.loaded()) == 2
+    hits = sr.search_batch(["q1", "q2"], [[0.0], [0.0]], 2)
+    assert [[d.id for d in h] for h in hits] == [["c", "a"], ["c", "a"]]
+
+def test_new_shard_version_clears_the_answer_cache(fake_shards, monkeypatch):
+    cleared = []
+    monkeypatch.setattr(shards, "invalidate_ans_cache", lambda: cleared.append(1))
+    sr = ShardedRetriever(max_loaded=2)
+    sr.shard("a")
+    sr.evict("a")
+    sr.shard("a")
+    assert cleared == []
+    # Published elsewhere while evicted here: noticed when it is loaded again.
+    sr.evict("a")
+    monkeypatch.setattr(_FakeShard, "version", "v2")
+    sr.shard("a")
+    assert cleared == [1]
@@ -0,0 +1,108 @@
+import os
+
+import faiss
+import numpy as np
+
+from src.config import Cfg
+from src.document_processor import DocProc
+from src.vector_engine import VecEng
+
+from conftest import fake_vecs, write_docs
+
+def _top_hit(vs, text):
+    # Nearest chunk to the text's own vector: must be that chunk if rows and ids line up.
+    docs = vs.similarity_search_by_vector(fake_vecs([text])[0], k=1)
+    return docs[0].page_content if docs else None
+
+def test_ivf_delete_keeps_rows_and_ids_aligned(env, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_type", "ivf_flat")
+    docs = write_docs(env / "raw", n_files=4, per_file=30)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+
+    os.remove(env / "raw" / "bmw_doc_1.txt")
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags())
+    assert vs.index.ntotal == 90
+
+    kept = [p for name, paras in docs.items() if name != "bmw_doc_1.txt" for p in paras]
+    assert all(_top_hit(vs, p) == p for p in kept)
+    gone = set(docs["bmw_doc_1.txt"])
+    assert not any(_top_hit(vs, p) in gone for p in docs["bmw_doc_1.txt"])
+
+def test_flat_delete_in_place(env, calls):
+    write_docs(env / "raw", n_files=3, per_file=10)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+    calls.clear()
+
+    os.remove(env / "raw" / "bmw_doc_0.txt")
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags())
+    assert vs.index.ntotal == 20
+    assert calls == []
+    assert ve.last_stats["removed"] == 10
+    ids = [vs.index_to_docstore_id[i] for i in range(vs.index.ntotal)]
+    assert len(set(ids)) == 20
+    vecs = np.asarray(fake_vecs([vs.docstore.search(c).page_content for c in ids]), dtype=np.float32)
+    assert np.allclose(vs.index.reconstruct_n(0, 20), vecs)
+
+def _add_file(env, name, per_file=10):
+    # A new source file with paragraphs unlike the ones already indexed.
+    extra = env / "extra"
+    extra.mkdir(exist_ok=True)
+    paras = write_docs(extra, n_files=1, per_file=per_file, seed=len(os.listdir(env / "raw")) + 7)["bmw_doc_0.txt"]
+    os.replace(extra / "bmw_doc_0.txt", env / "raw" / name)
+    return paras
+
+def test_hnsw_delete_retrains_without_reembedding(env, calls, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_type", "hnsw")
+    docs = write_docs(env / "raw", n_files=3, per_file=10)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+    calls.clear()
+
+    os.remove(env / "raw" / "bmw_doc_0.txt")
+    new = _add_file(env, "bmw_doc_new.txt")
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags())
+    assert sorted(calls) == sorted(new)
+    assert ve.last_stats["rebuilt"] and ve.last_stats["removed"] == 10
+    kept = docs["bmw_doc_1.txt"] + docs["bmw_doc_2.txt"] + new
+    assert vs.index.ntotal == len(kept)
+    assert all(_top_hit(vs, p) == p for p in kept)
+
+def test_kind_change_embeds_only_added_chunks(env, calls, monkeypatch):
+    monkeypatch.setattr(Cfg, "idx_auto_flat_max", 50)
+    docs = write_docs(env / "raw", n_files=4, per_file=10)
+    VecEng().crt_idx(DocProc().iter_frags(), full=True)
+    calls.clear()
+
+    new = _add_file(env, "bmw_doc_new1.txt") + _add_file(env, "bmw_doc_new2.txt")
+    ve = VecEng()
+    vs = ve.crt_idx(DocProc().iter_frags())
+    assert sorted(calls) == sorted(new)
+    assert isinstance(faiss.downcast_index(vs.index), faiss.IndexIVFFlat)
+    assert vs.index.ntotal == 60
+    assert all(_top_hit(vs, p) == p for p in new + docs["bmw_doc_0.txt"])
+
+def test_unchanged_files_are_not_parsed(env, calls, monkeypatch):
+    import src.document_processor as dp_mod
+
+    monkeypatch.setattr(Cfg, "dedup_enabled", True)
+    docs = write_docs(env / "raw", n_files=3, per_file=10)
+    # A copy of one of bmw_doc_0's paragraphs: merged by dedup, so that file is always re-parsed.
+    with open(env / "raw" / "bmw_doc_2.txt", "a", encoding="utf-8") as f:
+        f.write("\n\n" + docs["bmw_doc_0.txt"][0])
+    dp = DocProc()
+    VecEng().crt_idx(dp.iter_frags, full=True, paths=dp.ld_files())
+    calls.clear()
+
+    parsed = []
+    load_split = dp_mod._load_split
+    monkeypatch.setattr(dp_mod, "_load_split", lambda fp: parsed.append(os.path.basename(fp)) or load_split(fp))
+    new = _add_file(env, "bmw_doc_new.txt")
+    ve = VecEng()
+    vs = ve.crt_idx(dp.iter_frags, paths=dp.ld_files())
+    assert sorted(parsed) == ["bmw_doc_2.txt", "bmw_doc_new.txt"]
+    assert sorted(calls) == sorted(new)
+    assert vs.index.ntotal == 40
+    assert ve.last_stats["dedup"]["exact"] == 1
+    assert all(_top_hit(vs, p) == p for paras in docs.values() for p in paras)